@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measure graph conversion, serialization and validation on synthetic graphs.
+
+Graphs are generated with a given number of model processes, ports per
+model, fan-in (sources per model input) and fan-out (consumers per model
+output).  Specs are served from memory, so no database is needed.  Each
+stage is timed separately:
+
+    fbp_to_cis   fbpToCis on the FBP graph
+    ui_to_cis    uiToCis on every spec
+    cis_to_ui    cisToUI on every yggrun model
+    yaml_dump    yaml.safe_dump of the converted graph
+    pyaml_dump   pyaml.dump of the converted graph
+    write_yaml   writing the YAML that validation reads and /graph/convert
+                 streams back
+    validate     validateCis of the converted graph
+
+Results are compared with the baseline file, and stages slower than the
+baseline by more than the threshold are flagged as regressions; the exit
+status is 1 if there are any, and 2 if there is no baseline.  Timings only
+compare on the same machine, so no baseline is kept in the repository: CI
+runs the benchmark of the commit a branch forked from with --save-baseline,
+then the benchmark of the branch against that baseline (see
+.circleci/config.yml).  Locally, save a baseline before making a change.
+Run from an environment where Girder and yggdrasil are installed:
+
+    python benchmarks/conversion_benchmark.py --save-baseline
+    python benchmarks/conversion_benchmark.py
+    python benchmarks/conversion_benchmark.py --processes 1000 --ports 4
+"""
+
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+
+import pyaml
+import yaml
+
+from import_benchmark import importPlugin, PLUGIN_DIR
+
+BASELINE_FILE = os.path.join(PLUGIN_DIR, 'benchmarks',
+                             'conversion_baseline.json')
+
+# (processes, ports, fan-in, fan-out) of the default cases
+CASES = (
+    (10, 2, 1, 1),
+    (100, 4, 2, 2),
+    (500, 8, 2, 4),
+)
+
+# Differences smaller than this many seconds are never regressions
+MIN_DIFFERENCE = 0.001
+
+
+def generateModels(processes, ports):
+    """Generate yggrun models, each with the given number of ports."""
+    return [{
+        'name': 'Model%d' % i,
+        'driver': 'PythonModelDriver',
+        'args': './src/model%d.py' % i,
+        'inputs': ['model%d_in%d' % (i, j) for j in range(ports)],
+        'outputs': ['model%d_out%d' % (i, j) for j in range(ports)],
+    } for i in range(processes)]
+
+
+def generateGraph(models, fanIn=1, fanOut=1):
+    """Generate an acyclic FBP graph connecting the given yggrun models.
+
+    Each model input is fed by up to fanIn outputs of earlier models, and
+    each model output feeds up to fanOut later inputs.  Inputs left without
+    a source read from a file, and outputs left without a consumer write to
+    one.
+    """
+    processes = {}
+    connections = []
+
+    def connect(src, srcPort, tgt, tgtPort):
+        connections.append({
+            'src': {'process': src, 'port': srcPort},
+            'tgt': {'process': tgt, 'port': tgtPort},
+            'metadata': {}
+        })
+
+    def filePort(component, name):
+        key = 'file_' + name
+        metadata = {'label': name, 'name': './%s.txt' % name, 'type': 'File'}
+        if component == 'inport':
+            metadata['read_meth'] = 'table'
+        else:
+            metadata['write_meth'] = 'table'
+        processes[key] = {'component': component, 'metadata': metadata}
+        return key
+
+    uses = collections.Counter()
+    available = collections.deque()
+    for i, model in enumerate(models):
+        key = 'p%d' % i
+        processes[key] = {'component': model['name'].lower(),
+                          'metadata': {'label': model['name']}}
+        for inport in model['inputs']:
+            reused = []
+            while available and len(reused) < fanIn:
+                source = available.popleft()
+                connect(source[0], source[1], key, inport)
+                uses[source] += 1
+                reused.append(source)
+            if not reused:
+                connect(filePort('inport', inport), 'value', key, inport)
+            available.extend(source for source in reused
+                             if uses[source] < fanOut)
+        available.extend((key, outport) for outport in model['outputs'])
+
+    for i, model in enumerate(models):
+        for outport in model['outputs']:
+            if uses[('p%d' % i, outport)] == 0:
+                connect('p%d' % i, outport, filePort('outport', outport),
+                        'value')
+
+    return {'processes': processes, 'connections': connections}
+
+
+def timeStage(func, repeat):
+    """Run func repeatedly and return the median and minimum seconds."""
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    times.sort()
+    return times[len(times) // 2], times[0]
+
+
+def runCase(utils, serialize, processes, ports, fanIn, fanOut, repeat,
+            validate):
+    """Time every stage on one synthetic graph.
+
+    Returns a dict mapping the stage names to their median seconds.
+    """
+    models = generateModels(processes, ports)
+    specs = dict((model['name'].lower(), utils.cisToUI(model))
+                 for model in models)
+    graph = generateGraph(models, fanIn, fanOut)
+    cisgraph = utils.fbpToCis(graph, loadSpec=specs.get)
+
+    def writeYaml():
+        with open(os.devnull, 'w') as f:
+            serialize.writeYaml(cisgraph, f)
+
+    stages = [
+        ('fbp_to_cis', lambda: utils.fbpToCis(graph, loadSpec=specs.get)),
+        ('ui_to_cis', lambda: [utils.uiToCis(spec['content'])
+                               for spec in specs.values()]),
+        ('cis_to_ui', lambda: [utils.cisToUI(model) for model in models]),
+        ('yaml_dump', lambda: yaml.safe_dump(cisgraph,
+                                             default_flow_style=False)),
+        ('pyaml_dump', lambda: pyaml.dump(cisgraph)),
+        ('write_yaml', writeYaml),
+    ]
+    if validate:
+        stages.append(('validate', lambda: utils.validateCis(cisgraph)))
+
+    print('%d processes, %d ports, fan-in %d, fan-out %d: %d connections'
+          % (processes, ports, fanIn, fanOut, len(graph['connections'])))
+    results = {}
+    for name, func in stages:
+        median, minimum = timeStage(func, repeat)
+        results[name] = median
+        print('  %-12s median %9.2f ms, min %9.2f ms'
+              % (name, median * 1000, minimum * 1000))
+    return results
+
+
+def caseName(processes, ports, fanIn, fanOut):
+    return 'p%d-ports%d-in%d-out%d' % (processes, ports, fanIn, fanOut)
+
+
+def findRegressions(results, baseline, threshold):
+    """Return (case, stage, baseline, result) for every regressed stage."""
+    regressions = []
+    for case, stages in sorted(results.items()):
+        for stage, seconds in sorted(stages.items()):
+            expected = baseline.get(case, {}).get(stage)
+            if expected is not None and \
+                    seconds > expected * (1 + threshold) and \
+                    seconds - expected > MIN_DIFFERENCE:
+                regressions.append((case, stage, expected, seconds))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--processes', type=int,
+                        help='number of model processes of a single case '
+                        'to run instead of the default cases')
+    parser.add_argument('--ports', type=int, default=4,
+                        help='number of inputs and of outputs per model')
+    parser.add_argument('--fan-in', type=int, default=2,
+                        help='maximum number of sources per model input')
+    parser.add_argument('--fan-out', type=int, default=2,
+                        help='maximum number of consumers per model output')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timed runs per stage')
+    parser.add_argument('--no-validate', action='store_true',
+                        help='skip schema validation')
+    parser.add_argument('--baseline', default=BASELINE_FILE,
+                        help='baseline results file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='slowdown relative to the baseline that is '
+                        'reported as a regression')
+    args = parser.parse_args()
+
+    from girder.constants import ROOT_DIR
+    for dependency in ('oauth', 'jobs'):
+        importPlugin(dependency, os.path.join(ROOT_DIR, 'plugins', dependency))
+    importPlugin('cis', PLUGIN_DIR)
+    from girder.plugins.cis import serialize, utils
+
+    if args.processes:
+        cases = [(args.processes, args.ports, args.fan_in, args.fan_out)]
+    else:
+        cases = CASES
+
+    results = {}
+    for case in cases:
+        results[caseName(*case)] = runCase(
+            utils, serialize, *case, repeat=args.repeat, validate=not args.no_validate)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('Baseline saved to %s' % args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        sys.stderr.write('No baseline at %s; run with --save-baseline to '
+                         'create one\n' % args.baseline)
+        return 2
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = findRegressions(results, baseline, args.threshold)
+    for case, stage, expected, seconds in regressions:
+        print('REGRESSION %s %s: %.2f ms, baseline %.2f ms (%+.0f%%)'
+              % (case, stage, seconds * 1000, expected * 1000,
+                 (seconds / expected - 1) * 100))
+    if not regressions:
+        print('No regressions against %s' % args.baseline)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measure how long it takes to import the cis plugin and its load() imports.
+
+Each sample imports the plugin the way Girder's plugin loader does, in a
+fresh interpreter so that nothing is already cached in sys.modules, then
+imports the modules that load() imports.  Girder calls load() right after
+the import, so moving an import into load() does not shorten startup, and
+the reported time includes both.  The rest of load() needs a database and
+the network, and is not timed.  The plugins cis depends on are imported
+before the clock starts.
+
+Run from an environment where Girder is installed:
+
+    python benchmarks/import_benchmark.py --runs 10
+"""
+
+import argparse
+import imp
+import importlib
+import os
+import subprocess
+import sys
+import time
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules imported by load(), relative to the plugin package
+LOAD_IMPORTS = ('rest.spec', 'rest.graph', 'rest.metrics', 'utils')
+
+
+def importPlugin(name, pluginDir):
+    """Import a plugin's server package as girder.plugins.<name>."""
+    import girder.plugins
+
+    moduleName = 'girder.plugins.' + name
+    fp, pathname, description = imp.find_module('server', [pluginDir])
+    try:
+        module = imp.load_module(moduleName, fp, pathname, description)
+    finally:
+        if fp:
+            fp.close()
+    setattr(girder.plugins, name, module)
+    return module
+
+
+def sample():
+    """Import the plugin once and print the elapsed seconds.
+
+    Prints the seconds to import the package, then the seconds to also
+    import the modules of load().
+    """
+    from girder.constants import ROOT_DIR
+
+    for dependency in ('oauth', 'jobs'):
+        importPlugin(dependency, os.path.join(ROOT_DIR, 'plugins', dependency))
+
+    start = time.time()
+    importPlugin('cis', PLUGIN_DIR)
+    imported = time.time()
+    for name in LOAD_IMPORTS:
+        importlib.import_module('girder.plugins.cis.' + name)
+    print('%f %f' % (imported - start, time.time() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='number of fresh interpreters to sample')
+    parser.add_argument('--sample', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.sample:
+        return sample()
+
+    samples = []
+    for i in range(args.runs):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--sample'])
+        samples.append([float(value) for value in
+                        output.strip().splitlines()[-1].split()])
+
+    for label, times in (('package import', [s[0] for s in samples]),
+                         ('import + load() imports', [s[1] for s in samples])):
+        times.sort()
+        print('%s: min %.1f ms, median %.1f ms, max %.1f ms (%d runs)'
+              % (label, times[0] * 1000, times[len(times) // 2] * 1000,
+                 times[-1] * 1000, len(times)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+import shutil
+import tempfile
+import time
+from tests import base
+
+
+def setUpModule():
+    base.enabledPlugins.append('cis')
+    base.startServer()
+
+
+def tearDownModule():
+    base.stopServer()
+
+
+class LocalExecutorTestCase(base.TestCase):
+
+    def setUp(self):
+        super(LocalExecutorTestCase, self).setUp()
+        from girder.plugins.cis.scheduler import scheduler
+        from girder.plugins.cis.constants import PluginSettings
+        self.scheduler = scheduler
+        self.scheduler.stop()
+
+        self.user = self.model('user').createUser(
+            email='joe@dev.null', login='joeregular', firstName='Joe',
+            lastName='Regular', password='secret')
+
+        self.workspaceRoot = tempfile.mkdtemp()
+        self.model('setting').set(PluginSettings.EXECUTOR, 'local')
+        self.model('setting').set(PluginSettings.LOCAL_WORKSPACE_ROOT,
+                                  self.workspaceRoot)
+
+    def testLocalExecution(self):
+        from girder.plugins.cis.utils import execGraph
+        from girder.plugins.jobs.constants import JobStatus
+
+        jobModel = self.model('job', 'jobs')
+        job = execGraph('models: []\n', self.user)
+        self.assertEqual(job['kwargs']['executor'], 'local')
+        workspace = job['kwargs']['workspace']
+
+        self.scheduler.dispatch()
+        self.assertTrue(os.path.isfile(os.path.join(workspace, 'graph.yml')))
+
+        for i in range(60):
+            self.scheduler.poll()
+            job = jobModel.load(job['_id'], force=True)
+            if job['status'] in (JobStatus.SUCCESS, JobStatus.ERROR):
+                break
+            time.sleep(1)
+        self.assertIn(job['status'], (JobStatus.SUCCESS, JobStatus.ERROR))
+
+        resp = self.request('/graph/execute/%s/logs' % job['_id'],
+                            user=self.user)
+        self.assertStatusOk(resp)
+
+        resp = self.request('/graph/execute/%s/outputs' % job['_id'],
+                            user=self.user)
+        self.assertStatusOk(resp)
+        paths = [output['path'] for output in resp.json]
+        self.assertIn('graph.yml', paths)
+
+        resp = self.request('/graph/execute/%s/outputs/download' % job['_id'],
+                            user=self.user, isJson=False,
+                            params={'path': 'graph.yml'},
+                            additionalHeaders=[('Range', 'bytes=0-5')])
+        self.assertStatus(resp, 206)
+        self.assertEqual(self.getBody(resp), 'models')
+
+        resp = self.request('/graph/execute/%s/outputs/download' % job['_id'],
+                            user=self.user, params={'path': '../graph.yml'})
+        self.assertStatus(resp, 404)
+
+        # Symbolic links never expose files of the host
+        secret = os.path.join(self.workspaceRoot, 'secret.cfg')
+        with open(secret, 'w') as f:
+            f.write('password = hunter2\n')
+        os.symlink(secret, os.path.join(workspace, 'leak.cfg'))
+        os.symlink(os.path.join(workspace, 'missing'),
+                   os.path.join(workspace, 'dangling'))
+        resp = self.request('/graph/execute/%s/outputs' % job['_id'],
+                            user=self.user)
+        self.assertStatusOk(resp)
+        paths = [output['path'] for output in resp.json]
+        self.assertIn('graph.yml', paths)
+        self.assertNotIn('leak.cfg', paths)
+        self.assertNotIn('dangling', paths)
+        resp = self.request('/graph/execute/%s/outputs/download' % job['_id'],
+                            user=self.user, params={'path': 'leak.cfg'})
+        self.assertStatus(resp, 404)
+
+        folder = self.model('folder').createFolder(
+            self.user, 'outputs', parentType='user', creator=self.user)
+        resp = self.request(
+            '/graph/execute/%s/outputs/import' % job['_id'], user=self.user,
+            method='POST', params={'folderId': str(folder['_id'])})
+        self.assertStatusOk(resp)
+        names = [f['name'] for f in resp.json]
+        self.assertIn('graph.yml', names)
+        self.assertNotIn('leak.cfg', names)
+
+        resp = self.request('/graph/execute', user=self.user)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['executions'][0]['jobId'], str(job['_id']))
+        self.assertIsNotNone(resp.json['executions'][0]['created'])
+
+        # Expire the job so that the reaper removes its workspace
+        jobModel.update({'_id': job['_id']}, {
+            '$set': {'updated': datetime.datetime(2000, 1, 1)}})
+        self.scheduler.reap()
+        self.assertFalse(os.path.exists(workspace))
+
+    def testOrphanedExecution(self):
+        from girder.plugins.cis.executors import local
+
+        executor = local.LocalExecutor()
+        workspace = os.path.join(self.workspaceRoot, 'orphan')
+        os.makedirs(workspace)
+        job = {'kwargs': {'workspace': workspace}}
+        with open(os.path.join(workspace, local.GRAPH_FILE), 'w') as f:
+            f.write('models: []\n')
+
+        # Queued by this process, and waiting for a free process
+        with open(os.path.join(workspace, local.QUEUED_FILE), 'w') as f:
+            f.write(local.INSTANCE)
+        self.assertEqual(executor.status(job), 'running')
+
+        # Queued by an earlier Girder process that had the same process id
+        with open(os.path.join(workspace, local.QUEUED_FILE), 'w') as f:
+            f.write('%d earlier' % os.getpid())
+        self.assertEqual(executor.status(job), 'failed')
+        self.assertIn('stopped before it started', executor.logs(job))
+
+    def testCancelPendingExecution(self):
+        from girder.plugins.cis.executors import local
+
+        executor = local.LocalExecutor()
+        workspace = os.path.join(self.workspaceRoot, 'cancelled')
+        os.makedirs(workspace)
+        job = {'kwargs': {'workspace': workspace}}
+        with open(os.path.join(workspace, local.GRAPH_FILE), 'w') as f:
+            f.write('models: []\n')
+
+        # Cancelled while waiting for a free process, which then never
+        # starts yggrun
+        self.assertTrue(executor.cancel(job))
+        executor._run(workspace, 300)
+        self.assertFalse(os.path.exists(
+            os.path.join(workspace, local.PID_FILE)))
+        self.assertEqual(executor.status(job), 'failed')
+        self.assertIn('Cancelled before it started', executor.logs(job))
+
+        # Executions that were never submitted have nothing to stop
+        self.assertTrue(executor.cancel(
+            {'kwargs': {'workspace': os.path.join(workspace, 'missing')}}))
+
+    def testExecuteSavedGraph(self):
+        from girder.constants import AccessType
+        from girder.plugins.cis.conversion import contentHash
+
+        other = self.model('user').createUser(
+            email='jane@dev.null', login='janeregular', firstName='Jane',
+            lastName='Regular', password='secret')
+        graphModel = self.model('graph', 'cis')
+        content = {'processes': {}, 'connections': []}
+        graph = graphModel.setUserAccess({
+            'name': 'saved',
+            'content': content,
+            'creatorId': self.user['_id'],
+            'conversion': {
+                'contentHash': contentHash(content),
+                'specs': [],
+                'yaml': 'models: []\n',
+                'errors': []
+            }
+        }, user=self.user, level=AccessType.ADMIN, save=True)
+
+        resp = self.request('/graph/%s/execute' % graph['_id'], user=other,
+                            method='POST')
+        self.assertStatus(resp, 403)
+
+        resp = self.request('/graph/%s/execute' % graph['_id'],
+                            user=self.user, method='POST', isJson=False)
+        self.assertStatusOk(resp)
+        job = self.model('job', 'jobs').load(self.getBody(resp), force=True)
+        self.assertEqual(job['kwargs']['graphId'], str(graph['_id']))
+        self.assertEqual(job['kwargs']['graph'], 'models: []\n')
+
+        # Invalid graphs report the stored errors
+        graphModel.update({'_id': graph['_id']}, {'$set': {
+            'conversion.yaml': None,
+            'conversion.errors': [{'code': 'unknownComponent',
+                                   'message': 'Unknown'}]}})
+        resp = self.request('/graph/%s/execute' % graph['_id'],
+                            user=self.user, method='POST')
+        self.assertStatus(resp, 400)
+        self.assertEqual(resp.json['extra']['errors'][0]['code'],
+                         'unknownComponent')
+
+        self.model('user').remove(other)
+
+    def tearDown(self):
+        self.model('user').remove(self.user)
+        shutil.rmtree(self.workspaceRoot, ignore_errors=True)
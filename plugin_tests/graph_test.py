@@ -4,6 +4,7 @@
 import json
 import six
 import os
+import time
 import yaml
 import pyaml
 from pprint import pprint
@@ -62,16 +63,149 @@ class GraphTestCase(base.TestCase):
         self.assertEquals(resp.json['name'], 'test')
         graphId = resp.json['_id']
 
+        # The conversion is stored with the graph, and kept while neither
+        # the content nor the specs change
+        stored = self.model('graph', 'cis').load(graphId, force=True)
+        conversion = stored['conversion']
+        self.assertEqual(len(conversion['contentHash']), 40)
+        self.assertEqual(resp.json['content'], data)
+
+        # The layout is stored apart from the topology
+        self.assertEqual(stored['content']['processes']['rf7']['metadata'],
+                         {'label': 'Light'})
+        self.assertEqual(stored['layout']['rf7'],
+                         {'x': 1080, 'y': 360, 'width': 72, 'height': 72})
+        self.assertEqual([spec['name'] for spec in conversion['specs']],
+                         ['light'])
+
         graph['name'] = 'renamed'
         resp = self.request('/graph/%s' % graphId,  user=self.user,
                             method='PUT', type='application/json',
                             body=json.dumps(graph))
         self.assertStatus(resp, 200)
+        stored = self.model('graph', 'cis').load(graphId, force=True)
+        self.assertEqual(stored['conversion']['updated'],
+                         conversion['updated'])
+
+        # Graphs are found from the specs they use, and changing a spec
+        # marks their conversions as stale
+        spec = self.model('spec', 'cis').findOne({'content.name': 'light'})
+        resp = self.request('/spec/%s/graphs' % spec['_id'], user=self.user)
+        self.assertStatusOk(resp)
+        self.assertEqual([g['_id'] for g in resp.json], [graphId])
+        resp = self.request('/spec/%s/graphs' % spec['_id'], user=self.admin)
+        self.assertStatusOk(resp)
+        self.assertEqual(len(resp.json), 1)
+        from girder.plugins.cis.constants import PluginSettings
+        from girder.plugins.cis.pool import pool
+        pool.stop()
+        self.model('spec', 'cis').save(spec)
+        stored = self.model('graph', 'cis').load(graphId, force=True)
+        self.assertTrue(stored['conversion']['stale'])
+        resp = self.request('/graph', user=self.user,
+                            params={'validity': 'pending'})
+        self.assertStatusOk(resp)
+        self.assertEqual([g['_id'] for g in resp.json], [graphId])
+
+        # The graphs are revalidated in the background
+        pool.start(self.model('setting').get(
+            PluginSettings.WORKER_POOL_SIZE))
+        for i in range(50):
+            stored = self.model('graph', 'cis').load(graphId, force=True)
+            if stored['validity'] != 'pending':
+                break
+            time.sleep(0.1)
+        self.assertNotIn('stale', stored['conversion'])
+        self.assertEqual(stored['validity'], 'valid')
+        self.assertEqual(stored['version'], 2)
 
         resp = self.request('/graph/%s' % graphId,  user=self.user,
                             method='GET')
         self.assertStatus(resp, 200)
         self.assertEquals(resp.json['name'], 'renamed')
+        self.assertEquals(resp.json['version'], 2)
+
+        patch = [{'op': 'replace', 'path': '/processes/rf7/metadata/x',
+                  'value': 100},
+                 {'op': 'remove', 'path': '/connections/2'}]
+        resp = self.request('/graph/%s' % graphId, user=self.user,
+                            method='PATCH', type='application/json',
+                            params={'version': 2}, body=json.dumps(patch))
+        self.assertStatusOk(resp)
+        self.assertEquals(resp.json['version'], 3)
+        self.assertEquals(resp.json['content']['processes']['rf7'],
+                          {'component': 'light', 'metadata': dict(
+                              data['processes']['rf7']['metadata'], x=100)})
+        stored = self.model('graph', 'cis').load(graphId, force=True)
+        self.assertEquals(stored['layout']['rf7']['x'], 100)
+        self.assertEquals(stored['content']['connections'],
+                          data['connections'][:2])
+        conversion = stored['conversion']
+
+        # Moving a process leaves the topology and its conversion alone
+        resp = self.request('/graph/%s' % graphId, user=self.user,
+                            method='PATCH', type='application/json',
+                            params={'version': 3}, body=json.dumps([
+                                {'op': 'replace', 'value': 5,
+                                 'path': '/processes/rf7/metadata/y'}]))
+        self.assertStatusOk(resp)
+        self.assertEquals(resp.json['version'], 4)
+        moved = self.model('graph', 'cis').load(graphId, force=True)
+        self.assertEquals(moved['layout']['rf7']['y'], 5)
+        self.assertEquals(moved['content'], stored['content'])
+        self.assertEquals(moved['conversion'], conversion)
+
+        # Patches made against an older version are rejected
+        resp = self.request('/graph/%s' % graphId, user=self.user,
+                            method='PATCH', type='application/json',
+                            params={'version': 2}, body=json.dumps(patch))
+        self.assertStatus(resp, 409)
+
+        resp = self.request('/graph/%s' % graphId, user=self.user,
+                            method='PATCH', type='application/json',
+                            body=json.dumps([{'op': 'remove',
+                                              'path': '/nothing'}]))
+        self.assertStatus(resp, 400)
+
+        # Every version is recorded, the first as a snapshot
+        resp = self.request('/graph/%s/revision' % graphId, user=self.user)
+        self.assertStatusOk(resp)
+        self.assertEqual([(r['version'], r['snapshot']) for r in resp.json],
+                         [(4, False), (3, False), (2, False), (1, True)])
+
+        resp = self.request('/graph/%s/revision/3/diff' % graphId,
+                            user=self.user)
+        self.assertStatusOk(resp)
+        self.assertEqual(sorted(resp.json, key=lambda op: op['path']), [
+            {'op': 'remove', 'path': '/connections/2'},
+            {'op': 'replace', 'path': '/processes/rf7/metadata/x',
+             'value': 100}])
+
+        resp = self.request('/graph/%s/revision/1/restore' % graphId,
+                            user=self.user, method='POST')
+        self.assertStatusOk(resp)
+        self.assertEquals(resp.json['version'], 5)
+        self.assertEquals(resp.json['content'], data)
+
+        resp = self.request('/graph/%s/revision/3' % graphId, user=self.user)
+        self.assertStatusOk(resp)
+        self.assertEquals(resp.json['content']['processes']['rf7'],
+                          {'component': 'light', 'metadata': dict(
+                              data['processes']['rf7']['metadata'], x=100)})
+
+        # Of two saves of the same version, the second is rejected
+        from girder.plugins.cis.models.graph import VersionConflict
+        graphModel = self.model('graph', 'cis')
+        first, second = [graphModel.load(graphId, force=True)
+                         for i in range(2)]
+        first['content'] = second['content'] = data
+        graphModel.updateGraph(first, user=self.user)
+        with self.assertRaises(VersionConflict):
+            graphModel.updateGraph(second, user=self.user)
+        self.assertEqual(graphModel.load(graphId, force=True)['version'], 6)
+
+        resp = self.request('/graph/%s/revision/9' % graphId, user=self.user)
+        self.assertStatus(resp, 404)
 
         resp = self.request(path='/graph', method='GET', user=self.user)
         self.assertStatusOk(resp)
@@ -80,6 +214,8 @@ class GraphTestCase(base.TestCase):
         resp = self.request('/graph/%s' % graphId, user=self.admin,
                             method='DELETE')
         self.assertStatus(resp, 200)
+        self.assertEqual(self.model('graph_revision', 'cis').find(
+            {'graphId': stored['_id']}).count(), 0)
 
     def testConvert(self):
         fakeplant_yml = os.path.join(ROOT_DIR, 'plugins', 'cis', 
@@ -106,11 +242,48 @@ class GraphTestCase(base.TestCase):
         resp = self.request('/graph/convert', user=self.user, method='POST',
                             isJson=False, type='application/json', body=json.dumps(graph))
         self.assertStatus(resp, 200)
-        respyml = yaml.load(resp.body[0])
+        respyml = yaml.load(self.getBody(resp))
         respyml['connections'] = sorted(respyml['connections'], key=lambda x: x['output'])
         respyml['models'] = sorted(respyml['models'], key=lambda x: x['name'])
 
         self.assertEquals(goldyml, respyml)
+        self.assertIn('fbp_to_cis;dur=', resp.headers['Server-Timing'])
+        self.assertIn('schema_validate;dur=', resp.headers['Server-Timing'])
+
+        resp = self.request('/cis/metrics', user=self.user)
+        self.assertStatus(resp, 403)
+        resp = self.request('/cis/metrics', user=self.admin, isJson=False)
+        self.assertStatusOk(resp)
+        body = self.getBody(resp)
+        self.assertIn('cis_requests_total{endpoint="convert"}', body)
+        self.assertIn('cis_stage_seconds_count{stage="check_fbp"}', body)
+        self.assertIn('cis_spec_queries_total', body)
+
+    def testInvalidGraph(self):
+        fbp_graph_file = os.path.join(ROOT_DIR, 'plugins', 'cis',
+                                      'plugin_tests',
+                                      'light_files_fbp.json')
+        with open(fbp_graph_file, 'r') as fp:
+            data = json.load(fp)
+
+        data['processes']['bad'] = {'component': 'nosuchmodel',
+                                    'metadata': {'label': 'Bad'}}
+        data['connections'].append({
+            'src': {'process': 'missing', 'port': 'value'},
+            'tgt': {'process': 'rf7', 'port': 'ambient_light'}
+        })
+        data['connections'].append({
+            'src': {'process': 'rf7', 'port': 'no_such_output'},
+            'tgt': {'process': 'r4f', 'port': 'value'}
+        })
+        graph = {'name': 'test', 'content': data}
+
+        resp = self.request('/graph/convert', user=self.user, method='POST',
+                            type='application/json', body=json.dumps(graph))
+        self.assertStatus(resp, 400)
+        codes = sorted(error['code'] for error in resp.json['extra']['errors'])
+        self.assertEqual(codes, ['danglingConnection', 'unknownComponent',
+                                 'unknownPort'])
 
     def tearDown(self):
         self.model('user').remove(self.user)
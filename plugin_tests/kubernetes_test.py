@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import httmock
+import json
+import os
+import tempfile
+from six.moves.urllib.parse import parse_qs, urlparse
+from tests import base
+
+
+def setUpModule():
+    base.enabledPlugins.append('cis')
+    base.startServer()
+
+
+def tearDownModule():
+    base.stopServer()
+
+
+class KubernetesTestCase(base.TestCase):
+
+    def setUp(self):
+        super(KubernetesTestCase, self).setUp()
+
+        # Outside of a cluster there is no service account token to read
+        from girder.plugins.cis import kubernetes_executor
+        fd, self.tokenFile = tempfile.mkstemp()
+        os.write(fd, b'token')
+        os.close(fd)
+        self.tokenPath = kubernetes_executor.token_file_path
+        kubernetes_executor.token_file_path = self.tokenFile
+
+        self.requests = []
+        self.user = self.model('user').createUser(
+            email='joe@dev.null', login='joeregular', firstName='Joe',
+            lastName='Regular', password='secret')
+
+    @httmock.urlmatch(netloc='.*', path='.*/jobs.*', method='DELETE')
+    def mockDelete(self, url, request):
+        self.requests.append((urlparse(request.url), json.loads(request.body)))
+        return httmock.response(200, {}, {'content-type': 'application/json'},
+                                None, 5, request)
+
+    @httmock.urlmatch(netloc='.*', path='.*/jobs', method='GET')
+    def mockList(self, url, request):
+        query = parse_qs(urlparse(request.url).query)
+        self.requests.append((query, request.headers['Accept']))
+        # Two pages of partial object metadata
+        if 'continue' not in query:
+            names, metadata = ['joeregular-1', 'joeregular-2'], {
+                'continue': 'page2'}
+        else:
+            names, metadata = ['joeregular-3'], {}
+        return httmock.response(200, {
+            'kind': 'PartialObjectMetadataList',
+            'metadata': metadata,
+            'items': [{'metadata': {
+                'name': name, 'creationTimestamp': '2018-06-01T12:00:00Z'}}
+                for name in names]
+        }, {'content-type': 'application/json'}, None, 5, request)
+
+    def testList(self):
+        from girder.plugins.cis.kubernetes_executor import KubernetesJob
+
+        with httmock.HTTMock(self.mockList):
+            names = KubernetesJob.get_all_job_names('hub', 'cis-user=joe')
+        self.assertEqual(names, ['joeregular-1', 'joeregular-2',
+                                 'joeregular-3'])
+        (first, accept), (second, _) = self.requests
+        self.assertIn('as=PartialObjectMetadataList', accept)
+        self.assertEqual(first['labelSelector'], ['cis-user=joe'])
+        self.assertNotIn('continue', first)
+        self.assertEqual(second['continue'], ['page2'])
+
+        # Executions are listed a page at a time, by owner label
+        self.model('setting').set('cis.executor', 'kubernetes')
+        job = self.model('job', 'jobs').createJob(
+            title='joeregular-1', type='cis', user=self.user)
+        self.requests = []
+        with httmock.HTTMock(self.mockList):
+            resp = self.request('/graph/execute', user=self.user,
+                                params={'limit': 2})
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['continueToken'], 'page2')
+        self.assertEqual(resp.json['executions'], [{
+            'name': 'joeregular-1', 'created': '2018-06-01T12:00:00Z',
+            'jobId': str(job['_id'])
+        }, {
+            'name': 'joeregular-2', 'created': '2018-06-01T12:00:00Z',
+            'jobId': None
+        }])
+        (query, _), = self.requests
+        self.assertEqual(query['labelSelector'], ['cis-user=joeregular'])
+        self.assertEqual(query['limit'], ['2'])
+
+        with httmock.HTTMock(self.mockList):
+            resp = self.request('/graph/execute', user=self.user,
+                                params={'limit': 2, 'continueToken': 'page2'})
+        self.assertStatusOk(resp)
+        self.assertIsNone(resp.json['continueToken'])
+        self.assertEqual([e['name'] for e in resp.json['executions']],
+                         ['joeregular-3'])
+
+    def testDelete(self):
+        from girder.plugins.cis.kubernetes_executor import KubernetesJob
+
+        job = KubernetesJob('joe', 'joe-1', 'hub', 300, 'true', 'true',
+                            'image', 1, 1024)
+        with httmock.HTTMock(self.mockDelete):
+            self.assertTrue(job.delete())
+        url, body = self.requests.pop()
+        self.assertTrue(url.path.endswith('/namespaces/hub/jobs/joe-1'))
+        self.assertEqual(body['propagationPolicy'], 'Background')
+
+        # Jobs are deleted by label, in batches
+        names = ['joe-%d' % i for i in range(250)]
+        with httmock.HTTMock(self.mockDelete):
+            self.assertTrue(KubernetesJob.delete_all('hub', names))
+        self.assertEqual(len(self.requests), 3)
+        selected = []
+        for url, body in self.requests:
+            self.assertTrue(url.path.endswith('/namespaces/hub/jobs'))
+            self.assertEqual(body['propagationPolicy'], 'Background')
+            selector, = parse_qs(url.query)['labelSelector']
+            self.assertTrue(selector.startswith('cis-job in ('))
+            self.assertTrue(selector.endswith(')'))
+            batch = selector[len('cis-job in ('):-1].split(',')
+            self.assertLessEqual(len(batch), 100)
+            selected.extend(batch)
+        self.assertEqual(selected, names)
+
+    def tearDown(self):
+        from girder.plugins.cis import kubernetes_executor
+        kubernetes_executor.token_file_path = self.tokenPath
+        os.remove(self.tokenFile)
+        self.model('user').remove(self.user)
+        super(KubernetesTestCase, self).tearDown()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import unittest
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        super(RecordingHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class Formatted(object):
+
+    count = 0
+
+    def __str__(self):
+        Formatted.count += 1
+        return 'formatted'
+
+
+class LogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from girder.plugins.cis import log
+
+        log.setLevel('INFO')
+        self.logger = log.getLogger('girder.plugins.cis.test')
+        self.handler = RecordingHandler()
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        from girder.plugins.cis import log
+
+        self.logger.removeHandler(self.handler)
+        log.setLevel('INFO')
+
+    def testLevels(self):
+        from girder.plugins.cis import log
+
+        log.setLevel('INFO')
+        self.logger.debug('Not shown: %s', Formatted())
+        self.assertEqual(self.handler.records, [])
+        self.assertEqual(Formatted.count, 0)
+
+        log.setLevel('DEBUG')
+        self.logger.debug('Shown: %s', Formatted())
+        self.assertEqual(len(self.handler.records), 1)
+        self.assertEqual(self.handler.records[0].getMessage(),
+                         'Shown: formatted')
+
+    def testRequestContext(self):
+        from girder.plugins.cis import log
+        from girder.plugins.cis.pool import WorkerPool
+
+        self.logger.info('No context')
+        with log.requestContext('abc123'):
+            self.logger.info('In context %d', 1)
+        self.assertEqual(self.handler.records[0].requestId, None)
+        self.assertEqual(self.handler.records[0].getMessage(), 'No context')
+        self.assertEqual(self.handler.records[1].requestId, 'abc123')
+        self.assertEqual(self.handler.records[1].getMessage(),
+                         '[abc123] In context 1')
+
+        # Work submitted to a pool keeps the submitter's id
+        pool = WorkerPool('cis-log-test')
+        pool.start(1)
+        done = threading.Event()
+        with log.requestContext('def456'):
+            pool.submit(lambda: (self.logger.info('Background'), done.set()))
+        self.assertTrue(done.wait(5))
+        pool.stop()
+        self.assertEqual(self.handler.records[2].getMessage(),
+                         '[def456] Background')
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+
+class ProgressParserTestCase(unittest.TestCase):
+
+    def testParser(self):
+        from girder.plugins.cis.progress import ProgressParser, modelNames
+
+        models = modelNames('models:\n  - name: LightModel\n'
+                            '  - name: GrowthModel\n')
+        self.assertEqual(models, ['LightModel', 'GrowthModel'])
+
+        parser = ProgressParser(models)
+        self.assertFalse(parser.feed('INFO: Loading graph.yml'))
+        self.assertTrue(parser.feed('INFO: LightModel: Starting model'))
+        self.assertFalse(parser.feed('INFO: LightModel: Starting model'))
+        self.assertTrue(parser.feed('DEBUG: GrowthModel sent 12 messages'))
+        self.assertTrue(parser.feed('INFO: LightModel: Model completed'))
+        self.assertEqual(parser.finished, {'LightModel'})
+        self.assertEqual(parser.summary(),
+                         '1 of 2 models finished; 12 messages')
+
+        self.assertTrue(parser.feed('INFO: All models completed'))
+        self.assertEqual(len(parser.finished), 2)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import httmock
+import os
+import tempfile
+from tests import base
+
+
+def setUpModule():
+    base.enabledPlugins.append('cis')
+    base.startServer()
+
+
+def tearDownModule():
+    base.stopServer()
+
+
+class SchedulerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SchedulerTestCase, self).setUp()
+        from girder.plugins.cis.scheduler import scheduler
+        from girder.plugins.cis.constants import PluginSettings
+        self.scheduler = scheduler
+        self.scheduler.stop()
+
+        # Outside of a cluster there is no service account token to read
+        from girder.plugins.cis import kubernetes_executor
+        fd, self.tokenFile = tempfile.mkstemp()
+        os.write(fd, b'token')
+        os.close(fd)
+        self.tokenPath = kubernetes_executor.token_file_path
+        kubernetes_executor.token_file_path = self.tokenFile
+
+        users = ({
+            'email': 'joe@dev.null',
+            'login': 'joeregular',
+            'firstName': 'Joe',
+            'lastName': 'Regular',
+            'password': 'secret'
+        }, {
+            'email': 'jane@dev.null',
+            'login': 'janeregular',
+            'firstName': 'Jane',
+            'lastName': 'Regular',
+            'password': 'secret'
+        })
+        self.joe, self.jane = [self.model('user').createUser(**user)
+                               for user in users]
+
+        self.model('setting').set(PluginSettings.MAX_RUNNING_JOBS, 3)
+        self.model('setting').set(PluginSettings.MAX_RUNNING_JOBS_PER_USER, 2)
+
+    @httmock.urlmatch(netloc='.*', path='.*/jobs.*')
+    def mockKubernetes(self, url, request):
+        headers = {'content-type': 'application/json'}
+        if request.method == 'GET':
+            return httmock.response(404, {}, headers, None, 5, request)
+        return httmock.response(201, {}, headers, None, 5, request)
+
+    def testFairShare(self):
+        from girder.plugins.cis.utils import execGraph
+        from girder.plugins.jobs.constants import JobStatus
+
+        joeJobs = [execGraph('models: []', self.joe) for i in range(3)]
+        janeJobs = [execGraph('models: []', self.jane) for i in range(2)]
+
+        with httmock.HTTMock(self.mockKubernetes):
+            self.scheduler.dispatch()
+
+        jobModel = self.model('job', 'jobs')
+        statuses = [jobModel.load(job['_id'], force=True)['status']
+                    for job in joeJobs + janeJobs]
+
+        # Three slots: two go to Joe (who queued first), one to Jane
+        self.assertEqual(statuses, [
+            JobStatus.RUNNING, JobStatus.RUNNING, JobStatus.QUEUED,
+            JobStatus.RUNNING, JobStatus.QUEUED])
+
+    def testStaleClaim(self):
+        from girder.plugins.cis.scheduler import CLAIM_TIMEOUT
+        from girder.plugins.cis.utils import execGraph
+        from girder.plugins.jobs.constants import JobStatus
+
+        job = execGraph('models: []', self.joe)
+        jobModel = self.model('job', 'jobs')
+
+        # Claimed by another Girder process, which is submitting it
+        claimed = datetime.datetime.utcnow()
+        jobModel.update({'_id': job['_id']},
+                        {'$set': {'cisDispatched': claimed}})
+        with httmock.HTTMock(self.mockKubernetes):
+            self.scheduler.dispatch()
+        self.assertEqual(jobModel.load(job['_id'], force=True)['status'],
+                         JobStatus.QUEUED)
+
+        # That process stopped before marking the job running
+        claimed -= datetime.timedelta(seconds=CLAIM_TIMEOUT + 1)
+        jobModel.update({'_id': job['_id']},
+                        {'$set': {'cisDispatched': claimed}})
+        with httmock.HTTMock(self.mockKubernetes):
+            self.scheduler.dispatch()
+        job = jobModel.load(job['_id'], force=True)
+        self.assertEqual(job['status'], JobStatus.RUNNING)
+        self.assertGreater(job['cisDispatched'], claimed)
+
+    @httmock.urlmatch(netloc='.*', path='.*/jobs/.*', method='GET')
+    def mockUnavailable(self, url, request):
+        return httmock.response(500, 'unavailable', {}, None, 5, request)
+
+    def testPollTransientError(self):
+        from girder.plugins.cis.utils import execGraph
+        from girder.plugins.jobs.constants import JobStatus
+
+        job = execGraph('models: []', self.joe)
+        with httmock.HTTMock(self.mockKubernetes):
+            self.scheduler.dispatch()
+        jobModel = self.model('job', 'jobs')
+        self.assertEqual(jobModel.load(job['_id'], force=True)['status'],
+                         JobStatus.RUNNING)
+
+        # An API server error leaves the job running until the next pass
+        with httmock.HTTMock(self.mockUnavailable):
+            self.scheduler.poll()
+        self.assertEqual(jobModel.load(job['_id'], force=True)['status'],
+                         JobStatus.RUNNING)
+
+        # A job that no longer exists has failed
+        with httmock.HTTMock(self.mockKubernetes):
+            self.scheduler.poll()
+        self.assertEqual(jobModel.load(job['_id'], force=True)['status'],
+                         JobStatus.ERROR)
+
+    def tearDown(self):
+        from girder.plugins.cis import kubernetes_executor
+        kubernetes_executor.token_file_path = self.tokenPath
+        os.remove(self.tokenFile)
+        self.model('user').remove(self.joe)
+        self.model('user').remove(self.jane)
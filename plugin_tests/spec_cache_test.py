@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from bson.objectid import ObjectId
+
+
+class FakeSpecs(object):
+    """Specs and a version stamp held in memory, counting the loads."""
+
+    def __init__(self):
+        self.specs = {}
+        self.stamp = 0
+        self.loads = 0
+
+    def add(self, name):
+        spec = {'_id': ObjectId(), 'content': {'name': name}}
+        self.specs[name] = spec
+        return spec
+
+    def loadByName(self, name):
+        self.loads += 1
+        return self.specs.get(name)
+
+    def loadById(self, id):
+        self.loads += 1
+        for spec in self.specs.values():
+            if str(spec['_id']) == str(id):
+                return spec
+
+    def readStamp(self):
+        return self.stamp
+
+    def bumpStamp(self):
+        self.stamp += 1
+
+
+class SpecCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from girder.plugins.cis.spec_cache import SpecCache
+
+        self.store = FakeSpecs()
+        self.light = self.store.add('light')
+        self.cache = SpecCache(
+            loadByName=self.store.loadByName, loadById=self.store.loadById,
+            readStamp=self.store.readStamp, bumpStamp=self.store.bumpStamp,
+            maxEntries=4, checkInterval=0)
+
+    def testHits(self):
+        self.assertIs(self.cache.byName('light'), self.light)
+        self.assertIs(self.cache.byName('light'), self.light)
+        # A spec found by name is also cached by its ID
+        self.assertIs(self.cache.byId(self.light['_id']), self.light)
+        self.assertIs(self.cache.byId(str(self.light['_id'])), self.light)
+        self.assertEqual(self.store.loads, 1)
+
+        # Missing specs are cached too, and invalid IDs never loaded
+        self.assertIsNone(self.cache.byName('missing'))
+        self.assertIsNone(self.cache.byName('missing'))
+        self.assertIsNone(self.cache.byId('not an id'))
+        self.assertEqual(self.store.loads, 2)
+
+    def testBounded(self):
+        for i in range(6):
+            self.cache.byName('spec%d' % i)
+        self.assertEqual(len(self.cache._entries), 4)
+        self.store.loads = 0
+        self.cache.byName('spec5')
+        self.assertEqual(self.store.loads, 0)
+        self.cache.byName('spec0')
+        self.assertEqual(self.store.loads, 1)
+
+    def testStampChange(self):
+        self.cache.byName('light')
+        # Another process changed a spec
+        self.store.stamp += 1
+        updated = self.store.add('light')
+        self.assertIs(self.cache.byName('light'), updated)
+
+        # The stamp is only read once per check interval
+        self.cache.checkInterval = 60
+        self.cache.byName('light')
+        self.store.stamp += 1
+        self.store.add('light')
+        self.assertIs(self.cache.byName('light'), updated)
+
+    def testInvalidate(self):
+        self.cache.checkInterval = 60
+        self.cache.byName('light')
+        updated = self.store.add('light')
+        self.cache.invalidate()
+        self.assertEqual(self.store.stamp, 1)
+        self.assertIs(self.cache.byName('light'), updated)
+
+    def testInvalidateWhileLoading(self):
+        from girder.plugins.cis.spec_cache import SpecCache
+
+        def loadByName(name):
+            spec = self.store.loadByName(name)
+            cache.invalidate()
+            return spec
+
+        cache = SpecCache(
+            loadByName=loadByName, loadById=self.store.loadById,
+            readStamp=self.store.readStamp, bumpStamp=self.store.bumpStamp,
+            checkInterval=60)
+        cache.byName('light')
+        # What was loaded before the change is not kept
+        self.assertEqual(len(cache._entries), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,57 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import hashlib
+import hmac
 import httmock
 import json
+import os
+import shutil
 import six
+import tempfile
+import threading
+import yaml
 from tests import base
 import girder
 
 
+def makeModel(name, inputs, outputs):
+    return {'model': {
+        'name': name,
+        'driver': 'PythonModelDriver',
+        'args': './src/%s.py' % name.lower(),
+        'inputs': inputs,
+        'outputs': outputs
+    }}
+
+
+def initSpecRepo(path):
+    """Create a git repository to ingest specs from."""
+    from git import Repo
+
+    repo = Repo.init(path)
+    repo.git.symbolic_ref('HEAD', 'refs/heads/master')
+    return repo
+
+
+def commitSpecs(repo, files, message='Update specs'):
+    """Write and commit spec files; a None content removes the file."""
+    from git import Actor
+
+    for relpath, content in files.items():
+        fullPath = os.path.join(repo.working_tree_dir, relpath)
+        if content is None:
+            repo.index.remove([relpath], working_tree=True)
+            continue
+        if not os.path.isdir(os.path.dirname(fullPath)):
+            os.makedirs(os.path.dirname(fullPath))
+        with open(fullPath, 'w') as f:
+            yaml.safe_dump(content, f, default_flow_style=False)
+        repo.index.add([relpath])
+    actor = Actor('Test', 'test@dev.null')
+    return repo.index.commit(message, author=actor, committer=actor)
+
+
 def setUpModule():
     base.enabledPlugins.append('cis')
     base.startServer()
@@ -95,12 +139,21 @@ class SpecTestCase(base.TestCase):
         self.assertStatus(resp, 200)
         self.assertTrue(resp.json['public'])
 
+        # The yggrun form is computed and validated when the spec is saved
+        stored = self.model('spec', 'cis').load(resp.json['_id'], force=True)
+        self.assertEqual(stored['cis']['name'], 'TestModel')
+        self.assertEqual(stored['cis']['inputs'], ['test_in'])
+        self.assertEqual(stored['cisErrors'], [])
+
         model['public'] = False
+        model['content']['label'] = 'RenamedModel'
         resp = self.request('/spec/%s' % resp.json["_id"],  user=self.admin,
                             method='PUT', type='application/json',
                             body=json.dumps(model))
         self.assertStatus(resp, 200)
         self.assertFalse(resp.json['public'])
+        stored = self.model('spec', 'cis').load(resp.json['_id'], force=True)
+        self.assertEqual(stored['cis']['name'], 'RenamedModel')
 
         resp = self.request('/spec/%s' % resp.json["_id"],  user=self.admin, 
                             method='GET')
@@ -132,6 +185,180 @@ class SpecTestCase(base.TestCase):
         self.assertStatusOk(resp)
         self.assertEqual(len(resp.json), 5)
 
+    def testIngestLocalSource(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            repo = initSpecRepo(os.path.join(tmpdir, 'repo'))
+            commit = commitSpecs(repo, {
+                'specs/canopy.yml': makeModel('Canopy', ['light'], ['leaf']),
+                'specs/.hidden.yml': makeModel('Hidden', [], []),
+                'README.md': {'not': 'a spec'}
+            })
+            settings = self.model('setting')
+            settings.set('cis.spec_mirror_root',
+                         os.path.join(tmpdir, 'mirrors'))
+            settings.set('cis.spec_sources', [{
+                'name': 'local', 'url': repo.working_tree_dir,
+                'path': 'specs', 'public': False}])
+
+            resp = self.request('/spec/ingest', user=self.admin,
+                                method='PUT', params={'source': 'other'})
+            self.assertStatus(resp, 400)
+            resp = self.request('/spec/ingest', user=self.admin,
+                                method='PUT', params={'source': 'local'})
+            self.assertStatusOk(resp)
+            self.assertEqual(resp.json, ['canopy'])
+
+            spec = self.model('spec', 'cis').findOne(
+                {'content.name': 'canopy'})
+            self.assertFalse(spec['public'])
+            self.assertEqual(spec['source'], {
+                'name': 'local', 'url': repo.working_tree_dir,
+                'branch': 'master', 'path': 'specs/canopy.yml',
+                'commit': commit.hexsha})
+            self.assertTrue(os.path.isdir(
+                os.path.join(tmpdir, 'mirrors', 'local', '.git')))
+
+            # Specs of private sources are not readable by everyone
+            resp = self.request('/spec/%s' % spec['_id'], user=self.user)
+            self.assertStatus(resp, 403)
+            resp = self.request('/spec/%s' % spec['_id'])
+            self.assertStatus(resp, 401)
+            resp = self.request('/spec/%s' % spec['_id'], user=self.admin)
+            self.assertStatusOk(resp)
+
+            # The mirror is kept, and only changed specs are updated
+            commit = commitSpecs(repo, {
+                'specs/canopy.yml': makeModel('Canopy', ['light', 'co2'],
+                                              ['leaf']),
+                'specs/root.yml': makeModel('Root', ['water'], ['root'])
+            })
+            resp = self.request('/spec/ingest', user=self.admin,
+                                method='PUT')
+            self.assertStatusOk(resp)
+            self.assertEqual(sorted(resp.json), ['canopy', 'root'])
+            spec = self.model('spec', 'cis').findOne(
+                {'content.name': 'canopy'})
+            self.assertEqual(spec['source']['commit'], commit.hexsha)
+            self.assertEqual(len(spec['content']['inports']), 2)
+
+            resp = self.request('/spec/ingest', user=self.admin,
+                                method='PUT')
+            self.assertStatusOk(resp)
+            self.assertEqual(resp.json, [])
+
+            # Concurrent ingests of a source take turns with its mirror
+            from girder.plugins.cis import utils
+            commit = commitSpecs(repo, {
+                'specs/stem.yml': makeModel('Stem', ['water'], ['sap'])
+            })
+            changed = []
+            threads = [threading.Thread(target=lambda: changed.extend(
+                utils.ingest())) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(changed, ['stem'])
+            self.assertEqual(self.model('spec', 'cis').find(
+                {'content.name': 'stem'}).count(), 1)
+
+            resp = self.request('/system/setting', user=self.admin,
+                                method='PUT', params={
+                                    'key': 'cis.spec_sources',
+                                    'value': json.dumps([{'name': 'a/b',
+                                                          'url': 'x'}])})
+            self.assertStatus(resp, 400)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testWebhook(self):
+        from girder.plugins.cis import webhook
+
+        tmpdir = tempfile.mkdtemp()
+        delay = webhook.debouncer.delay
+        # Keep the debounced ingest from running on its own
+        webhook.debouncer.delay = 3600
+        try:
+            repo = initSpecRepo(os.path.join(tmpdir, 'repo'))
+            commitSpecs(repo, {
+                'specs/canopy.yml': makeModel('Canopy', ['light'], ['leaf']),
+                'specs/old.yml': makeModel('Old', ['light'], ['leaf']),
+                'specs/other.yml': makeModel('Other', ['light'], ['leaf'])
+            })
+            settings = self.model('setting')
+            settings.set('cis.spec_mirror_root',
+                         os.path.join(tmpdir, 'mirrors'))
+            settings.set('cis.spec_sources', [{
+                'name': 'local', 'url': repo.working_tree_dir,
+                'path': 'specs'}])
+            resp = self.request('/spec/ingest', user=self.admin,
+                                method='PUT')
+            self.assertStatusOk(resp)
+
+            # The recorded push adds root.yml, modifies canopy.yml and
+            # removes old.yml; other.yml changes without being listed
+            commitSpecs(repo, {
+                'specs/canopy.yml': makeModel('Canopy', ['light', 'co2'],
+                                              ['leaf']),
+                'specs/root.yml': makeModel('Root', ['water'], ['root']),
+                'specs/old.yml': None,
+                'specs/other.yml': makeModel('Other', ['light', 'co2'],
+                                             ['leaf'])
+            })
+            with open(os.path.join(os.path.dirname(__file__),
+                                   'github_push.json')) as f:
+                payload = json.load(f)
+            payload['repository']['clone_url'] = repo.working_tree_dir
+            body = json.dumps(payload)
+
+            def post(body, secret, event='push'):
+                signature = hmac.new(secret, body.encode('utf8'),
+                                     hashlib.sha256).hexdigest()
+                return self.request(
+                    '/spec/webhook', method='POST', body=body,
+                    type='application/json', additionalHeaders=[
+                        ('X-GitHub-Event', event),
+                        ('X-Hub-Signature-256', 'sha256=' + signature)])
+
+            # Webhooks are disabled until a secret is set
+            resp = post(body, b'sekrit')
+            self.assertStatus(resp, 403)
+            settings.set('cis.webhook_secret', 'sekrit')
+            resp = post(body, b'wrong')
+            self.assertStatus(resp, 403)
+
+            resp = post('{"zen": "Keep it logically awesome."}', b'sekrit',
+                        event='ping')
+            self.assertStatusOk(resp)
+            self.assertEqual(resp.json['sources'], [])
+
+            # Consecutive pushes are ingested once
+            for i in range(2):
+                resp = post(body, b'sekrit')
+                self.assertStatus(resp, 202)
+                self.assertEqual(resp.json['sources'], ['local'])
+            self.assertEqual(webhook.debouncer.pending(), ['local'])
+
+            self.assertEqual(sorted(webhook.debouncer.flush()),
+                             ['canopy', 'root'])
+            self.assertEqual(webhook.debouncer.pending(), [])
+            specs = dict((spec['content']['name'], spec) for spec in
+                         self.model('spec', 'cis').find(
+                             {'source.name': 'local'}))
+            self.assertEqual(len(specs['canopy']['content']['inports']), 2)
+            self.assertEqual(len(specs['other']['content']['inports']), 1)
+            self.assertIn('old', specs)
+
+            # Pushes to other branches are ignored
+            payload['ref'] = 'refs/heads/develop'
+            resp = post(json.dumps(payload), b'sekrit')
+            self.assertStatus(resp, 202)
+            self.assertEqual(resp.json['sources'], [])
+        finally:
+            webhook.debouncer.delay = delay
+            shutil.rmtree(tmpdir)
+
     def testOauth(self):
         event = { 
                  "user": self.user,
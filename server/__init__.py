@@ -1,13 +1,181 @@
 # -*- coding: utf-8 -*
 """Girder plugin for Crops in Silico."""
 
-from rest import spec, graph
-from utils import ingest
+import cherrypy
+import os
+import six
+
+from constants import PluginSettings
+from executors import EXECUTOR_NAMES
+import log
+from pool import pool
+import spec_sources
+from scheduler import scheduler
 from girder import events
+from girder.models.model_base import ValidationException
+from girder.utility import setting_utilities
 from girder.utility.model_importer import ModelImporter
 from girder.plugins.oauth.providers.github import GitHub
 
 
+@setting_utilities.validator({
+    PluginSettings.MAX_RUNNING_JOBS,
+    PluginSettings.MAX_RUNNING_JOBS_PER_USER,
+    PluginSettings.SCHEDULER_INTERVAL,
+    PluginSettings.WORKER_POOL_SIZE,
+    PluginSettings.JOB_TTL,
+    PluginSettings.LOCAL_POOL_SIZE
+})
+def validatePositiveInteger(doc):
+    """Validate settings that must be positive integers."""
+    if not isinstance(doc['value'], six.integer_types) or doc['value'] < 1:
+        raise ValidationException(
+            '%s must be a positive integer.' % doc['key'], 'value')
+
+
+@setting_utilities.validator(PluginSettings.EXECUTOR)
+def validateExecutor(doc):
+    if doc['value'] not in EXECUTOR_NAMES:
+        raise ValidationException(
+            'Executor must be one of %s.' % ', '.join(EXECUTOR_NAMES),
+            'value')
+
+
+@setting_utilities.validator(PluginSettings.LOCAL_WORKSPACE_ROOT)
+def validateLocalWorkspaceRoot(doc):
+    if not doc['value'] or not os.path.isabs(doc['value']):
+        raise ValidationException(
+            'Local workspace root must be an absolute path.', 'value')
+
+
+@setting_utilities.validator(PluginSettings.LOG_LEVEL)
+def validateLogLevel(doc):
+    if doc['value'] not in log.LEVELS:
+        raise ValidationException(
+            'Log level must be one of %s.' % ', '.join(log.LEVELS), 'value')
+
+
+@setting_utilities.validator(PluginSettings.SPEC_SOURCES)
+def validateSpecSources(doc):
+    doc['value'] = spec_sources.validateSources(doc['value'])
+
+
+@setting_utilities.validator(PluginSettings.SPEC_MIRROR_ROOT)
+def validateSpecMirrorRoot(doc):
+    if not doc['value'] or not os.path.isabs(doc['value']):
+        raise ValidationException(
+            'Spec mirror root must be an absolute path.', 'value')
+
+
+@setting_utilities.validator({
+    PluginSettings.LOCAL_MODELS_DIR,
+    PluginSettings.KUBERNETES_VOLUME_ROOT
+})
+def validateOptionalDirectory(doc):
+    if doc['value'] and not os.path.isdir(doc['value']):
+        raise ValidationException(
+            '%s must be an existing directory.' % doc['key'], 'value')
+
+
+@setting_utilities.default(PluginSettings.MAX_RUNNING_JOBS)
+def defaultMaxRunningJobs():
+    return 20
+
+
+@setting_utilities.default(PluginSettings.MAX_RUNNING_JOBS_PER_USER)
+def defaultMaxRunningJobsPerUser():
+    return 2
+
+
+@setting_utilities.default(PluginSettings.SCHEDULER_INTERVAL)
+def defaultSchedulerInterval():
+    return 5
+
+
+@setting_utilities.default(PluginSettings.WORKER_POOL_SIZE)
+def defaultWorkerPoolSize():
+    return 4
+
+
+@setting_utilities.default(PluginSettings.JOB_TTL)
+def defaultJobTtl():
+    return 24 * 60 * 60
+
+
+@setting_utilities.default(PluginSettings.EXECUTOR)
+def defaultExecutor():
+    return 'kubernetes'
+
+
+@setting_utilities.default(PluginSettings.LOCAL_WORKSPACE_ROOT)
+def defaultLocalWorkspaceRoot():
+    return '/tmp/cis-executions'
+
+
+@setting_utilities.default(PluginSettings.LOCAL_MODELS_DIR)
+def defaultLocalModelsDir():
+    return ''
+
+
+@setting_utilities.default(PluginSettings.KUBERNETES_VOLUME_ROOT)
+def defaultKubernetesVolumeRoot():
+    return ''
+
+
+@setting_utilities.default(PluginSettings.LOCAL_POOL_SIZE)
+def defaultLocalPoolSize():
+    return 2
+
+
+@setting_utilities.default(PluginSettings.LOG_LEVEL)
+def defaultLogLevel():
+    return 'INFO'
+
+
+@setting_utilities.default(PluginSettings.SPEC_SOURCES)
+def defaultSpecSources():
+    return spec_sources.DEFAULT_SOURCES
+
+
+@setting_utilities.default(PluginSettings.SPEC_MIRROR_ROOT)
+def defaultSpecMirrorRoot():
+    return '/tmp/cis-spec-mirrors'
+
+
+@setting_utilities.validator(PluginSettings.WEBHOOK_SECRET)
+def validateWebhookSecret(doc):
+    if not isinstance(doc['value'], six.string_types):
+        raise ValidationException('Webhook secret must be a string.',
+                                  'value')
+
+
+@setting_utilities.default(PluginSettings.WEBHOOK_SECRET)
+def defaultWebhookSecret():
+    return ''
+
+
+def updateLogLevel(event):
+    """Apply changes of the log level setting."""
+    if event.info.get('key') == PluginSettings.LOG_LEVEL:
+        log.setLevel(event.info['value'])
+
+
+def specChanged(event):
+    """Invalidate what depends on a spec that was saved or removed.
+
+    The spec caches of all processes are cleared, and the conversions of
+    graphs using the spec are marked as stale and redone in the background.
+    """
+    from conversion import invalidateConversions, revalidateGraphs
+    from spec_cache import specCache
+
+    specCache.invalidate()
+    name = event.info.get('content', {}).get('name')
+    if name is not None:
+        invalidateConversions([name])
+        revalidateGraphs([name])
+
+
 def storeToken(event):
     """Oauth callback event handler to store token."""
     user, token = event.info['user'], event.info['token']
@@ -18,8 +186,24 @@ def storeToken(event):
 
 def load(info):
     """Initialize the plugin."""
+    from rest import spec, graph, metrics
+    from utils import ingest
+
+    settingModel = ModelImporter.model('setting')
+    log.setLevel(settingModel.get(PluginSettings.LOG_LEVEL))
+    events.bind('model.setting.save.after', 'cis', updateLogLevel)
+    events.bind('model.spec.save.after', 'cis', specChanged)
+    events.bind('model.spec.remove', 'cis', specChanged)
+
     info['apiRoot'].spec = spec.Spec()
     info['apiRoot'].graph = graph.Graph()
+    info['apiRoot'].cis = metrics.Metrics()
     ingest()
     GitHub.addScopes(['user:email', 'public_repo'])
     events.bind('oauth.auth_callback.after', 'cis', storeToken)
+
+    pool.start(settingModel.get(PluginSettings.WORKER_POOL_SIZE))
+    cherrypy.engine.subscribe('stop', pool.stop)
+
+    scheduler.start()
+    cherrypy.engine.subscribe('stop', scheduler.stop)
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*
+"""Constants for the Crops in Silico plugin."""
+
+# The Girder job type used for yggrun executions
+JOB_TYPE = 'k8s.io/yggdrasil'
+
+
+class PluginSettings(object):
+    """Plugin setting keys."""
+
+    MAX_RUNNING_JOBS = 'cis.max_running_jobs'
+    MAX_RUNNING_JOBS_PER_USER = 'cis.max_running_jobs_per_user'
+    SCHEDULER_INTERVAL = 'cis.scheduler_interval'
+    WORKER_POOL_SIZE = 'cis.worker_pool_size'
+    JOB_TTL = 'cis.job_ttl'
+    EXECUTOR = 'cis.executor'
+    LOCAL_WORKSPACE_ROOT = 'cis.local_workspace_root'
+    LOCAL_MODELS_DIR = 'cis.local_models_dir'
+    LOCAL_POOL_SIZE = 'cis.local_pool_size'
+    KUBERNETES_VOLUME_ROOT = 'cis.kubernetes_volume_root'
+    LOG_LEVEL = 'cis.log_level'
+    SPEC_SOURCES = 'cis.spec_sources'
+    SPEC_MIRROR_ROOT = 'cis.spec_mirror_root'
+    WEBHOOK_SECRET = 'cis.webhook_secret'
+    # Incremented whenever a spec changes; not meant to be edited
+    SPEC_CACHE_VERSION = 'cis.spec_cache_version'
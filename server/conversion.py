@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*
+"""Cached yggrun conversions of saved graphs.
+
+Graph documents carry the result of converting and validating their
+content under 'conversion':
+
+    contentHash  SHA-1 of the FBP content the conversion was made from
+    specs        the name and fingerprint of every spec the graph uses
+    yaml         the validated yggrun YAML, or None if the graph is invalid
+    errors       the structural or schema errors of an invalid graph
+    updated      when the conversion was made
+
+The graph's 'validity' field summarizes its conversion for listings:
+'valid', 'invalid', or 'pending' while a spec it uses has changed and it
+has not been converted again yet.
+
+A conversion is current while the content hash and the fingerprints of the
+specs, their git hash or modification time, are unchanged.  Only then is it
+reused; otherwise the graph is converted again.  Graphs are indexed on the
+names of their specs, so that a spec change marks the conversions of just
+the graphs using it as stale.  After ingest, the affected graphs are
+converted again on the worker pool.
+"""
+
+import datetime
+import hashlib
+import json
+
+from girder.utility.model_importer import ModelImporter
+
+from . import metrics
+from .log import getLogger
+from .pool import pool
+from .utils import convertFbp, findSpec
+from .validation import GraphValidationError
+
+LOGGER = getLogger(__name__)
+
+# Values of the validity field of graphs
+VALID = 'valid'
+INVALID = 'invalid'
+PENDING = 'pending'
+
+
+def contentHash(content):
+    """Return a hash of an FBP graph's content."""
+    return hashlib.sha1(json.dumps(
+        content, sort_keys=True, separators=(',', ':'), default=str
+    ).encode('utf8')).hexdigest()
+
+
+def specFingerprint(spec):
+    """Return a value that changes whenever a spec is changed."""
+    if spec is None:
+        return None
+    if spec.get('hash'):
+        return spec['hash']
+    return str(spec.get('updated') or spec.get('created') or spec['_id'])
+
+
+def currentSpecFingerprints(names):
+    """Look up the fingerprints of the named specs with a single query."""
+    fingerprints = dict((name, None) for name in names)
+    cursor = ModelImporter.model('spec', 'cis').find(
+        {'content.name': {'$in': list(names)}},
+        fields=['content.name', 'hash', 'updated', 'created'])
+    for spec in cursor:
+        fingerprints[spec['content']['name']] = specFingerprint(spec)
+    return fingerprints
+
+
+def convert(content):
+    """Convert and validate an FBP graph into a conversion record."""
+    specs = {}
+
+    def loadSpec(name):
+        specs[name] = findSpec(name)
+        return specs[name]
+
+    record = {
+        'contentHash': contentHash(content),
+        'yaml': None,
+        'errors': [],
+        'updated': datetime.datetime.utcnow()
+    }
+    try:
+        record['yaml'] = convertFbp(content, loadSpec)
+    except GraphValidationError as e:
+        record['errors'] = e.errors
+    except BaseException as e:
+        record['errors'] = [{'code': 'invalidSchema', 'message': str(e)}]
+
+    # A list rather than a dict, since spec names need not be valid keys
+    record['specs'] = [{'name': name, 'fingerprint': specFingerprint(spec)}
+                       for name, spec in sorted(specs.items())]
+    return record
+
+
+def validity(record):
+    """Return the validity of a graph with the given conversion."""
+    return VALID if record['yaml'] is not None else INVALID
+
+
+def isCurrent(graph):
+    """Return whether a graph's stored conversion is up to date."""
+    record = graph.get('conversion')
+    if not record or record.get('stale') or record.get('contentHash') != \
+            contentHash(graph['content']):
+        return False
+    stored = dict((spec['name'], spec['fingerprint'])
+                  for spec in record['specs'])
+    return currentSpecFingerprints(stored) == stored
+
+
+def invalidateConversions(names):
+    """Mark the conversions of the graphs using the named specs as stale.
+
+    :returns: The number of graphs affected.
+    """
+    result = ModelImporter.model('graph', 'cis').collection.update_many(
+        {'conversion.specs.name': {'$in': list(names)}},
+        {'$set': {'conversion.stale': True, 'validity': PENDING}})
+    return result.modified_count
+
+
+def revalidateGraph(graphId):
+    """Convert a saved graph again and store the result and its validity.
+
+    Nothing is stored if the graph was saved meanwhile, since saving it
+    converted it too.
+    """
+    graphModel = ModelImporter.model('graph', 'cis')
+    graph = graphModel.load(graphId, force=True,
+                            fields=['content', 'version', 'conversion'])
+    if graph is None or isCurrent(graph):
+        return
+
+    with metrics.timer('revalidate'):
+        record = convert(graph['content'])
+    result = graphModel.collection.update_one(
+        {'_id': graph['_id'], 'version': graph.get('version')},
+        {'$set': {'conversion': record, 'validity': validity(record)}})
+    status = validity(record) if result.matched_count else 'skipped'
+    metrics.increment('cis_revalidations_total', {'result': status})
+    LOGGER.info('Revalidated graph %s: %s', graphId, status)
+
+
+def revalidateGraphs(names):
+    """Queue the revalidation of the graphs using the named specs.
+
+    :returns: The number of graphs queued.
+    """
+    graphIds = [graph['_id'] for graph in ModelImporter.model(
+        'graph', 'cis').findBySpecs(names, fields=['_id'])]
+    for graphId in graphIds:
+        pool.submit(revalidateGraph, graphId)
+    return len(graphIds)
+
+
+def refreshConversion(graph):
+    """Convert a graph document's content unless its conversion is current.
+
+    The document is updated in place but not saved.
+
+    :returns: The conversion record.
+    """
+    if not isCurrent(graph):
+        graph['conversion'] = convert(graph['content'])
+    graph['validity'] = validity(graph['conversion'])
+    return graph['conversion']
+
+
+def getConversion(graph):
+    """Return a saved graph's conversion, converting and storing it if stale.
+
+    As for revalidateGraph, nothing is stored if the graph was saved
+    meanwhile, since saving it converted it too.
+    """
+    if isCurrent(graph):
+        metrics.increment('cis_conversion_cache_total', {'result': 'hit'})
+        return graph['conversion']
+
+    metrics.increment('cis_conversion_cache_total', {'result': 'miss'})
+    graph['conversion'] = convert(graph['content'])
+    graph['validity'] = validity(graph['conversion'])
+    ModelImporter.model('graph', 'cis').collection.update_one(
+        {'_id': graph['_id'], 'version': graph.get('version')},
+        {'$set': {
+            'conversion': graph['conversion'],
+            'validity': graph['validity']
+        }})
+    return graph['conversion']
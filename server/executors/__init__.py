@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*
+"""Execution backends for yggrun graphs.
+
+The backend used for new executions is selected with the cis.executor
+setting.  Each execution job records the backend it was created with in its
+kwargs, so changing the setting does not strand jobs that are in flight.
+"""
+
+import threading
+
+from girder.utility.model_importer import ModelImporter
+
+from ..constants import PluginSettings
+
+EXECUTOR_NAMES = ('kubernetes', 'local')
+
+_executors = {}
+_lock = threading.Lock()
+
+
+class Executor(object):
+    """Interface of an execution backend.
+
+    Executions are Girder jobs whose kwargs hold the job name, the owner's
+    login, the yggrun YAML under 'graph', and whatever the backend added
+    through jobKwargs.
+    """
+
+    name = None
+
+    def jobKwargs(self, user, jobName):
+        """Return backend specific kwargs for a new execution job."""
+        return {}
+
+    def submit(self, job):
+        """Start an execution. Returns True if it was started.
+
+        A job is submitted again if the Girder process that submitted it
+        stopped before marking it running, so the execution may already
+        exist.
+        """
+        raise NotImplementedError()
+
+    def status(self, job):
+        """Return 'running', 'complete', 'failed', or None if not found.
+
+        Returns 'unknown' if the status cannot be determined at the moment,
+        for example while the backend is unreachable.
+        """
+        raise NotImplementedError()
+
+    def logs(self, job):
+        """Return the output of a started execution."""
+        raise NotImplementedError()
+
+    def followLogs(self, job):
+        """Yield the lines of an execution's output as they are written.
+
+        Returns once the execution has finished.
+        """
+        return iter(())
+
+    def cancel(self, job):
+        """Stop an execution. Returns True if it is no longer running."""
+        raise NotImplementedError()
+
+    def cleanup(self, jobs):
+        """Remove the resources and workspaces of finished executions.
+
+        Returns the jobs that were cleaned up; the others are retried later.
+        """
+        raise NotImplementedError()
+
+    def workspace(self, job):
+        """Return the path of an execution's workspace on the Girder host.
+
+        Returns None if the workspace is not reachable from this host.
+        """
+        return None
+
+    def list(self, user, limit, continueToken=None):
+        """List a page of a user's executions known to the backend.
+
+        Returns the executions, as dicts with 'name' and 'created', and the
+        token of the next page or None.
+        """
+        raise NotImplementedError()
+
+
+def getExecutor(name=None):
+    """Return the executor with the given name, or the configured one."""
+    if name is None:
+        name = ModelImporter.model('setting').get(PluginSettings.EXECUTOR)
+
+    with _lock:
+        if name not in _executors:
+            if name == 'kubernetes':
+                from .kubernetes import KubernetesExecutor
+                _executors[name] = KubernetesExecutor()
+            elif name == 'local':
+                from .local import LocalExecutor
+                _executors[name] = LocalExecutor()
+            else:
+                raise ValueError('Unknown executor %s' % name)
+        return _executors[name]
+
+
+def executorForJob(job):
+    """Return the executor that runs an execution job."""
+    return getExecutor(job['kwargs'].get('executor', 'kubernetes'))
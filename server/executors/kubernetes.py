@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*
+"""Executor that runs yggrun as Kubernetes jobs."""
+
+import collections
+import os
+import urllib
+
+from girder.utility.model_importer import ModelImporter
+
+from . import Executor
+from .. import metrics
+from ..constants import PluginSettings
+from ..kubernetes_executor import KubernetesJob, USER_LABEL, session
+from ..log import getLogger
+
+LOGGER = getLogger(__name__)
+
+session.hooks['response'].append(metrics.observeKubernetesResponse)
+
+
+def jupyterUserEncode(username):
+    return urllib.quote_plus(username).replace('.', '%2e').replace('-', '%2d').replace('%', '-')
+
+
+class KubernetesExecutor(Executor):
+    """Runs executions in the user's JupyterHub volume on Kubernetes."""
+
+    name = 'kubernetes'
+
+    # Job must run in same namespace as the PVC
+    namespace = 'hub'
+
+    def jobKwargs(self, user, jobName):
+        # Specify the Docker image and command(s) to run
+        docker_image = "cropsinsilico/jupyterlab:latest"
+        init_command = "mkdir -p /pvc/" + jobName + " && cp -R /pvc/models/* /pvc/" + jobName + " && chown -R 1000:100 /pvc/" + jobName
+
+        # Specify some arbitrary limits
+        return {
+            'namespace': self.namespace,
+            # Encode our username with Jupyter's special homebrew recipe
+            'username': jupyterUserEncode(user['login']),
+            'init_command': init_command,
+            'image': docker_image,
+            'timeout': 300,
+            'num_cpus': 2,
+            'max_ram_mb': 8384,
+        }
+
+    def _job(self, job):
+        """Build the KubernetesJob described by a Girder job's kwargs."""
+        kwargs = job['kwargs']
+        command = kwargs.get('command')
+        if command is None and kwargs.get('graph') is not None:
+            command = "echo '" + str(kwargs['graph']) + "' > graph.yml && echo Running in $(pwd): && ls -al && yggrun graph.yml"
+        return KubernetesJob(kwargs['username'], kwargs['name'],
+                             kwargs['namespace'], kwargs['timeout'],
+                             kwargs['init_command'], command,
+                             kwargs['image'], kwargs['num_cpus'],
+                             kwargs['max_ram_mb'], kwargs.get('ttl'))
+
+    def submit(self, job):
+        k8s_job = self._job(job)
+        return k8s_job.is_running() or k8s_job.submit()
+
+    def status(self, job):
+        return self._job(job).get_status()
+
+    def logs(self, job):
+        return self._job(job).get_error_message()
+
+    def followLogs(self, job):
+        return self._job(job).follow_logs()
+
+    def cancel(self, job):
+        return self._job(job).delete()
+
+    def cleanup(self, jobs):
+        namespaces = collections.defaultdict(list)
+        for job in jobs:
+            namespaces[job['kwargs']['namespace']].append(job)
+
+        cleaned = []
+        for namespace, namespaceJobs in namespaces.items():
+            if not KubernetesJob.delete_all(
+                    namespace, [job['title'] for job in namespaceJobs]):
+                LOGGER.warning('Failed to delete jobs in %s, deleting them '
+                               'one at a time', namespace)
+                namespaceJobs = [job for job in namespaceJobs
+                                 if self._job(job).delete()]
+
+            # The user volume is only mounted inside the cluster
+            for job in namespaceJobs:
+                if self._job(job).cleanup_workspace():
+                    cleaned.append(job)
+                else:
+                    LOGGER.warning('Failed to clean up after %s', job['title'])
+
+            if not KubernetesJob.delete_finished_cleanups(namespace):
+                LOGGER.warning('Failed to delete cleanup jobs in %s',
+                               namespace)
+        return cleaned
+
+    def workspace(self, job):
+        # The user volumes are only reachable when they are also mounted on
+        # the Girder host, one claim-<username> directory per user
+        root = ModelImporter.model('setting').get(
+            PluginSettings.KUBERNETES_VOLUME_ROOT)
+        if not root:
+            return None
+        kwargs = job['kwargs']
+        return os.path.join(root, 'claim-' + kwargs['username'], kwargs['name'])
+
+    def list(self, user, limit, continueToken=None):
+        selector = USER_LABEL + '=' + jupyterUserEncode(user['login'])
+        items, continueToken = KubernetesJob.list_jobs(
+            self.namespace, selector, limit, continueToken)
+        return [{
+            'name': item['name'],
+            'created': item.get('creationTimestamp')
+        } for item in items], continueToken
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*
+"""Executor that runs yggrun in a bounded pool of processes on this host.
+
+Each execution gets a workspace directory holding graph.yml, the id of
+the Girder process that queued it in yggrun.queued, the yggrun output in
+yggrun.log, the process id in yggrun.pid once it has started, the exit
+code in yggrun.exitcode once it has finished and yggrun.cancelled once it
+is cancelled.  Status is derived from these
+files, so any Girder process on the host can report on it.  Executions
+waiting for a free process are reported as running while the Girder
+process that queued them is alive, and as failed once it is gone.
+
+yggrun runs in its own session, so that stopping it also stops the
+processes it started.  Executions cancelled before yggrun started never
+start it.
+"""
+
+import datetime
+import errno
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+import uuid
+
+from girder.utility.model_importer import ModelImporter
+
+from . import Executor
+from ..constants import PluginSettings
+from ..log import getLogger
+from ..pool import WorkerPool
+
+LOGGER = getLogger(__name__)
+
+GRAPH_FILE = 'graph.yml'
+LOG_FILE = 'yggrun.log'
+PID_FILE = 'yggrun.pid'
+QUEUED_FILE = 'yggrun.queued'
+EXITCODE_FILE = 'yggrun.exitcode'
+CANCELLED_FILE = 'yggrun.cancelled'
+
+# Seconds between checks for new output when following a log
+FOLLOW_INTERVAL = 1
+
+# Tells this Girder process apart from an earlier one with the same process
+# id, as after the restart of a container
+INSTANCE = '%d %s' % (os.getpid(), uuid.uuid4().hex)
+
+
+def _readFile(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except IOError:
+        return None
+
+
+def _isAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _killGroup(pid, sig):
+    try:
+        os.killpg(pid, sig)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+class LocalExecutor(Executor):
+    """Runs executions as yggrun processes on the Girder host."""
+
+    name = 'local'
+
+    def __init__(self):
+        """Initialize the executor."""
+        self._pool = WorkerPool('cis-local')
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def jobKwargs(self, user, jobName):
+        root = ModelImporter.model('setting').get(
+            PluginSettings.LOCAL_WORKSPACE_ROOT)
+        return {
+            'workspace': os.path.join(root, user['login'], jobName),
+            'timeout': 300,
+        }
+
+    def submit(self, job):
+        kwargs = job['kwargs']
+        workspace = kwargs['workspace']
+        settingModel = ModelImporter.model('setting')
+
+        if os.path.isdir(workspace):
+            # Submitted by a Girder process that stopped before marking the
+            # job running.  yggrun is not started twice in a workspace.
+            if os.path.exists(os.path.join(workspace, PID_FILE)):
+                return True
+            shutil.rmtree(workspace)
+
+        # Mirror the Kubernetes init container, which copies the user's
+        # models next to the graph
+        modelsDir = settingModel.get(PluginSettings.LOCAL_MODELS_DIR)
+        if modelsDir:
+            shutil.copytree(modelsDir, workspace)
+        else:
+            os.makedirs(workspace)
+        with open(os.path.join(workspace, GRAPH_FILE), 'w') as f:
+            f.write(kwargs['graph'])
+        with open(os.path.join(workspace, QUEUED_FILE), 'w') as f:
+            f.write(INSTANCE)
+
+        with self._lock:
+            self._pending.add(workspace)
+        self._pool.start(settingModel.get(PluginSettings.LOCAL_POOL_SIZE))
+        self._pool.submit(self._run, workspace, kwargs['timeout'])
+        return True
+
+    def _run(self, workspace, timeout):
+        cancelled = os.path.join(workspace, CANCELLED_FILE)
+        try:
+            with open(os.path.join(workspace, LOG_FILE), 'w') as log:
+                if os.path.exists(cancelled):
+                    log.write('Cancelled before it started.\n')
+                    self._writeExitCode(workspace, -signal.SIGTERM)
+                    return
+                try:
+                    process = subprocess.Popen(
+                        ['yggrun', GRAPH_FILE], cwd=workspace, stdout=log,
+                        stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+                except OSError as e:
+                    log.write('Failed to start yggrun: %s\n' % e)
+                    self._writeExitCode(workspace, 127)
+                    return
+            with open(os.path.join(workspace, PID_FILE), 'w') as f:
+                f.write(str(process.pid))
+            # cancel writes its file before reading the pid file, so either
+            # it signals the process or the process is stopped here
+            if os.path.exists(cancelled):
+                _killGroup(process.pid, signal.SIGTERM)
+
+            timer = threading.Timer(timeout, _killGroup,
+                                    args=(process.pid, signal.SIGKILL))
+            timer.start()
+            try:
+                code = process.wait()
+            finally:
+                timer.cancel()
+            self._writeExitCode(workspace, code)
+        finally:
+            with self._lock:
+                self._pending.discard(workspace)
+
+    def _writeExitCode(self, workspace, code):
+        with open(os.path.join(workspace, EXITCODE_FILE), 'w') as f:
+            f.write(str(code))
+
+    def status(self, job):
+        workspace = job['kwargs']['workspace']
+        code = _readFile(os.path.join(workspace, EXITCODE_FILE))
+        if code is not None:
+            return 'complete' if int(code) == 0 else 'failed'
+
+        with self._lock:
+            if workspace in self._pending:
+                return 'running'
+
+        pid = _readFile(os.path.join(workspace, PID_FILE))
+        if pid is not None:
+            # A process that died without recording its exit code was lost
+            # along with the Girder process that was waiting on it
+            return 'running' if _isAlive(int(pid)) else 'failed'
+
+        # Still waiting for a slot in the process pool, unless the Girder
+        # process holding the pool has stopped
+        queuedBy = _readFile(os.path.join(workspace, QUEUED_FILE))
+        if queuedBy is not None:
+            pid = int(queuedBy.split()[0])
+            if pid == os.getpid():
+                alive = queuedBy == INSTANCE
+            else:
+                alive = _isAlive(pid)
+            return 'running' if alive else 'failed'
+        return None
+
+    def logs(self, job):
+        logs = _readFile(os.path.join(job['kwargs']['workspace'], LOG_FILE))
+        if logs is None:
+            if self.status(job) == 'failed':
+                return 'The Girder process that queued this execution ' \
+                    'stopped before it started.\n'
+            return "Please wait, fetching logs..."
+        return logs
+
+    def followLogs(self, job):
+        workspace = job['kwargs']['workspace']
+        logPath = os.path.join(workspace, LOG_FILE)
+        exitPath = os.path.join(workspace, EXITCODE_FILE)
+
+        while not os.path.exists(logPath):
+            if self.status(job) != 'running':
+                return
+            time.sleep(FOLLOW_INTERVAL)
+
+        with open(logPath, 'r') as log:
+            partial = ''
+            while True:
+                # Check before reading, so that the final read sees all of
+                # the output of a finished process
+                finished = os.path.exists(exitPath) or \
+                    self.status(job) != 'running'
+                data = log.read()
+                if data:
+                    lines = (partial + data).split('\n')
+                    partial = lines.pop()
+                    for line in lines:
+                        yield line
+                elif finished:
+                    if partial:
+                        yield partial
+                    return
+                else:
+                    time.sleep(FOLLOW_INTERVAL)
+
+    def cancel(self, job):
+        workspace = job['kwargs']['workspace']
+        try:
+            with open(os.path.join(workspace, CANCELLED_FILE), 'w'):
+                pass
+        except IOError:
+            # Not submitted yet
+            return True
+        pid = _readFile(os.path.join(workspace, PID_FILE))
+        if pid is not None and _isAlive(int(pid)):
+            _killGroup(int(pid), signal.SIGTERM)
+        return True
+
+    def cleanup(self, jobs):
+        for job in jobs:
+            shutil.rmtree(job['kwargs']['workspace'], ignore_errors=True)
+        return jobs
+
+    def workspace(self, job):
+        return job['kwargs']['workspace']
+
+    def list(self, user, limit, continueToken=None):
+        root = ModelImporter.model('setting').get(
+            PluginSettings.LOCAL_WORKSPACE_ROOT)
+        userDir = os.path.join(root, user['login'])
+        try:
+            names = sorted(os.listdir(userDir))
+        except OSError:
+            names = []
+
+        offset = int(continueToken or 0)
+        page = names[offset:offset + limit]
+        if offset + limit < len(names):
+            continueToken = str(offset + limit)
+        else:
+            continueToken = None
+
+        return [{
+            'name': name,
+            'created': datetime.datetime.utcfromtimestamp(
+                os.path.getctime(os.path.join(userDir, name)))
+        } for name in page], continueToken
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*
+"""JSON Patch (RFC 6902) for graph documents.
+
+applyPatch applies a patch to a copy of a document and also reports which
+parts of the document changed, as MongoDB field paths.  Saving only those
+fields with $set and $unset keeps an edit that moves one node from
+rewriting the whole graph.
+"""
+
+import copy
+
+import six
+
+OPERATIONS = ('add', 'remove', 'replace', 'move', 'copy', 'test')
+
+
+class JsonPatchError(ValueError):
+    """Raised when a patch is malformed or does not apply."""
+
+
+class JsonPatchTestFailed(JsonPatchError):
+    """Raised when a test operation of a patch fails."""
+
+
+def parsePointer(pointer):
+    """Split a JSON Pointer (RFC 6901) into its reference tokens."""
+    if not isinstance(pointer, six.string_types):
+        raise JsonPatchError('Invalid JSON pointer %r' % (pointer,))
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise JsonPatchError('Invalid JSON pointer %s' % pointer)
+    return [token.replace('~1', '/').replace('~0', '~')
+            for token in pointer[1:].split('/')]
+
+
+def _index(array, token, allowEnd=False):
+    if token == '-' and allowEnd:
+        return len(array)
+    if not token.isdigit() or (token != '0' and token.startswith('0')):
+        raise JsonPatchError('Invalid array index %s' % token)
+    index = int(token)
+    if index > len(array) or (index == len(array) and not allowEnd):
+        raise JsonPatchError('Array index %s is out of range' % token)
+    return index
+
+
+def _get(doc, tokens):
+    for token in tokens:
+        if isinstance(doc, dict):
+            if token not in doc:
+                raise JsonPatchError('Path /%s does not exist'
+                                     % '/'.join(tokens))
+            doc = doc[token]
+        elif isinstance(doc, list):
+            doc = doc[_index(doc, token)]
+        else:
+            raise JsonPatchError('Path /%s does not exist' % '/'.join(tokens))
+    return doc
+
+
+def _add(doc, tokens, value):
+    if not tokens:
+        return value
+    parent = _get(doc, tokens[:-1])
+    if isinstance(parent, dict):
+        parent[tokens[-1]] = value
+    elif isinstance(parent, list):
+        parent.insert(_index(parent, tokens[-1], allowEnd=True), value)
+    else:
+        raise JsonPatchError('Cannot add to /%s' % '/'.join(tokens))
+    return doc
+
+
+def _remove(doc, tokens):
+    if not tokens:
+        raise JsonPatchError('Cannot remove the whole document')
+    parent = _get(doc, tokens[:-1])
+    value = _get(parent, tokens[-1:])
+    if isinstance(parent, dict):
+        del parent[tokens[-1]]
+    else:
+        del parent[_index(parent, tokens[-1])]
+    return value
+
+
+def _touchedPath(old, new, tokens):
+    """Return the tokens of the field to save for a change at tokens.
+
+    Changes inside arrays save the whole array, since inserting or removing
+    an element moves the ones after it.  Keys MongoDB cannot address in a
+    field path also save their parent.
+    """
+    path = []
+    for token in tokens:
+        if isinstance(old, list) or isinstance(new, list) or \
+                not (isinstance(old, dict) or isinstance(new, dict)):
+            break
+        if not token or '.' in token or token.startswith('$'):
+            break
+        path.append(token)
+        old = old.get(token) if isinstance(old, dict) else None
+        new = new.get(token) if isinstance(new, dict) else None
+    return path
+
+
+def applyPatch(doc, patch, inPlace=False):
+    """Apply a JSON Patch to a copy of a document.
+
+    :param doc: The document to patch.
+    :param patch: The list of patch operations.
+    :param inPlace: Patch the document itself instead of a copy, in which
+        case it is left partially patched if an operation fails.
+    :returns: The patched document, and the list of the paths, as lists of
+        keys, whose values must be saved; a path missing from the patched
+        document was removed.
+    """
+    if not isinstance(patch, list):
+        raise JsonPatchError('A patch must be a list of operations')
+
+    result = doc if inPlace else copy.deepcopy(doc)
+    changed = []
+    for operation in patch:
+        if not isinstance(operation, dict) or \
+                operation.get('op') not in OPERATIONS:
+            raise JsonPatchError('Invalid patch operation %r' % (operation,))
+        op = operation['op']
+        if 'path' not in operation:
+            raise JsonPatchError('The %s operation needs a path' % op)
+        tokens = parsePointer(operation['path'])
+        if op in ('add', 'replace', 'test') and 'value' not in operation:
+            raise JsonPatchError('The %s operation needs a value' % op)
+        if op in ('move', 'copy'):
+            if 'from' not in operation:
+                raise JsonPatchError('The %s operation needs from' % op)
+            source = parsePointer(operation['from'])
+
+        if op == 'test':
+            if _get(result, tokens) != operation['value']:
+                raise JsonPatchTestFailed(
+                    'Test of %s failed' % operation['path'])
+            continue
+
+        if op == 'add':
+            result = _add(result, tokens, copy.deepcopy(operation['value']))
+        elif op == 'remove':
+            _remove(result, tokens)
+        elif op == 'replace':
+            if tokens:
+                _remove(result, tokens)
+            result = _add(result, tokens, copy.deepcopy(operation['value']))
+        elif op == 'move':
+            if tokens[:len(source)] == source and tokens != source:
+                raise JsonPatchError('Cannot move %s into itself'
+                                     % operation['from'])
+            result = _add(result, tokens, _remove(result, source))
+            changed.append(source)
+        elif op == 'copy':
+            result = _add(result, tokens,
+                          copy.deepcopy(_get(result, source)))
+        changed.append(tokens)
+
+    if inPlace:
+        return result, None
+
+    paths = sorted(_touchedPath(doc, result, tokens) for tokens in changed)
+    saved = []
+    for path in paths:
+        if not any(path[:len(other)] == other for other in saved):
+            saved.append(path)
+    return result, saved
+
+
+def _escape(key):
+    return key.replace('~', '~0').replace('/', '~1')
+
+
+def _diff(old, new, pointer, patch):
+    if old == new:
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                patch.append({'op': 'remove',
+                              'path': pointer + '/' + _escape(key)})
+        for key in new:
+            if key not in old:
+                patch.append({'op': 'add', 'path': pointer + '/' + _escape(key),
+                              'value': new[key]})
+            else:
+                _diff(old[key], new[key], pointer + '/' + _escape(key), patch)
+    elif isinstance(old, list) and isinstance(new, list):
+        # Skip the unchanged ends, so that inserting or removing one element
+        # produces one operation
+        shortest = min(len(old), len(new))
+        start = 0
+        while start < shortest and old[start] == new[start]:
+            start += 1
+        end = 0
+        while end < shortest - start and old[-1 - end] == new[-1 - end]:
+            end += 1
+        oldMiddle = old[start:len(old) - end]
+        newMiddle = new[start:len(new) - end]
+        common = min(len(oldMiddle), len(newMiddle))
+        for i in range(common):
+            _diff(oldMiddle[i], newMiddle[i], '%s/%d' % (pointer, start + i),
+                  patch)
+        for i in reversed(range(start + common, start + len(oldMiddle))):
+            patch.append({'op': 'remove', 'path': '%s/%d' % (pointer, i)})
+        for i in range(common, len(newMiddle)):
+            patch.append({'op': 'add', 'path': '%s/%d' % (pointer, start + i),
+                          'value': newMiddle[i]})
+    else:
+        patch.append({'op': 'replace', 'path': pointer, 'value': new})
+
+
+def makePatch(old, new):
+    """Return a JSON Patch that turns one document into another.
+
+    The size of the patch grows with the size of the difference.
+    """
+    patch = []
+    _diff(old, new, '', patch)
+    return patch
@@ -12,7 +12,8 @@
    Variable Name              (Default Value)
    ------------------------------------------------
    - RUNLEVEL                 ('development')
-   - TOKEN_FILE_PATH          ('/var/run/secrets/kubernetes.io/serviceaccount/token')
+   - TOKEN_FILE_PATH          ('/var/run/secrets/kubernetes.io/serviceaccount/token',
+                               read on first use and whenever it changes)
    - NODE_LABEL_NAME          ('')
    - NODE_LABEL_VALUE         ('')
    - KUBERNETES_SERVICE_HOST  ('10.0.0.1')
@@ -20,27 +21,87 @@
 """
 
 import time
-import logging
 import os
 import json
+import threading
 
 import requests
 
-LOGGER = logging.getLogger(__name__)
-LOGGER.setLevel(logging.INFO)
+from .log import getLogger
+
+LOGGER = getLogger(__name__)
 
 RUNLEVEL = os.getenv('RUNLEVEL', 'development')
 
-# Read Kubernetes auth token from the ServiceAccount file on disk
+# Shared by all API requests, so that connections to the API server are
+# reused; callers may add response hooks to observe requests
+session = requests.Session()
+
+# Kubernetes auth token from the ServiceAccount file on disk
 token_file_path = os.getenv(\
     'TOKEN_FILE_PATH', '/var/run/secrets/kubernetes.io/serviceaccount/token')
-token_file = open(token_file_path, 'r')
-auth_token = token_file.read()
-default_headers = {
-    'Content-Type': 'application/json',
-    'Authorization': 'Bearer ' + auth_token
+_token_lock = threading.Lock()
+_token_cache = {'mtime': None, 'headers': None}
+
+
+def get_default_headers():
+    """Returns the headers to send with every Kubernetes API request.
+
+    The ServiceAccount token is read on first use rather than at import, and
+    is read again whenever the token file changes, since bound ServiceAccount
+    tokens expire and are rotated by the kubelet.
+
+    Returns:
+        dict: The request headers.
+
+    Raises:
+        RuntimeError: If the token file cannot be read, as happens outside
+            of a Kubernetes cluster unless TOKEN_FILE_PATH is set.
+
+    """
+    try:
+        mtime = os.stat(token_file_path).st_mtime
+    except OSError as e:
+        raise RuntimeError('Cannot read the Kubernetes token from %s (%s); '
+                           'set TOKEN_FILE_PATH outside of a cluster' %
+                           (token_file_path, e.strerror))
+    with _token_lock:
+        if _token_cache['mtime'] != mtime:
+            LOGGER.debug('Reading Kubernetes token from %s', token_file_path)
+            with open(token_file_path, 'r') as token_file:
+                auth_token = token_file.read().strip()
+            _token_cache['headers'] = {
+                'Content-Type': 'application/json',
+                'Authorization': 'Bearer ' + auth_token
+            }
+            _token_cache['mtime'] = mtime
+        return _token_cache['headers']
+
+# Label identifying a job by name, used to select jobs in bulk
+JOB_LABEL = 'cis-job'
+
+# Label identifying the owner of a job, used to list a user's jobs
+USER_LABEL = 'cis-user'
+
+# Label marking the jobs that remove the workspace of another job
+CLEANUP_LABEL = 'cis-cleanup'
+
+# The number of jobs fetched per page when listing
+LIST_PAGE_SIZE = 500
+
+# Ask for object metadata only when listing, or whole objects as a fallback
+metadata_accept = 'application/json;as=PartialObjectMetadataList;' + \
+    'g=meta.k8s.io;v=v1,application/json'
+
+# The maximum number of jobs deleted by a single request
+DELETE_BATCH_SIZE = 100
+
+# Delete dependent pods in the background, through garbage collection
+delete_options = {
+    'kind': 'DeleteOptions',
+    'apiVersion': 'v1',
+    'propagationPolicy': 'Background'
 }
-token_file.close()
 
 class KubernetesJob(object):
     """Base class for jobs that run remotely via Kubernetes."""
@@ -57,7 +118,7 @@ class KubernetesJob(object):
     kubernetes_apiuri = os.getenv('KUBERNETES_SERVICE_HOST', '10.0.0.1') + ':' + \
         str(os.getenv('KUBERNETES_SERVICE_PORT', 443))
       
-    def __init__(self, username, job_name, namespace, timeout, init_command, command, docker_image, num_cpus, max_ram_mb):
+    def __init__(self, username, job_name, namespace, timeout, init_command, command, docker_image, num_cpus, max_ram_mb, ttl_seconds_after_finished=None):
         """Initializes self.
 
         Args:
@@ -71,6 +132,9 @@ class KubernetesJob(object):
                 AWS m4.xl is 4 CPUs.
             max_ram_mb (int): The maximum RAM in megabytes to allocate for the
                 job. Note AWS m4.xl is 16 GB.
+            ttl_seconds_after_finished (int): If set, Kubernetes deletes the
+                job and its pods this many seconds after it finishes. Requires
+                the TTLAfterFinished feature on the cluster.
 
         Returns:
             None: None.
@@ -86,6 +150,7 @@ class KubernetesJob(object):
         self.username = username
         self.init_command = init_command
         self.command = command
+        self.ttl_seconds_after_finished = ttl_seconds_after_finished
 
         # CPU is measured in microns (m) or integers, where 1000m = 1 CPU
         # RAM is measured in MB (M) or GB (G)
@@ -124,7 +189,8 @@ class KubernetesJob(object):
             command (str): The command to run inside the container.
 
         Returns:
-            None: None.
+            boolean: True if the job was submitted or is already running,
+                else False.
 
         """
         LOGGER.debug('KubernetesJob.submit')
@@ -138,7 +204,15 @@ class KubernetesJob(object):
             "apiVersion": "batch/v1",
             "kind": "Job",
             # TODO: Fix hard-coded namespace
-            "metadata": {"name": self.job_name, "namespace": self.namespace},
+            "metadata": {
+                "name": self.job_name,
+                "namespace": self.namespace,
+                "labels": {
+                    "app": "cis",
+                    JOB_LABEL: self.job_name,
+                    USER_LABEL: self.username
+                }
+            },
             "spec": {
                 # FIXME: due to k8s bug, not currently
                 # working when restartPolicy=OnFailure
@@ -210,6 +284,10 @@ class KubernetesJob(object):
             }
         }
         
+        if self.ttl_seconds_after_finished is not None:
+            payload['spec']['ttlSecondsAfterFinished'] = \
+                self.ttl_seconds_after_finished
+
         if self.init_command is not None:
             payload['spec']['template']['spec']['initContainers'] = [
                 {
@@ -238,7 +316,7 @@ class KubernetesJob(object):
                     "name": vol_name,
                     "persistentVolumeClaim": {"claimName": "nfs-" + vol_name}
                 }
-                LOGGER.info('Converted to Kubernetes volume: ' + json.dumps(volume))
+                LOGGER.info('Converted to Kubernetes volume: %s', volume)
                 volumes.append(volume)
 
             payload['spec']['template']['spec']['volumes'] = volumes
@@ -254,17 +332,17 @@ class KubernetesJob(object):
                     payload['spec']['template']['spec']['nodeSelector'][KubernetesJob.node_label_name] = \
                         True
 
-            LOGGER.info('Production job payload: ' + json.dumps(payload))
+            LOGGER.info('Production job payload: %s', payload)
 
         # submit to Kubernetes
-        LOGGER.debug('>>> Submitting payload: ' + json.dumps(payload))
-        LOGGER.info('Starting ' + self.job_name + '...')
+        LOGGER.debug('>>> Submitting payload: %s', payload)
+        LOGGER.info('Starting %s...', self.job_name)
         master_host = 'https://' + \
             KubernetesJob.kubernetes_apiuri + \
             '/apis/batch/v1/namespaces/' + self.namespace + '/jobs'
-        response = requests.post(master_host, json=payload, \
-            headers=default_headers, verify=False)
-        is_response_ok(response, 1, -1)
+        response = session.post(master_host, json=payload, \
+            headers=get_default_headers(), verify=False)
+        return is_response_ok(response, 1, -1)
 
     def is_running(self):
         """Returns True if the job is running, else False.
@@ -278,8 +356,8 @@ class KubernetesJob(object):
         url = 'https://' + KubernetesJob.kubernetes_apiuri + \
             '/apis/batch/v1/namespaces/' + self.namespace + '/jobs/' + self.job_name
 
-        LOGGER.debug('Checking that job exists: ' + url)
-        response = requests.get(url, headers=default_headers, verify=False)
+        LOGGER.debug('Checking that job exists: %s', url)
+        response = session.get(url, headers=get_default_headers(), verify=False)
         ok = is_response_ok(response, 1, -1)
         # If no exception was raised, our request returned a response
         return ok
@@ -296,27 +374,139 @@ class KubernetesJob(object):
 
         url = 'https://' + KubernetesJob.kubernetes_apiuri + \
                 '/apis/batch/v1/namespaces/' + self.namespace + '/jobs/' + self.job_name
-        LOGGER.debug('Getting job status from ' + url)
-        request_lambda = lambda: requests.get(\
-            url, headers=default_headers, verify=False)
+        LOGGER.debug('Getting job status from %s', url)
+        request_lambda = lambda: session.get(\
+            url, headers=get_default_headers(), verify=False)
         k8s_response = retry_request_until_ok(request_lambda, 1, 2)
         return_val = False
         if k8s_response is not None:
             json_resp = json.loads(k8s_response.text)
-            LOGGER.debug('>>> Got response: ' + k8s_response.text)
+            LOGGER.debug('>>> Got response: %s', k8s_response.text)
             status = json_resp['status']
             if 'conditions' in status:
                 conditions = status['conditions']
                 for condition in conditions:
                     if 'type' in condition and condition['type'] == "Failed":
                         return_val = condition['status'] == 'True'
-                        LOGGER.debug(self.job_name + ' is failed? ' + \
-                            str(return_val))
+                        LOGGER.debug('%s is failed? %s', self.job_name,
+                                     return_val)
             else:
-                LOGGER.debug('No job status conditions found: ' + \
-                    str(return_val))
+                LOGGER.debug('No job status conditions found: %s',
+                             return_val)
         return return_val
 
+    def cleanup_workspace(self):
+        """Removes the job's working directory from the user's volume.
+
+        The volume is not mounted outside of the cluster, so this submits a
+        short-lived job that deletes the directory.  The cleanup job carries
+        the job label of the job it cleans up after, so delete_all removes
+        both, and delete_finished_cleanups removes it once it has succeeded.
+
+        Returns:
+            boolean: True if the cleanup job was submitted or already exists,
+                else False.
+
+        """
+        LOGGER.debug('KubernetesJob.cleanup_workspace')
+
+        cleanup_name = self.job_name + '-cleanup'
+        if RUNLEVEL == 'production':
+            claim_name = 'nfs-userdata'
+        else:
+            claim_name = 'claim-' + self.username
+
+        payload = {
+            "apiVersion": "batch/v1",
+            "kind": "Job",
+            "metadata": {
+                "name": cleanup_name,
+                "namespace": self.namespace,
+                "labels": {
+                    "app": "cis",
+                    JOB_LABEL: self.job_name,
+                    CLEANUP_LABEL: "true"
+                }
+            },
+            "spec": {
+                # Only honored where the TTLAfterFinished feature is enabled
+                "ttlSecondsAfterFinished": 0,
+                "activeDeadlineSeconds": 300,
+                "template": {
+                    "metadata": {"name": cleanup_name},
+                    "spec": {
+                        "restartPolicy": "OnFailure",
+                        "containers": [
+                            {
+                                "name": cleanup_name,
+                                "image": "alpine",
+                                "command": ["bin/sh"],
+                                "args": ["-c", "rm -rf " + KubernetesJob.user_pvc_mount_path + "/" + self.job_name],
+                                "volumeMounts": [
+                                    {
+                                        "name": "userdata",
+                                        "mountPath": KubernetesJob.user_pvc_mount_path
+                                    }
+                                ]
+                            }
+                        ],
+                        "volumes": [
+                            {
+                                "name": "userdata",
+                                "persistentVolumeClaim": {"claimName": claim_name}
+                            }
+                        ]
+                    }
+                }
+            }
+        }
+
+        LOGGER.info('Cleaning up workspace of %s...', self.job_name)
+        master_host = 'https://' + \
+            KubernetesJob.kubernetes_apiuri + \
+            '/apis/batch/v1/namespaces/' + self.namespace + '/jobs'
+        response = session.post(master_host, json=payload, \
+            headers=get_default_headers(), verify=False)
+        if response.status_code == 409:
+            # Submitted by an earlier attempt
+            return True
+        return is_response_ok(response, 1, -1)
+
+    def get_status(self):
+        """Returns the state of the job in a single request.
+
+        Returns:
+            str: 'complete' or 'failed' once the job has finished, 'running'
+                while it has not, 'unknown' if the API server could not be
+                asked, or None if the job does not exist.
+
+        """
+        LOGGER.debug('KubernetesJob.get_status')
+
+        url = 'https://' + KubernetesJob.kubernetes_apiuri + \
+            '/apis/batch/v1/namespaces/' + self.namespace + '/jobs/' + self.job_name
+        LOGGER.debug('Getting job status from %s', url)
+        try:
+            k8s_response = session.get(url, headers=get_default_headers(), \
+                verify=False)
+        except requests.exceptions.RequestException as e:
+            LOGGER.warning('Cannot get the status of %s: %s', self.job_name, e)
+            return 'unknown'
+        if k8s_response.status_code == 404:
+            return None
+        if not is_response_ok(k8s_response, 1, None):
+            return 'unknown'
+
+        status = k8s_response.json().get('status', {})
+        for condition in status.get('conditions', []):
+            if condition.get('status') != 'True':
+                continue
+            if condition.get('type') == 'Complete':
+                return 'complete'
+            if condition.get('type') == 'Failed':
+                return 'failed'
+        return 'running'
+
     def get_error_message(self):
         """Returns the error message if this job has failed, else returns None.
 
@@ -328,7 +518,7 @@ class KubernetesJob(object):
         # TODO: this has not been tested very thoroughly
 
         LOGGER.debug('KubernetesJob.get_error_message')
-        LOGGER.debug(' >>> Reading error message for: ' + self.job_name)
+        LOGGER.debug(' >>> Reading error message for: %s', self.job_name)
 
         # Look up the pod_name for this job
         pods_url = 'https://' + \
@@ -336,9 +526,9 @@ class KubernetesJob(object):
             '/api/v1/namespaces/' + self.namespace + '/pods?labelSelector=job-name%3D' + \
             self.job_name
 
-        LOGGER.debug('Getting pod name from ' + pods_url)
-        request_lambda = lambda: requests.get(\
-            pods_url, headers=default_headers, verify=False)
+        LOGGER.debug('Getting pod name from %s', pods_url)
+        request_lambda = lambda: session.get(\
+            pods_url, headers=get_default_headers(), verify=False)
         k8s_response = retry_request_until_ok(request_lambda, 3, 1)
         return_val = "Please wait, fetching logs..."
         if k8s_response is not None:
@@ -350,26 +540,77 @@ class KubernetesJob(object):
             # FIXME: We assume there is only one matching job
             job_pod = job_pods['items'][0]
             pod_name = job_pod['metadata']['name']
-            LOGGER.debug('>>> Got pod name: ' + pod_name)
+            LOGGER.debug('>>> Got pod name: %s', pod_name)
 
             # Then read and return the logs from that pod
             logs_url = 'https://' + \
                 KubernetesJob.kubernetes_apiuri + \
                 '/api/v1/namespaces/' + self.namespace + '/pods/' + pod_name + '/log'
 
-            LOGGER.debug('Getting logs from ' + logs_url)
-            request_lambda2 = lambda: requests.get(\
-                logs_url, headers=default_headers, verify=False)
+            LOGGER.debug('Getting logs from %s', logs_url)
+            request_lambda2 = lambda: session.get(\
+                logs_url, headers=get_default_headers(), verify=False)
             k8s_response2 = retry_request_until_ok(request_lambda2, 3, 1)
             if k8s_response2 is not None:
                 return_val = k8s_response2.text
-                LOGGER.debug('Got logs: ' + return_val)
+                LOGGER.debug('Got logs: %s', return_val)
             else:
                 return_val = "Please wait, fetching logs..."
         else:
             return_val = "Error reading logs"
         return return_val
 
+    def follow_logs(self, poll_seconds=5):
+        """Yields the lines of the job's log as they are written.
+
+        Waits for the job's pod to start, then streams its log until the
+        container exits. Returns early if the job finishes or disappears
+        before its log could be opened.
+
+        Args:
+            poll_seconds (float): The number of seconds to wait between
+                attempts to open the log.
+
+        Yields:
+            str: Each line of the log.
+
+        """
+        LOGGER.debug('KubernetesJob.follow_logs')
+
+        pods_url = 'https://' + \
+            KubernetesJob.kubernetes_apiuri + \
+            '/api/v1/namespaces/' + self.namespace + '/pods?labelSelector=job-name%3D' + \
+            self.job_name
+
+        while True:
+            pods_response = session.get(\
+                pods_url, headers=get_default_headers(), verify=False)
+            if is_response_ok(pods_response, 1, poll_seconds) and \
+                    pods_response.json()['items']:
+                pod_name = pods_response.json()['items'][0]['metadata']['name']
+                logs_url = 'https://' + \
+                    KubernetesJob.kubernetes_apiuri + \
+                    '/api/v1/namespaces/' + self.namespace + '/pods/' + \
+                    pod_name + '/log'
+
+                # The log is unavailable until the container has started
+                LOGGER.debug('Following logs from %s', logs_url)
+                logs_response = session.get(logs_url, \
+                    params={'follow': 'true'}, stream=True, \
+                    headers=get_default_headers(), verify=False)
+                if logs_response.status_code == 200:
+                    try:
+                        for line in logs_response.iter_lines():
+                            yield line
+                    finally:
+                        logs_response.close()
+                    return
+                logs_response.close()
+
+            if self.get_status() not in ('running', 'unknown'):
+                return
+            time.sleep(poll_seconds)
+
     def is_done(self):
         """Returns True if the job is done, else returns False. TODO confirm
         behavior if done but deleted.
@@ -383,113 +624,167 @@ class KubernetesJob(object):
         url = 'https://' + KubernetesJob.kubernetes_apiuri + \
             '/apis/batch/v1/namespaces/' + self.namespace + '/jobs/' + self.job_name
 
-        LOGGER.debug('Getting job status from ' + url)
-        request_lambda = lambda: requests.get(\
-            url, headers=default_headers, verify=False)
+        LOGGER.debug('Getting job status from %s', url)
+        request_lambda = lambda: session.get(\
+            url, headers=get_default_headers(), verify=False)
         k8s_response = retry_request_until_ok(request_lambda, 1, 0)
         return_val = False
         if k8s_response is not None:
             json_resp = json.loads(k8s_response.text)
-            LOGGER.debug('>>> Got response: ' + k8s_response.text)
+            LOGGER.debug('>>> Got response: %s', k8s_response.text)
             status = json_resp['status']
             if 'conditions' in status:
                 conditions = status['conditions']
                 for condition in conditions:
                     if 'type' in condition and condition['type'] == "Complete":
                         return_val = condition['status'] == 'True'
-                        LOGGER.debug(self.job_name + ' is done? ' + \
-                            str(return_val))
+                        LOGGER.debug('%s is done? %s', self.job_name,
+                                     return_val)
             else:
-                LOGGER.debug('No job status conditions found: ' + str(return_val))
+                LOGGER.debug('No job status conditions found: %s', return_val)
         return return_val
 
     def delete(self):
-        """Deletes the job from Kubernetes. Note that while `kubectl delete job`
-        will also clean up the remaining pods, the REST API apparently does not
-        share this behavior. So we make a few extra REST calls to scale down and
-        clean up any leftover pod resources.
+        """Deletes the job from Kubernetes, along with its pods.
+
+        The pods are removed by the garbage collector through background
+        propagation, so this is a single request that does not wait for
+        them to terminate.
 
         Returns:
-            None: None.
+            boolean: True if the job was deleted or did not exist, else False.
 
         """
-        k8s_hostname = 'https://' + \
-            KubernetesJob.kubernetes_apiuri
-        jobs_url = k8s_hostname + '/apis/batch/v1/namespaces/' + self.namespace + '/jobs/' + \
+        LOGGER.debug('KubernetesJob.delete')
+
+        jobs_url = 'https://' + KubernetesJob.kubernetes_apiuri + \
+            '/apis/batch/v1/namespaces/' + self.namespace + '/jobs/' + \
             self.job_name
 
-        # Get current Job object to scale it down
-        LOGGER.debug('Removing orphaned job pods for ' + str(self.job_name))
-        jobs_get_response = requests.get(\
-            jobs_url, headers=default_headers, verify=False)
-        ok = is_response_ok(jobs_get_response, 1, -1)
-        if ok:
-            # Scale current number of Pods for the Job down to zero
-            job_json = jobs_get_response.json()
-            job_json['spec']['parallelism'] = 0
-            LOGGER.debug('Changing job parallelism to zero...')
-            jobs_put_response = requests.put(jobs_url, data=json.dumps(job_json), \
-                headers=default_headers, verify=False)
-            ok = is_response_ok(jobs_put_response, 1, -1)
-        if ok:
-            # Check for any leftover pod replicas
-            LOGGER.debug('Looking up job uid: ' + str(self.job_name))
-            job_controller_uid = job_json['metadata']['labels']['controller-uid']
-
-            # NOTE: "%3D" is a URL-encoded equal sign ("=")
-            pod_list_url = k8s_hostname + '/api/v1/namespaces/' + self.namespace + '/pods?' + \
-                'labelSelector=controller-uid%3D' + str(job_controller_uid)
-
-            continue_deleting = True
-            while continue_deleting:
-                pod_list_response = requests.get(\
-                    pod_list_url, headers=default_headers, verify=False)
-                ok = is_response_ok(pod_list_response, 1, -1)
-
-                orphaned_pod_list = pod_list_response.json()
-                LOGGER.debug('Checking for orphaned job pods for: ' + \
-                    str(self.job_name))
-                if not orphaned_pod_list['items']:
-                    LOGGER.info('All pods removed for job: ' + \
-                        str(self.job_name))
-                    continue_deleting = False
-                else:
-                    LOGGER.debug('Orphaned pod found!')
-                    orphan_pod = orphaned_pod_list['items'][0]
-                    pod_name = orphan_pod['metadata']['name']
-                    LOGGER.debug('Deleting orphaned pod: ' + str(pod_name))
-                    pod_delete_url = k8s_hostname + \
-                        '/api/v1/namespaces/' + self.namespace + '/pods/' + pod_name
-                    pod_delete_response = requests.delete(pod_delete_url, \
-                        headers=default_headers, verify=False)
-                    if is_response_ok(pod_delete_response, 1, -1):
-                        LOGGER.debug('Pod deleted: ' + str(pod_name))
-
-            # Then delete the Job itself
-            LOGGER.debug('Deleting job: ' + self.job_name)
-            job_delete_response = requests.delete(jobs_url, \
-                headers=default_headers, verify=False)
-            ok = is_response_ok(job_delete_response, 1, -1)
-
-            LOGGER.debug('Job successfully deleted!')
+        LOGGER.debug('Deleting job: %s', self.job_name)
+        response = session.delete(jobs_url, json=delete_options, \
+            headers=get_default_headers(), verify=False)
+        if response.status_code == 404:
+            return True
+        return is_response_ok(response, 1, -1)
 
     @staticmethod
-    def get_all_job_names():
-        """Returns all job names known to Kubernetes.
+    def delete_all(namespace, job_names):
+        """Deletes many jobs, along with their pods, using one deletecollection
+        request per batch of names.
+
+        Only jobs carrying the labels added by submit() are matched, along
+        with the cleanup jobs submitted for them by cleanup_workspace().
+
+        Args:
+            namespace (str): The namespace of the jobs.
+            job_names (list(str)): The names of the jobs to delete.
 
         Returns:
-            list(str): A list of job names.
+            boolean: True if every batch was deleted, else False.
 
         """
+        LOGGER.debug('KubernetesJob.delete_all')
+
         url = 'https://' + KubernetesJob.kubernetes_apiuri + \
-            '/apis/batch/v1/namespaces/' + self.namespace + '/jobs'
-        LOGGER.debug('Getting all job names from ' + url)
-        return_val = []
-        request_lambda = lambda: requests.get(\
-            url, headers=default_headers, verify=False)
+            '/apis/batch/v1/namespaces/' + namespace + '/jobs'
+        return_val = True
+        for start in range(0, len(job_names), DELETE_BATCH_SIZE):
+            batch = job_names[start:start + DELETE_BATCH_SIZE]
+            selector = JOB_LABEL + ' in (' + ','.join(batch) + ')'
+            LOGGER.debug('Deleting %d jobs', len(batch))
+            response = session.delete(url, json=delete_options, \
+                params={'labelSelector': selector}, headers=get_default_headers(), \
+                verify=False)
+            return_val = is_response_ok(response, 1, -1) and return_val
+        return return_val
+
+    @staticmethod
+    def delete_finished_cleanups(namespace):
+        """Deletes the cleanup jobs that have succeeded, in one request.
+
+        Clusters without the TTLAfterFinished feature would otherwise keep
+        every cleanup job submitted by cleanup_workspace().
+
+        Args:
+            namespace (str): The namespace of the jobs.
+
+        Returns:
+            boolean: True if the jobs were deleted, else False.
+
+        """
+        LOGGER.debug('KubernetesJob.delete_finished_cleanups')
+
+        url = 'https://' + KubernetesJob.kubernetes_apiuri + \
+            '/apis/batch/v1/namespaces/' + namespace + '/jobs'
+        response = session.delete(url, json=delete_options, \
+            params={'labelSelector': CLEANUP_LABEL + '=true',
+                    'fieldSelector': 'status.successful=1'}, \
+            headers=get_default_headers(), verify=False)
+        return is_response_ok(response, 1, -1)
+
+    @staticmethod
+    def list_jobs(namespace, label_selector=None, limit=None, continue_token=None):
+        """Returns one page of job metadata from a namespace.
+
+        Only object metadata is requested from the API server, which falls
+        back to full job objects if it does not support partial metadata.
+
+        Args:
+            namespace (str): The namespace to list.
+            label_selector (str): Only list jobs matching this label selector.
+            limit (int): The maximum number of jobs to return.
+            continue_token (str): The token returned with the previous page.
+
+        Returns:
+            tuple(list(dict), str): The metadata of each job, and the token for
+                the next page or None if this was the last page.
+
+        """
+        url = 'https://' + KubernetesJob.kubernetes_apiuri + \
+            '/apis/batch/v1/namespaces/' + namespace + '/jobs'
+        params = {}
+        if label_selector:
+            params['labelSelector'] = label_selector
+        if limit:
+            params['limit'] = limit
+        if continue_token:
+            params['continue'] = continue_token
+        headers = dict(get_default_headers())
+        headers['Accept'] = metadata_accept
+
+        LOGGER.debug('Listing jobs from %s', url)
+        request_lambda = lambda: session.get(\
+            url, params=params, headers=headers, verify=False)
         k8s_response = retry_request_until_ok(request_lambda, 1, 0)
-        if k8s_response is not None:
-            return_val = [job['name'] for job in k8s_response.json()]
+        if k8s_response is None:
+            return [], None
+
+        job_list = k8s_response.json()
+        items = [job['metadata'] for job in job_list.get('items') or []]
+        return items, job_list['metadata'].get('continue') or None
+
+    @staticmethod
+    def get_all_job_names(namespace, label_selector=None):
+        """Returns all job names known to Kubernetes in a namespace.
+
+        Args:
+            namespace (str): The namespace to list.
+            label_selector (str): Only list jobs matching this label selector.
+
+        Returns:
+            list(str): A list of job names.
+
+        """
+        LOGGER.debug('Getting all job names from %s', namespace)
+        return_val = []
+        continue_token = None
+        while True:
+            items, continue_token = KubernetesJob.list_jobs(
+                namespace, label_selector, LIST_PAGE_SIZE, continue_token)
+            return_val.extend(item['name'] for item in items)
+            if continue_token is None:
+                break
         return return_val
 
 
@@ -550,7 +845,7 @@ def is_response_ok(response, attempt_number, retry_delay_seconds):
         else:
             return_val = True
     except requests.exceptions.HTTPError as http_err:
-        LOGGER.debug('Response: ' + str(http_err))
+        LOGGER.debug('Response: %s', http_err)
         error_message = http_err.response.text
         LOGGER.debug(error_message)
         LOGGER.warning('Request returned ' + \
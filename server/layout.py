@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*
+"""Separate storage of the layout of FBP graphs.
+
+The editor keeps the position and size of every process in its metadata,
+next to the fields conversion uses.  Saved graphs store the two apart:
+
+    content  the topology: processes without layout fields, and connections
+    layout   {process key: {'x': ..., 'y': ..., 'width': ..., 'height': ...}}
+
+so that moving a node leaves the topology, and the conversion made from
+it, untouched.  Clients always see the merged content.
+"""
+
+import copy
+
+import six
+
+# Fields of a process' metadata that only describe how it is drawn
+LAYOUT_FIELDS = ('x', 'y', 'width', 'height')
+
+
+def splitLayout(content):
+    """Split FBP graph content into its topology and its layout.
+
+    The content is not modified.
+
+    :returns: The topology and the layout.
+    """
+    topology = dict(content)
+    layout = {}
+    processes = content.get('processes')
+    if isinstance(processes, dict):
+        topology['processes'] = {}
+        for key, process in six.iteritems(processes):
+            metadata = isinstance(process, dict) and process.get('metadata')
+            if not isinstance(metadata, dict) or \
+                    not any(field in metadata for field in LAYOUT_FIELDS):
+                topology['processes'][key] = process
+                continue
+            process = dict(process)
+            process['metadata'] = dict(
+                (field, value) for field, value in six.iteritems(metadata)
+                if field not in LAYOUT_FIELDS)
+            layout[key] = dict(
+                (field, metadata[field]) for field in LAYOUT_FIELDS
+                if field in metadata)
+            topology['processes'][key] = process
+    return topology, layout
+
+
+def mergeLayout(topology, layout):
+    """Return FBP graph content combining a topology and a layout.
+
+    Layout of processes missing from the topology is ignored.
+    """
+    if not layout or not isinstance(topology.get('processes'), dict):
+        return topology
+    content = dict(topology)
+    content['processes'] = dict(topology['processes'])
+    for key, position in six.iteritems(layout):
+        process = content['processes'].get(key)
+        if not isinstance(process, dict):
+            continue
+        process = dict(process)
+        process['metadata'] = dict(process.get('metadata') or {})
+        process['metadata'].update(copy.deepcopy(position))
+        content['processes'][key] = process
+    return content
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*
+"""Logging for the plugin.
+
+Every plugin logger is a child of the girder.plugins.cis logger, whose level
+is set by the cis.log_level setting.  Messages are formatted lazily by the
+logging module, so disabled levels cost a single level check.
+
+Records logged while handling a request are tagged with a correlation id,
+taken from the request's X-Request-Id header or generated, and echoed back
+in the response's X-Request-Id header.  Work handed to background threads
+can carry the id along with requestContext.
+"""
+
+import contextlib
+import logging
+import re
+import threading
+import uuid
+
+import cherrypy
+
+PLUGIN_LOGGER = __name__.rsplit('.', 1)[0]
+
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+REQUEST_ID_HEADER = 'X-Request-Id'
+
+_requestIdRegex = re.compile(r'^[\w.-]{1,64}$')
+_context = threading.local()
+
+
+def requestId():
+    """Return the correlation id of the current request or task, or None."""
+    value = getattr(_context, 'requestId', None)
+    if value is not None or cherrypy.request.app is None:
+        return value
+
+    value = getattr(cherrypy.request, 'cisRequestId', None)
+    if value is None:
+        value = cherrypy.request.headers.get(REQUEST_ID_HEADER)
+        if not value or not _requestIdRegex.match(value):
+            value = uuid.uuid4().hex[:12]
+        cherrypy.request.cisRequestId = value
+        cherrypy.response.headers[REQUEST_ID_HEADER] = value
+    return value
+
+
+@contextlib.contextmanager
+def requestContext(value):
+    """Tag the records logged by this thread with a correlation id."""
+    previous = getattr(_context, 'requestId', None)
+    _context.requestId = value
+    try:
+        yield
+    finally:
+        _context.requestId = previous
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the correlation id to log records as requestId.
+
+    The id also prefixes the message, so it shows up with Girder's own log
+    format.
+    """
+
+    def filter(self, record):
+        record.requestId = requestId()
+        if record.requestId is not None:
+            record.msg = '[%s] %s' % (record.requestId, record.msg)
+        return True
+
+
+_filter = RequestIdFilter()
+
+
+def getLogger(name):
+    """Return a logger whose records carry the correlation id."""
+    logger = logging.getLogger(name)
+    if _filter not in logger.filters:
+        logger.addFilter(_filter)
+    return logger
+
+
+def setLevel(level):
+    """Set the level of all plugin loggers, by name."""
+    logging.getLogger(PLUGIN_LOGGER).setLevel(getattr(logging, level))
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*
+"""In-process metrics for the plugin's hot paths.
+
+Stage timers feed latency histograms, which are exported in the Prometheus
+text format by GET /cis/metrics, and are reported per request in the
+Server-Timing response header.  Metrics are kept per Girder process.
+"""
+
+import contextlib
+import threading
+import time
+
+import cherrypy
+import six
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_help = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(six.iteritems(labels or {})))
+
+
+def describe(name, text):
+    """Set the HELP text of a metric."""
+    _help[name] = text
+
+
+def increment(name, labels=None, value=1):
+    """Add to a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, labels=None):
+    """Record a duration in a histogram."""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {
+                'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0}
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][i] += 1
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+
+
+def _inRequest():
+    # Outside of a request, cherrypy.request is a default object shared by
+    # every thread, which has no application
+    return cherrypy.request.app is not None
+
+
+@contextlib.contextmanager
+def timer(stage):
+    """Time a stage of request handling.
+
+    The duration is recorded in the cis_stage_seconds histogram and, when
+    running inside a request, added to its Server-Timing header.
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - start
+        observe('cis_stage_seconds', elapsed, {'stage': stage})
+        if _inRequest():
+            timings = getattr(cherrypy.request, 'cisTimings', None)
+            if timings is None:
+                timings = cherrypy.request.cisTimings = []
+            timings.append('%s;dur=%.1f' % (stage, elapsed * 1000))
+            cherrypy.response.headers['Server-Timing'] = ', '.join(timings)
+
+
+def observeKubernetesResponse(response, *args, **kwargs):
+    """Response hook recording the latency of Kubernetes API requests."""
+    observe('cis_kubernetes_request_seconds',
+            response.elapsed.total_seconds(),
+            {'method': response.request.method,
+             'code': str(response.status_code)})
+
+
+def _formatLabels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels)
+
+
+def render():
+    """Return all metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(six.iteritems(_counters))
+        histograms = sorted(
+            (key, dict(value, buckets=list(value['buckets'])))
+            for key, value in six.iteritems(_histograms))
+
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append('# HELP %s %s' % (name, _help[name]))
+            lines.append('# TYPE %s %s' % (name, kind))
+
+    for (name, labels), value in counters:
+        header(name, 'counter')
+        lines.append('%s%s %s' % (name, _formatLabels(labels), value))
+
+    for (name, labels), histogram in histograms:
+        header(name, 'histogram')
+        for bound, count in zip(BUCKETS, histogram['buckets']):
+            lines.append('%s_bucket%s %d' % (
+                name, _formatLabels(labels, [('le', bound)]), count))
+        lines.append('%s_bucket%s %d' % (
+            name, _formatLabels(labels, [('le', '+Inf')]), histogram['count']))
+        lines.append('%s_sum%s %f' % (
+            name, _formatLabels(labels), histogram['sum']))
+        lines.append('%s_count%s %d' % (
+            name, _formatLabels(labels), histogram['count']))
+
+    return '\n'.join(lines) + '\n'
+
+
+describe('cis_stage_seconds',
+         'Time spent in each stage of graph conversion and execution.')
+describe('cis_kubernetes_request_seconds',
+         'Latency of requests to the Kubernetes API server.')
+describe('cis_spec_queries_total',
+         'Number of spec documents loaded by name from the database.')
+describe('cis_spec_cache_total',
+         'Lookups of the in-process spec cache, by result.')
+describe('cis_conversion_cache_total',
+         'Lookups of the stored conversions of saved graphs, by result.')
+describe('cis_requests_total',
+         'Number of requests to the instrumented endpoints.')
+describe('cis_revalidations_total',
+         'Saved graphs converted again after spec changes, by result.')
@@ -3,9 +3,19 @@
 """Graph model definition."""
 
 from girder.constants import AccessType
-from girder.models.model_base import AccessControlledModel
+from girder.models.model_base import AccessControlledModel, \
+    ValidationException
 import datetime
 
+from ..layout import mergeLayout, splitLayout
+
+# Projection loading a graph without its layout
+TOPOLOGY_FIELDS = {'layout': False}
+
+
+class VersionConflict(Exception):
+    """Raised when a graph was changed since the version being edited."""
+
 
 class Graph(AccessControlledModel):
     """Graph model."""
@@ -13,21 +23,59 @@ class Graph(AccessControlledModel):
     def initialize(self):
         """Initialize the graph."""
         self.name = 'graph'
+        # The specs each graph uses, to find the graphs a spec change affects
+        self.ensureIndices(['conversion.specs.name'])
 
         self.exposeFields(level=AccessType.READ, fields={
             '_id', 'name', 'created', 'description', 'content',
-            'creatorId', 'public'})
+            'creatorId', 'public', 'updated', 'version', 'validity'})
 
     def validate(self, graph):
         """Validate the graph."""
         return graph
 
+    def filter(self, doc, user=None, additionalKeys=None):
+        """Filter a graph, merging its layout back into its content."""
+        filtered = super(Graph, self).filter(
+            doc, user, additionalKeys=additionalKeys)
+        if 'content' in filtered:
+            filtered['content'] = mergeLayout(filtered['content'],
+                                              doc.get('layout'))
+        return filtered
+
+    def loadTopology(self, id, user=None, level=AccessType.READ):
+        """Load a graph without its layout, for conversion and execution."""
+        return self.load(id, user=user, level=level, fields=TOPOLOGY_FIELDS,
+                         exc=True)
+
+    def _setChanges(self, update, field, old, new):
+        """Add the $set and $unset of the changed parts of a field."""
+        from ..jsonpatch import applyPatch, makePatch
+
+        if old == new:
+            return
+        _, paths = applyPatch(old, makePatch(old, new))
+        for path in paths:
+            value, exists = new, True
+            for key in path:
+                if not isinstance(value, dict) or key not in value:
+                    exists = False
+                    break
+                value = value[key]
+            name = '.'.join([field] + path)
+            if exists:
+                update['$set'][name] = value
+            else:
+                update.setdefault('$unset', {})[name] = ''
+
     def list(self, user=None, limit=0, offset=0,
-             sort=None, currentUser=None):
+             sort=None, currentUser=None, validity=None):
         """List a page of model graph for a given user.
 
         :param user: The user who owns the graph.
         :type user: dict or None
+        :param validity: Only list graphs with this validity.
+        :type validity: str or None
         :param limit: The page limit.
         :param offset: The page offset
         :param sort: The sort field.
@@ -36,6 +84,8 @@ class Graph(AccessControlledModel):
         cursor_def = {}
         if user is not None:
             cursor_def['creatorId'] = user['_id']
+        if validity is not None:
+            cursor_def['validity'] = validity
 
         cursor = self.find(cursor_def, sort=sort)
         for r in self.filterResultsByPermission(
@@ -43,19 +93,50 @@ class Graph(AccessControlledModel):
                 limit=limit, offset=offset):
             yield r
 
+    def findBySpecs(self, names, fields=None):
+        """Find the graphs using any of the named specs.
+
+        Graphs are indexed by the specs their stored conversion was made
+        with, including the ones that did not exist at the time.
+        """
+        return self.find({'conversion.specs.name': {'$in': list(names)}},
+                         fields=fields)
+
+    def listBySpec(self, name, user=None, limit=0, offset=0, sort=None):
+        """List a page of the graphs using a spec that a user can read."""
+        cursor = self.find({'conversion.specs.name': name}, sort=sort)
+        for r in self.filterResultsByPermission(
+                cursor=cursor, user=user, level=AccessType.READ,
+                limit=limit, offset=offset):
+            yield r
+
     def removeGraph(self, graph, token):
         """Remove the graph."""
         self.remove(graph)
 
+    def remove(self, graph, **kwargs):
+        """Remove the graph and its revisions."""
+        self.model('graph_revision', 'cis').removeGraphRevisions(graph)
+        super(Graph, self).remove(graph, **kwargs)
+
     def createGraph(self, graph=None, creator=None, save=True):
-        """Create a graph."""
+        """Create a graph.
+
+        The graph is converted to yggrun format and the result is stored
+        with it, and its first revision is recorded.
+        """
+        from ..conversion import refreshConversion
+
         now = datetime.datetime.utcnow()
+        topology, layout = splitLayout(graph['content'])
 
         obj = {
             'name': graph['name'],
-            'content': graph['content'],
+            'content': topology,
+            'layout': layout,
             'created': now,
-            'creatorId': creator['_id']
+            'creatorId': creator['_id'],
+            'version': 1
         }
 
         if 'public' in graph and creator.get('admin'):
@@ -66,18 +147,120 @@ class Graph(AccessControlledModel):
         if creator is not None:
             self.setUserAccess(obj, user=creator, level=AccessType.ADMIN,
                                save=False)
+        refreshConversion(obj)
         if save:
             obj = self.save(obj)
+            self.model('graph_revision', 'cis').record(obj, user=creator)
 
         return obj
 
-    def updateGraph(self, graph):
+    def updateGraph(self, graph, user=None):
         """Update a graph.
 
-        :param graph: The graph document to update.
+        The stored yggrun conversion is recomputed if the topology or one of
+        the specs it uses has changed, and a revision is recorded.  A save
+        that only moves processes leaves the stored topology and conversion
+        alone.
+
+        :param graph: The graph document to update, with its content as
+            clients see it, including the layout.
         :type graph: dict
+        :param user: The user making the change.
+        :type user: dict or None
         :returns: The graph document that was edited.
+        :raises VersionConflict: If the graph was saved since it was loaded.
         """
+        from ..conversion import refreshConversion
+
+        previous = self.load(graph['_id'], force=True,
+                             fields=['content', 'layout'])
+        current = graph.get('version')
+        topology, layout = splitLayout(graph['content'])
+        graph['content'] = topology
+        graph['layout'] = layout
         graph['updated'] = datetime.datetime.utcnow()
+        graph['version'] = (current or 0) + 1
+
+        # As for patches, the write fails if another save came first, so
+        # that no two revisions get the same version
+        query = {'_id': graph['_id'], 'version': current}
+        if previous is not None and previous.get('content') == topology:
+            result = self.collection.update_one(query, {'$set': dict(
+                (key, value) for key, value in graph.items()
+                if key not in ('_id', 'content'))})
+        else:
+            refreshConversion(graph)
+            graph = self.validate(graph)
+            result = self.collection.replace_one(query, graph)
+        if not result.matched_count:
+            raise VersionConflict('The graph was changed by another save.')
+
+        self.model('graph_revision', 'cis').record(
+            graph, previous=previous and mergeLayout(
+                previous.get('content'), previous.get('layout')), user=user)
+        return graph
+
+    def patchGraph(self, graph, patch, version=None, user=None):
+        """Apply a JSON Patch to the content of a graph.
+
+        Only the changed fields of the topology and layout are written, in
+        a single update that fails if the graph was changed since it was
+        loaded.  The conversion is only redone if the topology changed.
 
-        return self.save(graph)
+        :param graph: The graph document to patch.
+        :type graph: dict
+        :param patch: The RFC 6902 operations, relative to the content as
+            clients see it, including the layout.
+        :type patch: list
+        :param version: The version of the graph the patch was made against.
+            If it is not the current one, or a test operation of the patch
+            fails, VersionConflict is raised.
+        :type version: int or None
+        :param user: The user making the change.
+        :type user: dict or None
+        :returns: The patched graph document.
+        """
+        from ..conversion import refreshConversion
+        from ..jsonpatch import applyPatch, JsonPatchError, \
+            JsonPatchTestFailed
+
+        current = graph.get('version')
+        if version is not None and version != (current or 0):
+            raise VersionConflict('The graph was changed since version %d.'
+                                  % version)
+
+        oldTopology = graph['content']
+        oldLayout = graph.get('layout') or {}
+        try:
+            content, _ = applyPatch(mergeLayout(oldTopology, oldLayout), patch)
+        except JsonPatchTestFailed as e:
+            raise VersionConflict(str(e))
+        except JsonPatchError as e:
+            raise ValidationException(str(e), 'patch')
+
+        topology, layout = splitLayout(content)
+        graph['content'] = topology
+        graph['layout'] = layout
+        graph['updated'] = datetime.datetime.utcnow()
+        graph['version'] = (current or 0) + 1
+
+        update = {'$set': {
+            'updated': graph['updated'],
+            'version': graph['version']
+        }}
+        if topology != oldTopology:
+            update['$set']['conversion'] = refreshConversion(graph)
+            update['$set']['validity'] = graph['validity']
+            self._setChanges(update, 'content', oldTopology, topology)
+        self._setChanges(update, 'layout', oldLayout, layout)
+
+        # Graphs saved before versioning have no version field, which the
+        # None in the query matches
+        result = self.collection.update_one(
+            {'_id': graph['_id'], 'version': current}, update)
+        if not result.matched_count:
+            raise VersionConflict('The graph was changed by another save.')
+
+        self.model('graph_revision', 'cis').record(graph, patch=patch,
+                                                   user=user)
+        return graph
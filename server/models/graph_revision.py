@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Graph revision model definition."""
+
+from girder.models.model_base import Model
+from girder.constants import AccessType, SortDir
+import datetime
+
+from ..jsonpatch import applyPatch, makePatch
+from ..layout import mergeLayout
+
+# The fields of a revision shown when listing them
+SUMMARY_FIELDS = ('graphId', 'version', 'snapshot', 'created', 'creatorId')
+
+# Every this many versions a revision stores the whole content; the others
+# store a JSON Patch against the previous version
+SNAPSHOT_INTERVAL = 20
+
+
+# Example revision objects:
+# {
+#     "graphId": ObjectId,
+#     "version": 21,
+#     "snapshot": True,
+#     "content": {"processes": {...}, "connections": [...]},
+#     "created": datetime,
+#     "creatorId": ObjectId
+# }
+# {
+#     "graphId": ObjectId,
+#     "version": 22,
+#     "snapshot": False,
+#     "patch": [{"op": "replace", "path": "/processes/rf7/metadata/x",
+#                "value": 100}],
+#     "created": datetime,
+#     "creatorId": ObjectId
+# }
+
+
+class GraphRevision(Model):
+    """Defines the graph revision model.
+
+    A graph's content at any version is rebuilt from the closest snapshot
+    at or before it, followed by at most SNAPSHOT_INTERVAL - 1 patches.
+    """
+
+    def initialize(self):
+        """Initialize the model."""
+        self.name = 'graph_revision'
+        self.ensureIndices([([('graphId', 1), ('version', -1)], {})])
+
+        self.exposeFields(level=AccessType.READ, fields=SUMMARY_FIELDS)
+
+    def validate(self, revision):
+        """Validate the revision."""
+        return revision
+
+    def record(self, graph, previous=None, patch=None, user=None):
+        """Record the current version of a graph.
+
+        Revisions hold the content as clients see it, including the layout.
+
+        :param graph: The graph document, as saved.
+        :param previous: The content of the graph's previous version.
+        :param patch: The JSON Patch from the previous version, if known;
+            otherwise it is computed from previous.
+        :param user: The user who made the change.
+        :returns: The revision document.
+        """
+        version = graph.get('version', 1)
+        content = mergeLayout(graph['content'], graph.get('layout'))
+        revision = {
+            'graphId': graph['_id'],
+            'version': version,
+            'created': graph.get('updated') or datetime.datetime.utcnow(),
+            'creatorId': user['_id'] if user else graph.get('creatorId')
+        }
+
+        # Graphs saved before revisions were kept start with a snapshot
+        snapshot = (version - 1) % SNAPSHOT_INTERVAL == 0 or \
+            (previous is None and patch is None) or \
+            self.findOne({'graphId': graph['_id'], 'version': version - 1},
+                         fields=['_id']) is None
+        if snapshot:
+            revision['snapshot'] = True
+            revision['content'] = content
+        else:
+            if patch is None:
+                patch = makePatch(previous, content)
+            revision['snapshot'] = False
+            revision['patch'] = [operation for operation in patch
+                                 if operation['op'] != 'test']
+        return self.save(revision)
+
+    def list(self, graph, limit=0, offset=0, sort=None):
+        """List the revisions of a graph, without their contents."""
+        return self.find(
+            {'graphId': graph['_id']}, limit=limit, offset=offset,
+            sort=sort or [('version', SortDir.DESCENDING)],
+            fields=list(SUMMARY_FIELDS))
+
+    def getContent(self, graph, version):
+        """Rebuild the content of a graph at a version.
+
+        :returns: The content, or None if the version is not recorded.
+        """
+        snapshot = self.findOne({
+            'graphId': graph['_id'],
+            'snapshot': True,
+            'version': {'$lte': version}
+        }, sort=[('version', SortDir.DESCENDING)])
+        if snapshot is None:
+            return None
+
+        content = snapshot['content']
+        expected = snapshot['version'] + 1
+        for revision in self.find({
+            'graphId': graph['_id'],
+            'version': {'$gt': snapshot['version'], '$lte': version}
+        }, sort=[('version', SortDir.ASCENDING)]):
+            if revision['version'] != expected:
+                return None
+            content, _ = applyPatch(content, revision['patch'], inPlace=True)
+            expected += 1
+        if expected != version + 1:
+            return None
+        return content
+
+    def removeGraphRevisions(self, graph):
+        """Remove all revisions of a graph."""
+        self.removeWithQuery({'graphId': graph['_id']})
@@ -5,11 +5,14 @@
 from girder.constants import AccessType
 from girder.models.model_base import AccessControlledModel
 #from girder.utility import JsonEncoder
-import json
 import datetime
 import requests
 import yaml
 
+from ..log import getLogger
+
+LOGGER = getLogger(__name__)
+
 
 # Example Spec object:
 # {
@@ -35,11 +38,13 @@ class Spec(AccessControlledModel):
 
         self.exposeFields(level=AccessType.READ, fields={
             '_id', 'name', 'created', 'content', 'description',
-            'creatorId', 'issue_url', 'public'})
+            'creatorId', 'issue_url', 'public', 'source'})
 
     def validate(self, spec):
-        """Validate the model."""
-        return spec
+        """Validate the model, storing its yggrun form with it."""
+        from ..utils import precomputeSpec
+
+        return precomputeSpec(spec)
 
     def list(self, user=None, limit=0, offset=0,
              sort=None, currentUser=None):
@@ -108,17 +113,16 @@ class Spec(AccessControlledModel):
 	#"_oauthToken": {
 	#	"access_token": "XXXX",
         authHeader = 'token %s' % user['_oauthToken']['access_token']
-        print(authHeader)
 
         # Create our issue
         issue = {'title': 'New model request: %s' % spec['content']['name'],
                  'body': '```%s```' % yaml }
-        print(json.dumps(issue))
+        LOGGER.debug('Submitting issue: %s', issue)
         #json=json.dumps(issue, cls=JsonEncoder)
         r = requests.post(issuesUrl, json=issue, headers={'Authorization': authHeader})
         if r.status_code == requests.codes.created:
             body = r.json()
-            print(body)
+            LOGGER.info('Created issue %s', body['url'])
             spec['issue_url'] = body['url']
             return self.save(spec)
         else:
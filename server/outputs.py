@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*
+"""Access to the files an execution wrote into its workspace.
+
+Files are always read in chunks, so large output tables are never loaded
+into memory.  Symbolic links are never followed out of a workspace, as the
+model that wrote them could point them at any file of the Girder host.
+"""
+
+import datetime
+import os
+import re
+import stat
+
+from girder.utility.model_importer import ModelImporter
+
+# Size of the chunks read from output files
+CHUNK_SIZE = 65536
+
+_rangeRegex = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a requested byte range lies outside of the file."""
+
+
+def listOutputs(workspace):
+    """List the files in a workspace.
+
+    :param workspace: The workspace directory.
+    :type workspace: str
+    :returns: A list of dicts with the relative 'path', 'size' and
+        'updated' time of each file, sorted by path.  Symbolic links and
+        other special files are left out.
+    """
+    outputs = []
+    for dirName, subdirList, fileList in os.walk(workspace):
+        for fname in fileList:
+            path = os.path.join(dirName, fname)
+            try:
+                info = os.lstat(path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(info.st_mode):
+                continue
+            outputs.append({
+                'path': os.path.relpath(path, workspace),
+                'size': info.st_size,
+                'updated': datetime.datetime.utcfromtimestamp(info.st_mtime)
+            })
+    return sorted(outputs, key=lambda output: output['path'])
+
+
+def resolveOutput(workspace, path):
+    """Return the absolute path of a file in a workspace.
+
+    Returns None if the path does not name a file inside the workspace.
+    """
+    workspace = os.path.realpath(workspace)
+    fullPath = os.path.realpath(os.path.join(workspace, path))
+    if not fullPath.startswith(workspace + os.sep) or \
+            not os.path.isfile(fullPath):
+        return None
+    return fullPath
+
+
+def parseRange(header, size):
+    """Parse a single byte range from an HTTP Range header.
+
+    :param header: The value of the Range header, or None.
+    :param size: The size of the file.
+    :returns: The (start, end) offsets, end exclusive, or None to send the
+        whole file.
+    """
+    match = _rangeRegex.match(header or '')
+    if match is None:
+        return None
+
+    start, end = match.groups()
+    if not start:
+        # A suffix range: the last N bytes
+        if not end:
+            return None
+        start, end = max(size - int(end), 0), size
+    else:
+        start = int(start)
+        end = min(int(end) + 1, size) if end else size
+    if start >= size or start >= end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def streamFile(path, start, end):
+    """Return a generator function yielding bytes [start, end) of a file."""
+    def stream():
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    return stream
+
+
+def importOutputs(workspace, folder, user):
+    """Upload every file of a workspace into a Girder folder.
+
+    Subdirectories of the workspace become subfolders.  Files are streamed
+    into the folder's assetstore.  Files that are replaced by a symbolic
+    link, or moved out of the workspace, after being listed are skipped.
+
+    :returns: The list of created files.
+    """
+    folderModel = ModelImporter.model('folder')
+    uploadModel = ModelImporter.model('upload')
+
+    files = []
+    for output in listOutputs(workspace):
+        parent = folder
+        dirName, fname = os.path.split(output['path'])
+        for part in dirName.split(os.sep) if dirName else []:
+            parent = folderModel.createFolder(
+                parent, part, parentType='folder', creator=user,
+                reuseExisting=True)
+
+        path = resolveOutput(workspace, output['path'])
+        if path is None:
+            continue
+        try:
+            fd = os.open(path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+        except OSError:
+            continue
+        with os.fdopen(fd, 'rb') as f:
+            files.append(uploadModel.uploadFromFile(
+                f, os.fstat(fd).st_size, fname, parentType='folder',
+                parent=parent, user=user))
+    return files
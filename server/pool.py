@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*
+"""A small pool of background worker threads."""
+
+import threading
+
+from six.moves import queue
+
+from .log import getLogger, requestContext, requestId
+
+LOGGER = getLogger(__name__)
+
+
+class WorkerPool(object):
+    """Runs submitted callables on a fixed number of daemon threads."""
+
+    def __init__(self, name):
+        """Initialize the pool.
+
+        :param name: Prefix for the names of the worker threads.
+        :type name: str
+        """
+        self.name = name
+        self._queue = queue.Queue()
+        self._threads = []
+
+    def start(self, size):
+        """Start the worker threads.
+
+        :param size: The number of worker threads.
+        :type size: int
+        """
+        while len(self._threads) < size:
+            thread = threading.Thread(
+                target=self._work,
+                name='%s-%d' % (self.name, len(self._threads)))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop the worker threads once the queued work has drained."""
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, func, *args, **kwargs):
+        """Queue a call to func(*args, **kwargs) on a worker thread.
+
+        The call is logged under the correlation id of the submitter.
+        """
+        self._queue.put((func, args, kwargs, requestId()))
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            func, args, kwargs, taskId = task
+            with requestContext(taskId):
+                try:
+                    func(*args, **kwargs)
+                except Exception:
+                    LOGGER.exception('Background task %s failed',
+                                     func.__name__)
+
+
+pool = WorkerPool('cis-worker')
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*
+"""Structured progress of running executions.
+
+The yggrun output of a running execution is followed as it is written, and
+lines reporting that a model started or finished, or how many messages it
+passed, are turned into Girder job progress updates.  Clients subscribed to
+the notification stream receive these as job_status events.
+"""
+
+import re
+import threading
+import time
+
+import yaml
+from girder.utility.model_importer import ModelImporter
+
+from .executors import executorForJob
+from .log import getLogger, requestContext
+
+LOGGER = getLogger(__name__)
+
+# The minimum number of seconds between two progress updates of a job
+PUBLISH_INTERVAL = 2
+
+STARTED_PATTERN = re.compile(r'\b(start(ed|ing)?|running)\b', re.IGNORECASE)
+FINISHED_PATTERN = re.compile(r'\b(complete[sd]?|finished|exited|stopped)\b',
+                              re.IGNORECASE)
+MESSAGES_PATTERN = re.compile(r'\b(\d+) messages?\b', re.IGNORECASE)
+ALL_FINISHED_PATTERN = re.compile(r'\ball models (have )?(complete|finish)',
+                                  re.IGNORECASE)
+
+
+class ProgressParser(object):
+    """Tracks the progress of the models of a graph from yggrun output."""
+
+    def __init__(self, models):
+        """Initialize the parser.
+
+        :param models: The names of the models in the graph.
+        :type models: list
+        """
+        self.models = list(models)
+        self.started = set()
+        self.finished = set()
+        self.messages = {}
+
+        # Longest names first, so that a name containing another one wins
+        names = sorted(self.models, key=len, reverse=True)
+        self._modelRegex = re.compile(
+            r'\b(%s)\b' % '|'.join(re.escape(name) for name in names)) \
+            if names else None
+
+    def feed(self, line):
+        """Parse one line of output.
+
+        :returns: True if the line changed the progress.
+        """
+        if ALL_FINISHED_PATTERN.search(line):
+            changed = self.finished != set(self.models)
+            self.started.update(self.models)
+            self.finished.update(self.models)
+            return changed
+
+        match = self._modelRegex.search(line) if self._modelRegex else None
+        if match is None:
+            return False
+        model = match.group(1)
+
+        changed = False
+        if FINISHED_PATTERN.search(line):
+            changed = model not in self.finished
+            self.started.add(model)
+            self.finished.add(model)
+        elif STARTED_PATTERN.search(line) and model not in self.started:
+            self.started.add(model)
+            changed = True
+
+        count = MESSAGES_PATTERN.search(line)
+        if count is not None and \
+                self.messages.get(model) != int(count.group(1)):
+            self.messages[model] = int(count.group(1))
+            changed = True
+        return changed
+
+    def summary(self):
+        """Return a one line, human readable description of the progress."""
+        running = [model for model in self.models
+                   if model in self.started and model not in self.finished]
+        parts = ['%d of %d models finished' % (len(self.finished),
+                                               len(self.models))]
+        if running:
+            parts.append('running %s' % ', '.join(running))
+        if self.messages:
+            parts.append('%d messages' % sum(self.messages.values()))
+        return '; '.join(parts)
+
+
+def modelNames(yamlGraph):
+    """Return the names of the models in a yggrun YAML graph."""
+    graph = yaml.safe_load(yamlGraph) or {}
+    models = graph.get('models') or []
+    if isinstance(models, dict):
+        models = [models]
+    return [model['name'] for model in models if 'name' in model]
+
+
+def followProgress(job):
+    """Publish progress updates for a job until its output ends."""
+    jobModel = ModelImporter.model('job', 'jobs')
+    parser = ProgressParser(modelNames(job['kwargs']['graph']))
+
+    def publish():
+        jobModel.updateJob(job, progressTotal=len(parser.models),
+                           progressCurrent=len(parser.finished),
+                           progressMessage=parser.summary())
+
+    lastPublished = 0
+    pending = False
+    for line in executorForJob(job).followLogs(job):
+        pending = parser.feed(line) or pending
+        if pending and time.time() - lastPublished >= PUBLISH_INTERVAL:
+            publish()
+            lastPublished = time.time()
+            pending = False
+    if pending:
+        publish()
+
+
+def follow(job):
+    """Follow the progress of a job on a background thread."""
+    def run():
+        with requestContext(job['title']):
+            try:
+                followProgress(job)
+            except Exception:
+                LOGGER.exception('Failed to follow progress')
+
+    thread = threading.Thread(target=run, name='cis-progress-' + job['title'])
+    thread.daemon = True
+    thread.start()
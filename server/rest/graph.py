@@ -4,15 +4,17 @@ from girder.api.docs import addModel
 from girder.api.rest import Resource, filtermodel, RestException
 from girder.api.describe import Description, autoDescribeRoute
 from girder.constants import SortDir, AccessType
-from ..models.graph import Graph as GraphModel
-from ..utils import fbpToCis, execGraph, getLogs
-import tempfile
-import yaml
-import pyaml
+from ..models.graph import Graph as GraphModel, VersionConflict
+from ..utils import convertFbp, execGraph, execGraphAsync, getLogs, \
+    listExecutions, getWorkspace, streamFbp
+from ..conversion import getConversion
+from ..jsonpatch import makePatch
+from ..validation import GraphValidationError
+from .. import metrics, outputs
+from ..log import getLogger
+import cherrypy
+import mimetypes
 import os
-from yggdrasil.yamlfile import prep_yaml
-from yggdrasil.schema import get_schema
-from yggdrasil.backwards import as_str
 
 graphDef = {
     "description": "Object representing a Crops in Silico model graph.",
@@ -55,6 +57,16 @@ graphDef = {
             "type": "string",
             "format": "date-time",
             "description": "The last time when the graph was modified."
+        },
+        "version": {
+            "type": "integer",
+            "description": "Incremented by every change of the graph."
+        },
+        "validity": {
+            "type": "string",
+            "enum": ["valid", "invalid", "pending"],
+            "description": ("Whether the graph converts, or pending while "
+                            "it is revalidated after a spec change.")
         }
     },
     'example': {
@@ -66,11 +78,14 @@ graphDef = {
         'creatorId': '18312dcdbaec030000144d233',
         'created': '2017-01-09T18:56:27.262000+00:00',
         'official': True,
-        'updated': '2017-01-10T16:15:17.313000+00:00'
+        'updated': '2017-01-10T16:15:17.313000+00:00',
+        'version': 3
     },
 }
 addModel('graph', graphDef, resources='graph')
 
+LOGGER = getLogger(__name__)
+
 
 class Graph(Resource):
     """Defines graph API."""
@@ -84,10 +99,24 @@ class Graph(Resource):
         self.route('GET', (':id',), self.getGraph)
         self.route('POST', (), self.createGraph)
         self.route('PUT', (':id',), self.updateGraph)
+        self.route('PATCH', (':id',), self.patchGraph)
         self.route('DELETE', (':id',), self.deleteGraph)
+        self.route('GET', (':id', 'revision'), self.listRevisions)
+        self.route('GET', (':id', 'revision', ':version'), self.getRevision)
+        self.route('GET', (':id', 'revision', ':version', 'diff'),
+                   self.diffRevision)
+        self.route('POST', (':id', 'revision', ':version', 'restore'),
+                   self.restoreRevision)
         self.route('POST', ('convert',), self.convertGraph)
+        self.route('GET', ('execute',), self.listExecutions)
         self.route('POST', ('execute',), self.executeGraph)
-        self.route('GET', ('execute',':name','logs'), self.getLogs)
+        self.route('POST', (':id', 'execute'), self.executeSavedGraph)
+        self.route('GET', ('execute', ':id', 'logs'), self.getLogs)
+        self.route('GET', ('execute', ':id', 'outputs'), self.listOutputs)
+        self.route('GET', ('execute', ':id', 'outputs', 'download'),
+                   self.downloadOutput)
+        self.route('POST', ('execute', ':id', 'outputs', 'import'),
+                   self.importOutputs)
 
     @access.public
     @filtermodel(model='graph', plugin='cis')
@@ -96,10 +125,12 @@ class Graph(Resource):
         .param('userId', "The ID of the graph's creator.", required=False)
         .param('text', ('Perform a full text search for graphs with matching '
                         'name or description.'), required=False)
+        .param('validity', 'Only return graphs with this validity.',
+               required=False, enum=['valid', 'invalid', 'pending'])
         .pagingParams(defaultSort='lowerName',
                       defaultSortDir=SortDir.DESCENDING)
     )
-    def listGraphs(self, userId, text, limit, offset, sort, params):
+    def listGraphs(self, userId, text, validity, limit, offset, sort, params):
         """List graphs."""
         currentUser = self.getCurrentUser()
         if userId:
@@ -109,9 +140,10 @@ class Graph(Resource):
 
         return list(self._model.list(
                 user=user, currentUser=currentUser,
-                offset=offset, limit=limit, sort=sort))
+                offset=offset, limit=limit, sort=sort, validity=validity))
 
     @access.user
+    @filtermodel(model='graph', plugin='cis')
     @autoDescribeRoute(
         Description('Create a new graph.')
         .jsonParam('graph', 'Name and attributes of the graph.',
@@ -153,6 +185,7 @@ class Graph(Resource):
         self.model('graph', 'cis').remove(graph)
 
     @access.user
+    @filtermodel(model='graph', plugin='cis')
     @autoDescribeRoute(
         Description('Update an existing graph.')
         .modelParam('id', model='graph', plugin='cis',
@@ -161,6 +194,7 @@ class Graph(Resource):
         .responseClass('graph')
         .errorResponse('ID was invalid.')
         .errorResponse('Access was denied for the graph.', 403)
+        .errorResponse('The graph was changed by another save.', 409)
     )
     def updateGraph(self, graphObj, graph, params):
         """Update graph."""
@@ -174,11 +208,149 @@ class Graph(Resource):
         elif 'public' in graph:
             graphObj['public'] = graph['public']
 
-        return self.model('graph', 'cis').updateGraph(graphObj)
+        try:
+            return self.model('graph', 'cis').updateGraph(graphObj, user=user)
+        except VersionConflict as e:
+            raise RestException(str(e), 409)
+
+    @access.user
+    @filtermodel(model='graph', plugin='cis')
+    @autoDescribeRoute(
+        Description('Edit the content of a graph with a JSON Patch.')
+        .notes('The body is a list of RFC 6902 operations whose paths are '
+               'relative to the graph content, for example '
+               '[{"op": "replace", "path": "/processes/rf7/metadata/x", '
+               '"value": 100}].  Only the changed fields are written.  Pass '
+               'the version the patch was made against to have it rejected '
+               'with 409 if the graph changed since.')
+        .modelParam('id', model='graph', plugin='cis',
+                    level=AccessType.WRITE)
+        .jsonParam('patch', 'The JSON Patch operations.', paramType='body',
+                   requireArray=True)
+        .param('version', 'The version of the graph being edited.',
+               dataType='integer', required=False)
+        .responseClass('graph')
+        .errorResponse('ID was invalid, or the patch does not apply.')
+        .errorResponse('Access was denied for the graph.', 403)
+        .errorResponse('The graph was changed since the given version.', 409)
+    )
+    def patchGraph(self, graph, patch, version):
+        """Patch graph."""
+        try:
+            return self.model('graph', 'cis').patchGraph(
+                graph, patch, version, user=self.getCurrentUser())
+        except VersionConflict as e:
+            raise RestException(str(e), 409)
+
+    def _revisionContent(self, graph, version):
+        content = self.model('graph_revision', 'cis').getContent(
+            graph, version)
+        if content is None:
+            raise RestException('Version %d of the graph is not recorded.'
+                                % version, 404)
+        return content
+
+    @access.public
+    @autoDescribeRoute(
+        Description('List the revisions of a graph, newest first.')
+        .modelParam('id', model='graph', plugin='cis', level=AccessType.READ)
+        .pagingParams(defaultSort='version',
+                      defaultSortDir=SortDir.DESCENDING)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied for the graph.', 403)
+    )
+    def listRevisions(self, graph, limit, offset, sort):
+        """List graph revisions."""
+        revisionModel = self.model('graph_revision', 'cis')
+        user = self.getCurrentUser()
+        return [revisionModel.filter(revision, user) for revision in
+                revisionModel.list(graph, limit=limit, offset=offset,
+                                   sort=sort)]
+
+    @access.public
+    @autoDescribeRoute(
+        Description('Get the content of a graph at a revision.')
+        .modelParam('id', model='graph', plugin='cis', level=AccessType.READ)
+        .param('version', 'The version of the graph.', paramType='path',
+               dataType='integer')
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied for the graph.', 403)
+        .errorResponse('The version is not recorded.', 404)
+    )
+    def getRevision(self, graph, version):
+        """Get a graph revision."""
+        return {
+            'graphId': graph['_id'],
+            'version': version,
+            'content': self._revisionContent(graph, version)
+        }
+
+    @access.public
+    @autoDescribeRoute(
+        Description('Compare two revisions of a graph.')
+        .notes('Returns the JSON Patch that turns the content at the '
+               'fromVersion, by default the one before, into the content '
+               'at this version.')
+        .modelParam('id', model='graph', plugin='cis', level=AccessType.READ)
+        .param('version', 'The version of the graph.', paramType='path',
+               dataType='integer')
+        .param('fromVersion', 'The version to compare with.',
+               dataType='integer', required=False)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied for the graph.', 403)
+        .errorResponse('A version is not recorded.', 404)
+    )
+    def diffRevision(self, graph, version, fromVersion):
+        """Diff graph revisions."""
+        if fromVersion is None:
+            fromVersion = version - 1
+        return makePatch(self._revisionContent(graph, fromVersion),
+                         self._revisionContent(graph, version))
+
+    @access.user
+    @filtermodel(model='graph', plugin='cis')
+    @autoDescribeRoute(
+        Description('Restore the content of a graph from a revision.')
+        .notes('The restored content is saved as a new version.')
+        .modelParam('id', model='graph', plugin='cis',
+                    level=AccessType.WRITE)
+        .param('version', 'The version to restore.', paramType='path',
+               dataType='integer')
+        .responseClass('graph')
+        .errorResponse('ID was invalid.')
+        .errorResponse('Access was denied for the graph.', 403)
+        .errorResponse('The version is not recorded.', 404)
+        .errorResponse('The graph was changed by another save.', 409)
+    )
+    def restoreRevision(self, graph, version):
+        """Restore a graph revision."""
+        graph['content'] = self._revisionContent(graph, version)
+        try:
+            return self.model('graph', 'cis').updateGraph(
+                graph, user=self.getCurrentUser())
+        except VersionConflict as e:
+            raise RestException(str(e), 409)
+
+    def _convert(self, content, stream=False):
+        try:
+            if stream:
+                return streamFbp(content)
+            return convertFbp(content)
+        except GraphValidationError as e:
+            raise RestException('Invalid graph', 400, {
+                'errors': e.errors,
+                'warnings': e.warnings
+            })
+        except BaseException as e:
+            LOGGER.info('Invalid graph: %s', e)
+            raise RestException('Invalid graph %s', 400, e)
 
     @access.public
     @autoDescribeRoute(
         Description('Convert a graph from FBP to yggrun format.')
+        .notes('If the graph has structural problems, such as unknown '
+               'components or ports, the 400 response lists all of them '
+               'in extra.errors.')
         .jsonParam('graph', 'Name and attributes of the spec.',
                    paramType='body')
         .errorResponse()
@@ -186,81 +358,182 @@ class Graph(Resource):
     )
     def convertGraph(self, graph):
         """Convert graph."""
-        cisgraph = fbpToCis(graph['content'])
-
-        cisgraph = as_str(cisgraph, recurse=True, allow_pass=True)
-        
-        # Write to temp file and validate
-        tmpfile = tempfile.NamedTemporaryFile(suffix="yml", prefix="cis",
-                                              delete=False)
-        yaml.safe_dump(cisgraph, tmpfile, default_flow_style=False)
-        yml_prep = prep_yaml(tmpfile.name)
-        os.remove(tmpfile.name)
-
-        s = get_schema()
-        yml_norm = s.normalize(yml_prep)
-        try:
-            s.validate(yml_norm)
-        except BaseException as e:
-            print(e)
-            raise RestException('Invalid graph %s', 400, e)
+        metrics.increment('cis_requests_total', {'endpoint': 'convert'})
+        yamlGraph = self._convert(graph['content'], stream=True)
 
         self.setRawResponse()
-        return pyaml.dump(cisgraph)
+        return yamlGraph
 
     @access.user
     @autoDescribeRoute(
-        Description('Execute yggrun on a graph and return the result.')
+        Description('Queue a yggrun execution of a graph.')
+        .notes('Returns the ID of the Girder job tracking the execution. '
+               'In background mode the graph is converted and validated '
+               'after the response is sent; progress and validation errors '
+               'are reported through the job and its notifications.')
         .jsonParam('graph', 'Name and attributes of the spec.',
                    paramType='body')
+        .param('background', 'Convert and validate the graph in the '
+               'background instead of in the request.', dataType='boolean',
+               required=False, default=False)
         .errorResponse()
         .errorResponse('Not authorized to execute graphs.', 403)
     )
-    def executeGraph(self, graph):
+    def executeGraph(self, graph, background):
         """Execute graph."""
-        cisgraph = fbpToCis(graph['content'])
+        user = self.getCurrentUser()
+        self.setRawResponse()
+        metrics.increment('cis_requests_total', {'endpoint': 'execute'})
+
+        if background:
+            job = execGraphAsync(graph['content'], user)
+            return str(job['_id'])
 
+        yaml_graph = self._convert(graph['content'])
+
+        with metrics.timer('queue'):
+            job = execGraph(yaml_graph, user)
+        return str(job['_id'])
+
+    @access.user
+    @autoDescribeRoute(
+        Description('Queue a yggrun execution of a saved graph.')
+        .notes('Returns the ID of the Girder job tracking the execution. '
+               'The conversion stored with the graph is used, unless the '
+               'graph or one of its specs changed since it was made.')
+        .param('id', 'The ID of the graph.', paramType='path')
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied for the graph.', 403)
+        .errorResponse('The graph is invalid.', 400)
+    )
+    def executeSavedGraph(self, id):
+        """Execute a saved graph."""
         user = self.getCurrentUser()
-        username = user['login']
-
-        cisgraph = as_str(cisgraph, recurse=True, allow_pass=True)
-        
-        # Write to temp file and validate
-        tmpfile = tempfile.NamedTemporaryFile(suffix="yml", prefix="cis",
-                                              delete=False)
-        yaml.safe_dump(cisgraph, tmpfile, default_flow_style=False)
-        yml_prep = prep_yaml(tmpfile.name)
-        os.remove(tmpfile.name)
-
-        s = get_schema()
-        yml_norm = s.normalize(yml_prep)
-        try:
-            s.validate(yml_norm)
-        except BaseException as e:
-            print(e)
-            raise RestException('Invalid graph %s', 400, e)
+        metrics.increment('cis_requests_total', {'endpoint': 'execute_saved'})
+        graph = self._model.loadTopology(id, user=user)
+
+        with metrics.timer('conversion'):
+            conversion = getConversion(graph)
+        if conversion['yaml'] is None:
+            raise RestException('Invalid graph', 400, {
+                'errors': conversion['errors']
+            })
 
         self.setRawResponse()
-        yaml_graph = pyaml.dump(cisgraph)
-        
-        #print('Executing graph: ' + str(yaml_graph))
-        return execGraph(yaml_graph, username)
-        
+        with metrics.timer('queue'):
+            job = execGraph(conversion['yaml'], user,
+                            graphId=str(graph['_id']),
+                            graphVersion=graph.get('version'))
+        return str(job['_id'])
+
     @access.user
     @autoDescribeRoute(
-        Description('Return the job logs from running this graph.')
-        .param('name', "The name of the job to lookup.", paramType='path')
+        Description('List the executions of the current user.')
+        .notes('Pages through the user\'s executions known to the '
+               'configured executor; pass the returned continue token to '
+               'fetch the next page.')
+        .param('limit', 'The maximum number of executions to return.',
+               dataType='integer', required=False, default=50)
+        .param('continueToken', 'The continue token of the previous page.',
+               required=False)
         .errorResponse()
+        .errorResponse('Not authorized to list executions.', 403)
+    )
+    def listExecutions(self, limit, continueToken):
+        """List executions."""
+        user = self.getCurrentUser()
+        executions, continueToken = listExecutions(user, limit, continueToken)
+        return {'executions': executions, 'continueToken': continueToken}
+
+    @access.user
+    @autoDescribeRoute(
+        Description('Return the job logs from running this graph.')
+        .modelParam('id', 'The ID of the execution job.', model='job',
+                    plugin='jobs', level=AccessType.READ)
+        .errorResponse('ID was invalid.')
         .errorResponse('Not authorized to read jobs.', 403)
     )
-    def getLogs(self, name):
+    def getLogs(self, job):
         """Get job logs from executing this graph."""
-        
-        # TODO: How to detect username?
+        return getLogs(job)
+
+    def _workspace(self, job):
+        workspace = getWorkspace(job)
+        if workspace is None:
+            raise RestException(
+                'The outputs of this execution are not reachable.', 400)
+        if not os.path.isdir(workspace):
+            raise RestException('The execution has no outputs.', 404)
+        return workspace
+
+    @access.user
+    @autoDescribeRoute(
+        Description('List the files written by an execution.')
+        .modelParam('id', 'The ID of the execution job.', model='job',
+                    plugin='jobs', level=AccessType.READ)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Not authorized to read jobs.', 403)
+    )
+    def listOutputs(self, job):
+        """List execution outputs."""
+        return outputs.listOutputs(self._workspace(job))
+
+    @access.cookie
+    @access.user
+    @autoDescribeRoute(
+        Description('Download a file written by an execution.')
+        .notes('Supports single byte ranges through the Range header.')
+        .modelParam('id', 'The ID of the execution job.', model='job',
+                    plugin='jobs', level=AccessType.READ)
+        .param('path', 'The path of the file, relative to the workspace.')
+        .errorResponse('ID was invalid.')
+        .errorResponse('Not authorized to read jobs.', 403)
+        .errorResponse('The file does not exist.', 404)
+        .errorResponse('The requested range is not satisfiable.', 416)
+    )
+    def downloadOutput(self, job, path):
+        """Download an execution output."""
+        fullPath = outputs.resolveOutput(self._workspace(job), path)
+        if fullPath is None:
+            raise RestException('The file does not exist.', 404)
+
+        size = os.path.getsize(fullPath)
+        try:
+            byteRange = outputs.parseRange(
+                cherrypy.request.headers.get('Range'), size)
+        except outputs.RangeNotSatisfiable:
+            cherrypy.response.headers['Content-Range'] = 'bytes */%d' % size
+            raise RestException('The requested range is not satisfiable.',
+                                416)
+
+        start, end = byteRange or (0, size)
+        if byteRange is not None:
+            cherrypy.response.status = 206
+            cherrypy.response.headers['Content-Range'] = \
+                'bytes %d-%d/%d' % (start, end - 1, size)
+
+        name = os.path.basename(fullPath)
+        self.setRawResponse()
+        cherrypy.response.headers['Accept-Ranges'] = 'bytes'
+        cherrypy.response.headers['Content-Type'] = \
+            mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        cherrypy.response.headers['Content-Length'] = end - start
+        cherrypy.response.headers['Content-Disposition'] = \
+            'attachment; filename="%s"' % name
+        return outputs.streamFile(fullPath, start, end)
+
+    @access.user
+    @autoDescribeRoute(
+        Description('Import the files written by an execution into a folder.')
+        .modelParam('id', 'The ID of the execution job.', model='job',
+                    plugin='jobs', level=AccessType.READ)
+        .modelParam('folderId', 'The destination folder.', model='folder',
+                    level=AccessType.WRITE, paramType='query')
+        .errorResponse('ID was invalid.')
+        .errorResponse('Write access was denied on the folder.', 403)
+    )
+    def importOutputs(self, job, folder):
+        """Import execution outputs into a folder."""
         user = self.getCurrentUser()
-        username = user['login']
-        job_name = name
-        job_type = 'k8s.io/yggdrasil'
-        
-        #print('Executing graph: ' + str(yaml_graph))
-        return getLogs(job_name, job_type, username)
+        files = outputs.importOutputs(self._workspace(job), folder, user)
+        return [self.model('file').filter(f, user) for f in files]
@@ -0,0 +1,30 @@
+"""Defines the metrics API."""
+from girder.api import access
+from girder.api.rest import Resource
+from girder.api.describe import Description, autoDescribeRoute
+from .. import metrics
+import cherrypy
+
+
+class Metrics(Resource):
+    """Defines metrics API."""
+
+    def __init__(self):
+        """Initialize the API."""
+        super(Metrics, self).__init__()
+        self.resourceName = 'cis'
+        self.route('GET', ('metrics',), self.getMetrics)
+
+    @access.admin
+    @autoDescribeRoute(
+        Description('Return the plugin metrics in the Prometheus text format.')
+        .notes('Includes per stage timings of graph conversion and '
+               'execution, and the latency of Kubernetes API requests.')
+        .errorResponse('Admin access was denied.', 403)
+    )
+    def getMetrics(self):
+        """Get metrics."""
+        self.setRawResponse()
+        cherrypy.response.headers['Content-Type'] = \
+            'text/plain; version=0.0.4'
+        return metrics.render()
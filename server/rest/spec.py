@@ -6,14 +6,16 @@ from girder.api.rest import Resource, filtermodel, RestException
 from girder.api.describe import Description, autoDescribeRoute
 from girder.constants import SortDir, AccessType
 from ..models.spec import Spec as SpecModel
-from ..utils import ingest, uiToCis
+from ..spec_cache import specCache
+from ..spec_sources import getSources
+from ..constants import PluginSettings
+from .. import webhook
+from ..log import getLogger
+from ..conversion import contentHash
+from ..utils import ingest, specModel, uiToCis, validateCis
+import json
 import pyaml
 import yaml
-from yggdrasil.yamlfile import prep_yaml
-from yggdrasil.schema import get_schema
-from yggdrasil.backwards import as_str
-import os
-import tempfile
 import cherrypy
 
 specDef = {
@@ -57,6 +59,11 @@ specDef = {
             "type": "string",
             "format": "date-time",
             "description": "The last time when the spec was modified."
+        },
+        "source": {
+            "type": "object",
+            "description": ("The repository, branch, file and commit an "
+                            "ingested spec comes from.")
         }
     },
     'example': {
@@ -73,6 +80,8 @@ specDef = {
 }
 addModel('spec', specDef, resources='spec')
 
+LOGGER = getLogger(__name__)
+
 
 class Spec(Resource):
     """Defines spec API."""
@@ -84,22 +93,67 @@ class Spec(Resource):
         self._model = SpecModel()
         self.route('GET', (), self.listSpecs)
         self.route('GET', (':id',), self.getSpec)
+        self.route('GET', (':id', 'graphs'), self.listSpecGraphs)
         self.route('POST', (), self.createSpec)
         self.route('PUT', (':id',), self.updateSpec)
         self.route('DELETE', (':id',), self.deleteSpec)
         self.route('PUT', ('ingest',), self.ingestSpecs)
+        self.route('POST', ('webhook',), self.receiveWebhook)
         self.route('POST', ('convert',), self.convertSpec)
         self.route('PUT', ('ingest',), self.ingestSpecs)
         self.route('POST', (':id', 'issue',), self.submitIssue)
 
     @access.admin
     @autoDescribeRoute(
-        Description('Refresh specs from github')
+        Description('Refresh specs from their git repositories')
+        .notes('Returns the names of the specs created or updated.  The '
+               'repositories are set by the cis.spec_sources setting.')
+        .param('source', 'Only ingest the spec source with this name.',
+               required=False)
+        .errorResponse('No spec source has that name.')
         .errorResponse('Not authorized to ingest specs.', 403)
     )
-    def ingestSpecs(self):
+    def ingestSpecs(self, source):
         """Ingest specs."""
-        ingest()
+        sources = None
+        if source is not None:
+            sources = [s for s in getSources() if s['name'] == source]
+            if not sources:
+                raise RestException('No spec source is named %s.' % source)
+        return ingest(sources)
+
+    @access.public
+    @autoDescribeRoute(
+        Description('Receive a GitHub push webhook.')
+        .notes('Configure the webhook with the application/json content '
+               'type and the secret of the cis.webhook_secret setting.  '
+               'Pushes to the branch of a spec source re-ingest only the '
+               'spec files they change, a few seconds after the last push '
+               'of a burst.  Returns the names of the sources scheduled.')
+        .errorResponse('The payload is not valid JSON.')
+        .errorResponse('Webhooks are disabled, or the signature is wrong.',
+                       403)
+    )
+    def receiveWebhook(self):
+        """Receive a GitHub webhook."""
+        secret = self.model('setting').get(PluginSettings.WEBHOOK_SECRET)
+        body = cherrypy.request.body.read()
+        if not secret or not webhook.verifySignature(
+                secret, body, cherrypy.request.headers):
+            raise RestException('Invalid webhook signature.', 403)
+
+        event = cherrypy.request.headers.get('X-GitHub-Event', 'push')
+        if event != 'push':
+            return {'event': event, 'sources': []}
+        try:
+            payload = json.loads(body.decode('utf8'))
+        except ValueError:
+            raise RestException('The payload is not valid JSON.')
+
+        sources = webhook.handlePush(payload, getSources())
+        cherrypy.response.status = 202
+        return {'event': event,
+                'sources': [source['name'] for source in sources]}
 
     @access.public
     @filtermodel(model='spec', plugin='cis')
@@ -145,15 +199,38 @@ class Spec(Resource):
     @filtermodel(model='spec', plugin='cis')
     @autoDescribeRoute(
         Description('Get a spec by ID.')
-        .modelParam('id', model='spec', plugin='cis', force=True)
+        .param('id', 'The ID of the spec.', paramType='path')
         .responseClass('spec')
         .errorResponse('ID was invalid.')
         .errorResponse('Read access was denied for the model', 403)
     )
-    def getSpec(self, spec):
+    def getSpec(self, id):
         """Get spec."""
+        spec = specCache.byId(id)
+        if spec is None:
+            raise RestException('Invalid spec id (%s).' % id)
+        # The cache holds every spec, so access is checked on each request
+        self.model('spec', 'cis').requireAccess(
+            spec, user=self.getCurrentUser(), level=AccessType.READ)
         return spec
 
+    @access.public
+    @filtermodel(model='graph', plugin='cis')
+    @autoDescribeRoute(
+        Description('Return the graphs using a spec.')
+        .notes('Lists the graphs a change of the spec affects, among those '
+               'accessible to the user.')
+        .modelParam('id', model='spec', plugin='cis', level=AccessType.READ)
+        .pagingParams(defaultSort='name')
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied for the spec.', 403)
+    )
+    def listSpecGraphs(self, spec, limit, offset, sort):
+        """List the graphs using a spec."""
+        return list(self.model('graph', 'cis').listBySpec(
+            spec['content']['name'], user=self.getCurrentUser(),
+            limit=limit, offset=offset, sort=sort))
+
     @access.user
     @autoDescribeRoute(
         Description('Delete an existing spec.')
@@ -201,23 +278,22 @@ class Spec(Resource):
     )
     def convertSpec(self, spec):
         """Convert spec."""
+        # A spec identical to a saved one was already converted and validated
+        stored = specCache.byName(spec['content'].get('name'))
+        if stored is not None and stored.get('cis') is not None and \
+                stored.get('cisHash') == contentHash(spec['content']):
+            if stored['cisErrors']:
+                raise RestException('Invalid model %s', 400,
+                                    stored['cisErrors'][0])
+            self.setRawResponse()
+            return pyaml.dump({'model': stored['cis']})
+
         cisspec = uiToCis(spec['content'])
 
-        cisspec = as_str(cisspec, recurse=True, allow_pass=True)
-        
-        # Write to temp file and validate
-        tmpfile = tempfile.NamedTemporaryFile(suffix="yml", prefix="cis",
-                                              delete=False)
-        yaml.safe_dump(cisspec, tmpfile, default_flow_style=False)
-        yml_prep = prep_yaml(tmpfile.name)
-        os.remove(tmpfile.name)
-
-        s = get_schema()
-        yml_norm = s.normalize(yml_prep)
         try:
-            s.validate(yml_norm)
+            cisspec = validateCis(cisspec)
         except BaseException as e:
-            print(e)
+            LOGGER.info('Invalid model: %s', e)
             raise RestException('Invalid model %s', 400, e)
 
         self.setRawResponse()
@@ -240,7 +316,7 @@ class Spec(Resource):
             cherrypy.response.status = 200
             return { "issue_url": spec['issue_url'] }
 	    
-        cisspec = uiToCis(spec['content'])
+        cisspec = {'model': specModel(spec)}
 
         specyaml = yaml.safe_dump(cisspec, default_flow_style=False)
 
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*
+"""In-process scheduler for yggrun executions.
+
+Execute requests are stored as Girder jobs in the QUEUED state, which makes
+the jobs collection the persistent submission queue.  A background thread
+periodically polls the running jobs for completion and dispatches queued
+jobs to their executor, subject to a global and a per-user concurrency
+limit.
+Users with the fewest running jobs are served first (fair share), and the
+oldest job wins within a user.
+
+The output of each job this process dispatched is followed and published
+as job progress.  Logs of finished jobs are archived on the Girder job, and
+once a finished job is older than the configured TTL the executor removes
+its resources and workspace.
+"""
+
+import collections
+import datetime
+import threading
+
+from girder.utility.model_importer import ModelImporter
+from girder.plugins.jobs.constants import JobStatus
+
+from .constants import JOB_TYPE, PluginSettings
+from .executors import executorForJob
+from . import progress
+from .log import getLogger
+
+LOGGER = getLogger(__name__)
+
+# The maximum number of finished jobs cleaned up in one scheduler pass
+REAP_BATCH_SIZE = 50
+
+# Seconds after which a job claimed by a scheduler that has not marked it
+# running can be claimed again
+CLAIM_TIMEOUT = 600
+
+
+class Scheduler(object):
+    """Dispatches queued executions with bounded concurrency."""
+
+    def __init__(self):
+        """Initialize the scheduler."""
+        self._thread = None
+        self._stopped = threading.Event()
+        self._wakeup = threading.Event()
+
+    def start(self):
+        """Start the dispatch thread."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='cis-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the dispatch thread."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wakeup(self):
+        """Run a dispatch pass without waiting for the next interval."""
+        self._wakeup.set()
+
+    def _run(self):
+        settingModel = ModelImporter.model('setting')
+        while not self._stopped.is_set():
+            try:
+                self.tick()
+            except Exception:
+                LOGGER.exception('Scheduler pass failed')
+            self._wakeup.wait(
+                settingModel.get(PluginSettings.SCHEDULER_INTERVAL))
+            self._wakeup.clear()
+
+    def tick(self):
+        """Update the running jobs, dispatch queued jobs, reap old ones."""
+        self.poll()
+        self.dispatch()
+        self.reap()
+
+    def poll(self):
+        """Mark finished jobs as succeeded or failed.
+
+        The logs are archived on the Girder job at this point, since they
+        are lost once the executor cleans up after the job.
+        """
+        jobModel = ModelImporter.model('job', 'jobs')
+        for job in jobModel.find({'type': JOB_TYPE,
+                                  'status': JobStatus.RUNNING}):
+            try:
+                self._poll(job)
+            except Exception:
+                LOGGER.exception('Failed to update %s', job['title'])
+
+    def _poll(self, job):
+        jobModel = ModelImporter.model('job', 'jobs')
+        executor = executorForJob(job)
+        status = executor.status(job)
+        if status == 'complete':
+            jobModel.updateJob(job, status=JobStatus.SUCCESS,
+                               log=executor.logs(job))
+        elif status == 'failed':
+            jobModel.updateJob(job, status=JobStatus.ERROR,
+                               log=executor.logs(job))
+        elif status is None:
+            jobModel.updateJob(job, status=JobStatus.ERROR,
+                               log='Job not found by the %s executor\n' %
+                               executor.name)
+        # 'running' and 'unknown' are looked at again on the next pass
+
+    def reap(self):
+        """Clean up after jobs that finished over a TTL ago."""
+        jobModel = ModelImporter.model('job', 'jobs')
+        ttl = ModelImporter.model('setting').get(PluginSettings.JOB_TTL)
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=ttl)
+
+        jobs = list(jobModel.find({
+            'type': JOB_TYPE,
+            'status': {'$in': [JobStatus.SUCCESS, JobStatus.ERROR,
+                               JobStatus.CANCELED]},
+            'updated': {'$lt': cutoff},
+            'cisReaped': {'$exists': False}
+        }, sort=[('cisReapAttempted', 1), ('updated', 1)],
+            limit=REAP_BATCH_SIZE))
+        if not jobs:
+            return
+
+        executors = collections.defaultdict(list)
+        for job in jobs:
+            if job.get('cisDispatched'):
+                executors[executorForJob(job)].append(job)
+            else:
+                # Jobs that were never dispatched have nothing to clean up
+                self._markReaped(job)
+
+        for executor, executorJobs in executors.items():
+            try:
+                cleaned = executor.cleanup(executorJobs)
+            except Exception:
+                LOGGER.exception('Failed to clean up %s jobs', executor.name)
+                cleaned = []
+            cleanedIds = set(job['_id'] for job in cleaned)
+            for job in executorJobs:
+                if job['_id'] in cleanedIds:
+                    self._markReaped(job)
+                else:
+                    self._markReapAttempted(job)
+
+    def _markReaped(self, job):
+        ModelImporter.model('job', 'jobs').update({'_id': job['_id']}, {
+            '$set': {'cisReaped': datetime.datetime.utcnow()}
+        }, multi=False)
+
+    def _markReapAttempted(self, job):
+        # Jobs that failed to clean up go to the back of the next batches,
+        # so that they cannot hold up the others
+        ModelImporter.model('job', 'jobs').update({'_id': job['_id']}, {
+            '$set': {'cisReapAttempted': datetime.datetime.utcnow()}
+        }, multi=False)
+
+    def dispatch(self):
+        """Submit queued jobs up to the configured concurrency limits."""
+        jobModel = ModelImporter.model('job', 'jobs')
+        settingModel = ModelImporter.model('setting')
+        maxRunning = settingModel.get(PluginSettings.MAX_RUNNING_JOBS)
+        maxPerUser = settingModel.get(PluginSettings.MAX_RUNNING_JOBS_PER_USER)
+
+        running = collections.Counter()
+        for job in jobModel.find({'type': JOB_TYPE,
+                                  'status': JobStatus.RUNNING},
+                                 fields=['userId']):
+            running[job.get('userId')] += 1
+
+        queues = collections.OrderedDict()
+        for job in jobModel.find({'type': JOB_TYPE,
+                                  'status': JobStatus.QUEUED},
+                                 sort=[('created', 1)]):
+            queues.setdefault(job.get('userId'),
+                              collections.deque()).append(job)
+
+        total = sum(running.values())
+        while queues and total < maxRunning:
+            # Fair share: the user with the fewest running jobs goes next,
+            # ties are broken by the age of the user's oldest queued job.
+            userId = min(queues, key=lambda u: (running[u],
+                                                queues[u][0]['created']))
+            if running[userId] >= maxPerUser:
+                del queues[userId]
+                continue
+
+            job = queues[userId].popleft()
+            if not queues[userId]:
+                del queues[userId]
+
+            if self._claim(job) and self._submit(job):
+                running[userId] += 1
+                total += 1
+
+    def _claim(self, job):
+        """Atomically take ownership of a queued job.
+
+        Every Girder process runs a scheduler, so this prevents two of them
+        from submitting the same job.  A job that is still queued
+        CLAIM_TIMEOUT seconds after being claimed was left behind by a Girder
+        process that stopped, and is claimed and submitted again.
+        """
+        now = datetime.datetime.utcnow()
+        cutoff = now - datetime.timedelta(seconds=CLAIM_TIMEOUT)
+        result = ModelImporter.model('job', 'jobs').collection.update_one({
+            '_id': job['_id'],
+            'status': JobStatus.QUEUED,
+            '$or': [{'cisDispatched': {'$exists': False}},
+                    {'cisDispatched': {'$lt': cutoff}}]
+        }, {
+            '$set': {'cisDispatched': now}
+        })
+        return result.modified_count == 1
+
+    def _submit(self, job):
+        jobModel = ModelImporter.model('job', 'jobs')
+        executor = executorForJob(job)
+        try:
+            ok = executor.submit(job)
+        except Exception:
+            LOGGER.exception('Failed to submit %s', job['title'])
+            ok = False
+
+        if ok:
+            job = jobModel.updateJob(job, status=JobStatus.RUNNING)
+            progress.follow(job)
+        else:
+            jobModel.updateJob(
+                job, status=JobStatus.ERROR,
+                log='Failed to submit job to the %s executor\n' %
+                executor.name)
+        return ok
+
+
+scheduler = Scheduler()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*
+"""YAML serialization of yggrun graphs.
+
+Models and connections are serialized one at a time and written to a
+file, so neither the representation nor the YAML of a large graph is built
+as a whole; the file is then read back in chunks.  The C emitter of PyYAML
+is used when it is available.
+"""
+
+import yaml
+
+Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# Sections of a graph that are serialized item by item
+SECTIONS = ('models', 'connections')
+
+# Size of the chunks YAML files are read in
+CHUNK_SIZE = 65536
+
+
+def _dump(data):
+    return yaml.dump(data, Dumper=Dumper, default_flow_style=False)
+
+
+def iterYaml(graph):
+    """Yield the YAML of a yggrun graph piece by piece."""
+    others = dict((key, value) for key, value in graph.items()
+                  if key not in SECTIONS)
+    if others:
+        yield _dump(others)
+
+    for key in SECTIONS:
+        if key not in graph:
+            continue
+        items = graph[key]
+        if not isinstance(items, list) or not items:
+            yield _dump({key: items})
+            continue
+        yield key + ':\n'
+        for item in items:
+            yield _dump([item])
+
+
+def writeYaml(graph, f):
+    """Write the YAML of a yggrun graph to a file, piece by piece."""
+    for piece in iterYaml(graph):
+        f.write(piece)
+
+
+def readChunks(f):
+    """Return a generator function yielding the rest of a file in chunks.
+
+    The file is closed once it has been read.
+    """
+    def stream():
+        with f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    return stream
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*
+"""A bounded in-process cache of spec documents.
+
+Specs are looked up by name on every graph conversion, and by ID by the
+spec endpoints, but change only when they are ingested or edited.  The
+cache keeps recently used specs in memory, keyed by name and by ID.
+
+Every Girder process shares a version stamp stored as a setting in
+MongoDB.  Any change to a spec increments the stamp, and each process
+compares its cached stamp with the stored one at most once per second,
+clearing its cache when they differ.  Other processes therefore see a spec
+change within a second, without an external cache service.
+"""
+
+import collections
+import threading
+import time
+
+from bson.objectid import ObjectId
+from girder.utility.model_importer import ModelImporter
+
+from . import metrics
+from .constants import PluginSettings
+
+# Maximum number of cached entries; a spec cached by name and by ID uses two
+MAX_ENTRIES = 512
+
+# Seconds between checks of the stored version stamp
+CHECK_INTERVAL = 1.0
+
+
+def _settings():
+    return ModelImporter.model('setting').collection
+
+
+def readStamp():
+    """Return the stored version stamp of the specs."""
+    doc = _settings().find_one({'key': PluginSettings.SPEC_CACHE_VERSION},
+                               projection=['value'])
+    return doc['value'] if doc else 0
+
+
+def bumpStamp():
+    """Increment the stored version stamp of the specs."""
+    _settings().update_one({'key': PluginSettings.SPEC_CACHE_VERSION},
+                           {'$inc': {'value': 1}}, upsert=True)
+
+
+def loadByName(name):
+    metrics.increment('cis_spec_queries_total')
+    return ModelImporter.model('spec', 'cis').findOne({'content.name': name})
+
+
+def loadById(id):
+    return ModelImporter.model('spec', 'cis').load(id, force=True)
+
+
+class SpecCache(object):
+    """A least recently used cache of specs, invalidated by a shared stamp.
+
+    Cached documents are shared between callers, which must not modify
+    them.
+    """
+
+    def __init__(self, loadByName=loadByName, loadById=loadById,
+                 readStamp=readStamp, bumpStamp=bumpStamp,
+                 maxEntries=MAX_ENTRIES, checkInterval=CHECK_INTERVAL):
+        self._loaders = {'name': loadByName, 'id': loadById}
+        self._readStamp = readStamp
+        self._bumpStamp = bumpStamp
+        self.maxEntries = maxEntries
+        self.checkInterval = checkInterval
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._checked = None
+
+    def _check(self):
+        """Clear the cache if the stored stamp changed; call with the lock."""
+        now = time.time()
+        if self._checked is not None and \
+                now - self._checked < self.checkInterval:
+            return
+        stamp = self._readStamp()
+        if stamp != self._stamp:
+            self._entries.clear()
+            self._stamp = stamp
+        self._checked = now
+
+    def _get(self, kind, value):
+        key = (kind, str(value))
+        with self._lock:
+            self._check()
+            stamp = self._stamp
+            if key in self._entries:
+                spec = self._entries.pop(key)
+                self._entries[key] = spec
+                metrics.increment('cis_spec_cache_total', {'result': 'hit'})
+                return spec
+
+        metrics.increment('cis_spec_cache_total', {'result': 'miss'})
+        spec = self._loaders[kind](value)
+        with self._lock:
+            # Keep what was loaded only if no change was seen meanwhile
+            if self._stamp == stamp:
+                self._entries[key] = spec
+                # Several specs may share a name, so a spec loaded by ID is
+                # not necessarily the one found by its name
+                if kind == 'name' and spec is not None:
+                    self._entries[('id', str(spec['_id']))] = spec
+                while len(self._entries) > self.maxEntries:
+                    self._entries.popitem(last=False)
+        return spec
+
+    def byName(self, name):
+        """Return the spec with the given component name, or None."""
+        return self._get('name', name)
+
+    def byId(self, id):
+        """Return the spec with the given ID, or None."""
+        if not isinstance(id, ObjectId) and not ObjectId.is_valid(id):
+            return None
+        return self._get('id', id)
+
+    def invalidate(self):
+        """Clear the cache of every process."""
+        self._bumpStamp()
+        with self._lock:
+            self._entries.clear()
+            # Also drops what is being loaded, which may predate the change
+            self._stamp = None
+            self._checked = None
+
+
+specCache = SpecCache()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*
+"""Git repositories that specs are ingested from.
+
+The cis.spec_sources setting lists the repositories, for example:
+
+    [{"name": "cis-specs",
+      "url": "https://github.com/cropsinsilico/cis-specs",
+      "branch": "master", "path": "models", "public": true},
+     {"name": "private", "url": "git@example.org:lab/models.git",
+      "branch": "main", "path": "specs", "public": false}]
+
+Each source is mirrored under cis.spec_mirror_root, in a directory named
+after it that is kept between ingests and only fetched again.  Every use
+of a mirror holds its lock, so that ingests of the same source, from this
+or another Girder process, never run git in it at the same time.  Specs
+record the source, file and commit they were ingested from.  When sources
+provide specs with the same name, the one listed first wins.
+"""
+
+import contextlib
+import errno
+import fcntl
+import os
+import re
+import threading
+
+import six
+from six.moves.urllib.parse import urlsplit, urlunsplit
+import yaml
+from girder.models.model_base import ValidationException
+from girder.utility.model_importer import ModelImporter
+
+from .constants import PluginSettings
+from .log import getLogger
+
+LOGGER = getLogger(__name__)
+
+DEFAULT_SOURCES = [{
+    'name': 'cis-specs',
+    'url': 'https://github.com/cropsinsilico/cis-specs',
+    'branch': 'master',
+    'path': 'models',
+    'public': True
+}]
+
+SOURCE_DEFAULTS = {'branch': 'master', 'path': 'models', 'public': True}
+
+_NAME_RE = re.compile(r'^[\w.-]+$')
+
+_locks = {}
+_locksLock = threading.Lock()
+
+
+def validateSources(sources):
+    """Check the value of the spec sources setting.
+
+    :returns: The sources, with the defaults filled in.
+    """
+    if not isinstance(sources, list):
+        raise ValidationException('Spec sources must be a list.', 'value')
+    names = set()
+    result = []
+    for original in sources:
+        if not isinstance(original, dict) or \
+                not isinstance(original.get('url'), six.string_types):
+            raise ValidationException(
+                'Every spec source needs a url.', 'value')
+        source = dict(SOURCE_DEFAULTS)
+        source.update(original)
+        source.setdefault('name', source['url'].rstrip('/').split('/')[-1])
+        if not _NAME_RE.match(source['name']) or source['name'] in names:
+            raise ValidationException(
+                'Spec source names must be unique and contain only letters, '
+                'digits, ".", "-" and "_".', 'value')
+        if os.path.isabs(source['path']) or \
+                '..' in source['path'].split('/'):
+            raise ValidationException(
+                'The path of a spec source must be inside the repository.',
+                'value')
+        names.add(source['name'])
+        result.append(source)
+    return result
+
+
+def getSources():
+    """Return the configured spec sources, in order of priority."""
+    return validateSources(ModelImporter.model('setting').get(
+        PluginSettings.SPEC_SOURCES))
+
+
+def publicUrl(url):
+    """Return a repository URL without the credentials it may contain."""
+    parts = urlsplit(url)
+    if parts.scheme and '@' in parts.netloc:
+        return urlunsplit(parts._replace(
+            netloc=parts.netloc.rsplit('@', 1)[1]))
+    return url
+
+
+def mirrorPath(source):
+    """Return the directory holding the mirror of a source."""
+    return os.path.join(ModelImporter.model('setting').get(
+        PluginSettings.SPEC_MIRROR_ROOT), source['name'])
+
+
+@contextlib.contextmanager
+def mirrorLock(source):
+    """Hold the lock of the mirror of a source.
+
+    Threads of this process wait on a lock of their own, and other
+    processes on an exclusive lock of a file next to the mirror.
+    """
+    path = mirrorPath(source)
+    with _locksLock:
+        lock = _locks.setdefault(path, threading.Lock())
+    with lock:
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with open(path + '.lock', 'a') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                yield path
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+
+def syncMirror(source, path):
+    """Clone a source into path, or fetch its branch if already there.
+
+    :returns: The GitPython repository, checked out at the branch head.
+    """
+    from git import Repo
+
+    if os.path.isdir(os.path.join(path, '.git')):
+        repo = Repo(path)
+        repo.remotes.origin.set_url(source['url'])
+        repo.git.fetch('origin', source['branch'])
+        repo.git.reset('--hard', 'FETCH_HEAD')
+    else:
+        repo = Repo.clone_from(source['url'], path, branch=source['branch'])
+    return repo
+
+
+def isSpecFile(source, relpath):
+    """Return whether a path of a repository is a spec file of a source."""
+    prefix = source['path'].strip('/')
+    return (not prefix or relpath.startswith(prefix + '/')) and \
+        not os.path.basename(relpath).startswith('.')
+
+
+def loadSpecFile(source, repo, path, relpath):
+    """Load a spec file of a source, in the format required by the UI.
+
+    :returns: The spec, with the git hash of the file and the provenance.
+    """
+    from .utils import cisToUI
+
+    with open(os.path.join(path, relpath), 'r') as stream:
+        model = yaml.safe_load(stream)
+
+    converted = cisToUI(model['model'])
+    converted['hash'] = str(repo.tree()[relpath])
+    converted['source'] = {
+        'name': source['name'],
+        'url': publicUrl(source['url']),
+        'branch': source['branch'],
+        'path': relpath,
+        'commit': repo.head.commit.hexsha
+    }
+    return converted
+
+
+def loadSource(source, path):
+    """Update the mirror of a source and load all of its specs.
+
+    :returns: A dict mapping the names of the specs to the specs.
+    """
+    repo = syncMirror(source, path)
+    specs = {}
+    for dirName, subdirList, fileList in os.walk(
+            os.path.join(path, source['path'])):
+        subdirList[:] = [name for name in subdirList if name != '.git']
+        for fname in fileList:
+            relpath = os.path.relpath(os.path.join(dirName, fname), path)
+            if not isSpecFile(source, relpath):
+                continue
+            try:
+                spec = loadSpecFile(source, repo, path, relpath)
+            except Exception:
+                LOGGER.exception('Cannot load spec %s of source %s',
+                                 relpath, source['name'])
+                continue
+            specs[spec['content']['name']] = spec
+    return specs
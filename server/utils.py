@@ -1,96 +1,237 @@
 # -*- coding: utf-8 -*
 """Plugin utilities."""
-from git import Repo
 import os
-import yaml
-import urllib
-import shutil
+import tempfile
+from multiprocessing.pool import ThreadPool
 from models.spec import Spec as SpecModel
 from girder.plugins.jobs.models.job import Job as JobModel
+from girder.plugins.jobs.constants import JobStatus
 
 import datetime
 import sys
+import threading
 
-from kubernetes_executor import KubernetesJob
+from girder.utility.model_importer import ModelImporter
+
+from constants import JOB_TYPE, PluginSettings
+import metrics
+import serialize
+from log import getLogger, requestContext, requestId
+from pool import pool
+from spec_cache import specCache
+from spec_sources import getSources, isSpecFile, loadSource, \
+    loadSpecFile, mirrorLock, syncMirror
+from scheduler import scheduler
+from validation import checkFbp, GraphValidationError
+from executors import getExecutor, executorForJob
+
+LOGGER = getLogger(__name__)
+
+_saveLock = threading.Lock()
+
+def createExecution(user, **otherKwargs):
+    """Create the Girder job that tracks a yggrun execution for a user.
+
+    The job runs on the configured executor and stays INACTIVE until
+    queueExecution is called with the graph.
+    """
+    username = user['login']
 
-def jupyterUserEncode(username):
-    return urllib.quote_plus(username).replace('.', '%2e').replace('-', '%2d').replace('%', '-')
-    
-def execGraph(yaml_graph, username):
-    # Write YAML graph to a file
-    #yaml_path = "graph.yaml";f = open(yaml_path,"w");f.write(yaml_graph);f.close()
-    
-    # TODO: How do we cache/lookup this execution again later? Hash the command?
-    
     # Give our job a unique name
     job_name = username + "-" + str(datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f'))
-    job_type = 'k8s.io/yggdrasil'
-    
-    # Specify the Docker image and command(s) to run
-    docker_image = "cropsinsilico/jupyterlab:latest"
-    init_command = "mkdir -p /pvc/" + job_name + " && cp -R /pvc/models/* /pvc/" + job_name + " && chown -R 1000:100 /pvc/" + job_name
-    command = "echo '" + str(yaml_graph) + "' > graph.yml && echo Running in $(pwd): && ls -al && yggrun graph.yml"
-    
-    # Encode our username with Jupyter's special homebrew recipe
-    username = jupyterUserEncode(username)
-    
-    # Job must run in same namespace as the PVC
-    namespace = "hub"
-    
-    # Specify some arbitrary limits
-    timeout = 300
-    num_cpus = 2
-    max_ram_mb = 8384
-        
-    # Create a record in the Job database
-    jobModel = JobModel()
-    job_model = jobModel.createJob(job_name, job_type, async=True, kwargs={
+    job_type = JOB_TYPE
+    executor = getExecutor()
+
+    kwargs = {
         'name': job_name,
         'type': job_type,
-        'namespace': namespace,
-        'username': username,
-        'init_command': init_command,
-        'command': command,
-        'image': docker_image,
-        'timeout': timeout,
-        'num_cpus': num_cpus,
-        'max_ram_mb': max_ram_mb,
-    })
-    
-    jobModel.save(job_model)
-    
-    # Create and run the job
-    k8s_job = KubernetesJob(username, job_name, namespace, timeout, init_command, command, docker_image, num_cpus, max_ram_mb)
-    if not k8s_job.is_running():
-        jobModel.scheduleJob(job_model)
-        k8s_job.submit()
-    
-    return job_name
-    
-def getLogs(job_name, job_type, username): 
-    # Create and run the job
-    timeout = 300
-    num_cpus = 2
-    max_ram_mb = 8384
-    job = KubernetesJob(username, job_name, "hub", timeout, None, None, None, num_cpus, max_ram_mb)
-    #if not job.is_running():
-        #return 'Job is not running'
-    #elif not job.is_done():
-        #return 'Job is still running'
-    #elif job.is_failed():
-        #return 'Job is failed'
-    #else:
-        #return job.get_error_message() 
-    return job.get_error_message()
-
-def cloneRepo(url, path, branch='master'):
-    """Use gitpython to clone the specified repo/branch."""
-    if not os.path.isdir(path):
-        repo = Repo.clone_from(url, path, branch=branch)
-    else:
-        repo = Repo(path)
-    return repo
+        'executor': executor.name,
+        'graph': None,
+        'ttl': ModelImporter.model('setting').get(PluginSettings.JOB_TTL),
+    }
+    kwargs.update(executor.jobKwargs(user, job_name))
+    kwargs.update(otherKwargs)
+
+    return JobModel().createJob(job_name, job_type, user=user, async=True,
+                                kwargs=kwargs)
+
 
+def queueExecution(job, yaml_graph):
+    """Attach the yggrun YAML to an execution job and queue it.
+
+    The job is dispatched to its executor by the scheduler, subject to the
+    configured concurrency limits.
+    """
+    jobModel = JobModel()
+    job['kwargs']['graph'] = str(yaml_graph)
+    job = jobModel.save(job)
+    job = jobModel.updateJob(job, status=JobStatus.QUEUED,
+                             progressMessage='Waiting to be scheduled')
+    scheduler.wakeup()
+    return job
+
+
+def execGraph(yaml_graph, user, **otherKwargs):
+    """Queue a yggrun execution of the graph for the given user.
+
+    Extra keyword arguments are stored in the job's kwargs.  Returns the
+    Girder job.
+    """
+    return queueExecution(createExecution(user, **otherKwargs), yaml_graph)
+
+
+def execGraphAsync(content, user):
+    """Queue an execution of an FBP graph, converting it in the background.
+
+    Conversion and validation run on the worker pool; progress and errors
+    are reported through the returned Girder job.
+    """
+    job = createExecution(user)
+    pool.submit(convertAndQueue, job, content)
+    return job
+
+
+def convertAndQueue(job, content):
+    """Convert and validate an FBP graph, then queue its execution job."""
+    jobModel = JobModel()
+    job = jobModel.updateJob(job, progressMessage='Converting graph')
+    try:
+        yaml_graph = convertFbp(content)
+    except BaseException as e:
+        jobModel.updateJob(job, status=JobStatus.ERROR,
+                           log='Invalid graph: %s\n' % e,
+                           progressMessage='Invalid graph')
+        return
+    queueExecution(job, yaml_graph)
+
+
+def convertFbp(content, loadSpec=None):
+    """Check, convert and validate an FBP graph.
+
+    Returns the YAML of the validated yggrun graph.  Raises
+    GraphValidationError listing
+    every structural problem of the graph, or the yggdrasil error if the
+    converted graph fails schema validation.  Specs are loaded with
+    loadSpec, by default from the database.
+    """
+    return validateCisYaml(_fbpToCis(content, loadSpec))
+
+
+def streamFbp(content, loadSpec=None):
+    """Check, convert and validate an FBP graph, like convertFbp.
+
+    Returns a generator function yielding the YAML of the validated yggrun
+    graph in chunks, read from the file that was validated.
+    """
+    f = _validateCis(_fbpToCis(content, loadSpec))[1]
+    return serialize.readChunks(f)
+
+
+def _fbpToCis(content, loadSpec):
+    with metrics.timer('check_fbp'):
+        errors, warnings, specs = checkFbp(content, loadSpec or findSpec)
+    for warning in warnings:
+        LOGGER.info('Graph warning: %s', warning['message'])
+    if errors:
+        raise GraphValidationError(errors, warnings)
+
+    with metrics.timer('fbp_to_cis'):
+        return fbpToCis(content, loadSpec=specs.get)
+
+
+def _validateCis(cisgraph):
+    # yggdrasil is slow to import, so defer it until the first validation
+    from yggdrasil.yamlfile import prep_yaml
+    from yggdrasil.schema import get_schema
+    from yggdrasil.backwards import as_str
+
+    cisgraph = as_str(cisgraph, recurse=True, allow_pass=True)
+
+    # prep_yaml reads files, so the graph is serialized once, to a temp
+    # file, and the same YAML is what callers send or store.  The file is
+    # returned open and already unlinked, so it is gone once closed.
+    tmpfile = tempfile.NamedTemporaryFile(mode='w+', suffix='.yml',
+                                          prefix='cis', delete=False)
+    try:
+        try:
+            with metrics.timer('yaml_dump'):
+                serialize.writeYaml(cisgraph, tmpfile)
+            tmpfile.flush()
+            with metrics.timer('prep_yaml'):
+                yml_prep = prep_yaml(tmpfile.name)
+        finally:
+            os.remove(tmpfile.name)
+
+        s = get_schema()
+        with metrics.timer('schema_normalize'):
+            yml_norm = s.normalize(yml_prep)
+        with metrics.timer('schema_validate'):
+            s.validate(yml_norm)
+    except BaseException:
+        tmpfile.close()
+        raise
+    tmpfile.seek(0)
+    return cisgraph, tmpfile
+
+
+def validateCis(cisgraph):
+    """Validate a yggrun graph or model against the yggdrasil schema.
+
+    Returns the input with all strings converted to native strings; raises
+    if validation fails.
+    """
+    cisgraph, f = _validateCis(cisgraph)
+    f.close()
+    return cisgraph
+
+
+def validateCisYaml(cisgraph):
+    """Validate a yggrun graph or model and return the YAML validated.
+
+    Raises if validation fails.
+    """
+    with _validateCis(cisgraph)[1] as f:
+        return f.read()
+
+
+def listExecutions(user, limit=50, continue_token=None):
+    """List a page of a user's executions known to the configured executor.
+
+    The Kubernetes executor selects jobs by the owner label added at submit
+    time, so the cost does not depend on the number of other users' jobs.
+    Returns the page and the token for the next one.
+    """
+    items, continue_token = getExecutor().list(user, limit, continue_token)
+
+    names = [item['name'] for item in items]
+    jobIds = {}
+    for job in JobModel().find({'title': {'$in': names}, 'userId': user['_id']},
+                               fields=['title']):
+        jobIds[job['title']] = job['_id']
+
+    executions = [{
+        'name': item['name'],
+        'created': item['created'],
+        'jobId': jobIds.get(item['name'])
+    } for item in items]
+    return executions, continue_token
+
+
+def getWorkspace(job):
+    """Return the path of an execution's workspace on this host, or None."""
+    return executorForJob(job).workspace(job)
+
+
+def getLogs(job):
+    """Return the logs of an execution.
+
+    Logs of finished jobs are read from the archive on the Girder job.
+    """
+    if job['status'] in (JobStatus.INACTIVE, JobStatus.QUEUED):
+        return 'Waiting for the job to be scheduled...'
+    if job['status'] != JobStatus.RUNNING:
+        return ''.join(job.get('log', []))
+    return executorForJob(job).logs(job)
 
 def cisToUI(cismodel):
     """Convert from yggrun to UI format."""
@@ -125,6 +266,46 @@ def uiToCis(uimodel):
     return {"model": cismodel}
 
 
+def precomputeSpec(spec):
+    """Store the yggrun form of a spec on it, validated once.
+
+    'cis' holds the yggrun model, 'cisErrors' the reasons it failed
+    conversion or schema validation, if it did, and 'cisHash' the hash of
+    the content they were computed from.  They are only recomputed when the
+    content changes.
+    """
+    from conversion import contentHash
+
+    digest = contentHash(spec['content'])
+    if spec.get('cisHash') == digest and 'cis' in spec:
+        return spec
+
+    spec['cisHash'] = digest
+    spec['cisErrors'] = []
+    try:
+        spec['cis'] = uiToCis(spec['content'])['model']
+    except Exception as e:
+        spec['cis'] = None
+        spec['cisErrors'] = [str(e)]
+        return spec
+    try:
+        spec['cis'] = validateCis({'model': spec['cis']})['model']
+    except BaseException as e:
+        LOGGER.info('Invalid spec %s: %s', spec['content'].get('name'), e)
+        spec['cisErrors'] = [str(e)]
+    return spec
+
+
+def specModel(spec):
+    """Return the yggrun model of a spec.
+
+    The form precomputed when the spec was saved is used if there is one.
+    """
+    if spec.get('cis') is not None:
+        return dict(spec['cis'])
+    return uiToCis(spec['content'])['model']
+
+
 def convertPortsToPuts(ports):
     """Convert UI inports/outports to yggrun inputs/output."""
     puts = []
@@ -146,34 +327,6 @@ def convertInputsToPorts(inputs):
     return ports
 
 
-def loadSpecs(repo, path):
-    """Load model specs from the specified temporary path.
-
-    Convert from the yggrun YAML to the flow-based-protocol format required
-    for UI.  The "content" nested dict is a convention used for storing
-    these objects as blobs in Girder.
-    """
-    specs = {}
-    for dirName, subdirList, fileList in os.walk(path + "/models"):
-
-        if dirName.endswith(".git"):
-            pass
-
-        for fname in fileList:
-            relpath = os.path.relpath(dirName + "/" + fname, path)
-
-            model = {}
-            with open(dirName + "/" + fname, 'r') as stream:
-                model = yaml.load(stream)
-
-            # Convert to format expected by UI
-            converted = cisToUI(model['model'])
-            if repo is not None:
-                converted['hash'] = str(repo.tree()[relpath])
-
-            specs[converted['content']['name']] = converted
-    return specs
-
 def get_label_or_name(obj, use_metadata=True):
     if obj is None:
         return None
@@ -184,7 +337,7 @@ def get_label_or_name(obj, use_metadata=True):
 
     
 def get_graph_port_label_by_name(ports, name):
-    print('Searching %s for %s' % (str(ports), name))
+    LOGGER.debug('Searching %s for %s', ports, name)
     ret = None
     for key,port in ports:
         if port['name'].lower() == name.lower():
@@ -192,8 +345,18 @@ def get_graph_port_label_by_name(ports, name):
             break
     return ret
 
-def fbpToCis(data):
-    """ Given a flow-based-protocol graph, return in CIS format."""
+def findSpec(name):
+    """Load the spec of a component, from the spec cache if possible."""
+    with metrics.timer('spec_query'):
+        return specCache.byName(name)
+
+
+def fbpToCis(data, loadSpec=findSpec):
+    """ Given a flow-based-protocol graph, return in CIS format.
+
+    Specs of the graph's components are looked up with loadSpec, which
+    takes a component name and returns its spec document.
+    """
     inports = {}
     outports = {}
     models = {}
@@ -212,20 +375,20 @@ def fbpToCis(data):
                port['method']  = process['metadata']['write_meth']
                outports[key] = port
         else:
-            spec = SpecModel().findOne({'content.name': component})
+            spec = loadSpec(component)
             for inport in spec['content']['inports']:
                 port = {}
                 port['name'] = inport['name']
                 port['label'] = inport['label']
                 inports[port['name']] = port
-            print(inports)                
+            LOGGER.debug('Inports: %s', inports)
             for outport in spec['content']['outports']:
                 port = {}
                 port['name'] = outport['name']
                 port['label'] = outport['label']
                 outports[port['name']] = port
-            print(outports)                 
-            models[key] = uiToCis(spec['content'])['model']
+            LOGGER.debug('Outports: %s', outports)
+            models[key] = specModel(spec)
     
 
     graph_ports = inports.items() + outports.items()
@@ -247,11 +410,11 @@ def fbpToCis(data):
            conn['filetype'] = outports[tgtkey]['method']
            conn['output'] = outports[tgtkey]['path']
         else:
-           print('Finding source_port: ' + str(connection['src']['port']))
+           LOGGER.debug('Finding source_port: %s', connection['src']['port'])
            source_port = get_graph_port_label_by_name(graph_ports, connection['src']['port'])
            conn['input'] = source_port['label']
            
-           print('Finding target_port: ' + str(connection['tgt']['port']))
+           LOGGER.debug('Finding target_port: %s', connection['tgt']['port'])
            target_port = get_graph_port_label_by_name(graph_ports, connection['tgt']['port']) 
            conn['output'] = target_port['label']
            #conn['input'] = connection['src']['port']
@@ -271,52 +434,135 @@ def fbpToCis(data):
     return { "models": models.values(), "connections": conns }
 
 
-def ingest():
-    """Given a repo of specs, clone the repo and ingest into Girder.
+def saveSpecs(source, gitspecs, priorities):
+    """Save the specs loaded from a source whose git hash changed.
 
-    Use the git object hash to determine whether the spec has changed.
+    A spec ingested from a source listed before this one is left alone.
+    Saves of concurrent ingests run one at a time, so that they do not
+    both create a spec.
+
+    :param priorities: The position of every source in the setting.
+    :returns: The names of the specs created or updated.
     """
-    # TODO: Parameterize these in the plugin configuration
-    url = "https://github.com/cropsinsilico/cis-specs"
-    path = "/tmp/cis-specs"
-    branch = "master"
-
-    repo = cloneRepo(url, path, branch)
-    gitspecs = loadSpecs(repo, path)
-
-    specs = {}
-    # Delete specs that are not in github
-    #for spec in SpecModel().find({}):
-    #    if 'public' not in spec or not spec['public']:
-    #        pass
-    #    name = spec['content']['name']
-    #    specs[name] = spec
-    #    if name not in gitspecs:
-    #        SpecModel().remove(spec)
-    #        print("Spec %s removed from github, deleting" % name)
-
-    for key, gitspec in gitspecs.items():
-        name = gitspec['content']['name']
-
-        gitspec = gitspecs[name]
+    with _saveLock:
+        return _saveSpecs(source, gitspecs, priorities)
+
+
+def _saveSpecs(source, gitspecs, priorities):
+    changed = []
+    for name, gitspec in gitspecs.items():
         spec = SpecModel().findOne({'content.name': name})
         if spec is not None:
-            if 'hash' in spec and spec['hash'] != gitspec['hash']:
-                print("Hash changed for spec %s, updating" % name)
+            owner = spec.get('source', {}).get('name')
+            if priorities.get(owner, len(priorities)) < \
+                    priorities[source['name']]:
+                LOGGER.debug('Spec %s comes from source %s, not updating',
+                             name, owner)
+            elif 'hash' in spec and spec['hash'] != gitspec['hash']:
+                LOGGER.info("Hash changed for spec %s, updating", name)
                 spec['content'] = gitspec['content']
                 spec['hash'] = gitspec['hash']
-                SpecModel().setPublic(spec, True, save=False)
+                spec['source'] = gitspec['source']
+                SpecModel().setPublic(spec, source['public'], save=False)
                 SpecModel().save(spec)
+                changed.append(name)
             else:
-                print("Hash identical, not updating spec %s" % name)
+                LOGGER.debug("Hash identical, not updating spec %s", name)
 
         else:
-            print("New spec %s, creating" % name)
+            LOGGER.info("New spec %s from source %s, creating", name,
+                        source['name'])
             spec = {}
             spec['content'] = gitspec['content']
             spec['hash'] = gitspec['hash']
-            SpecModel().setPublic(spec, True, save=False)
+            spec['source'] = gitspec['source']
+            SpecModel().setPublic(spec, source['public'], save=False)
             SpecModel().save(spec)
+            changed.append(name)
+    return changed
+
+
+def _sourcePriorities():
+    return dict((source['name'], i) for i, source in enumerate(getSources()))
+
+
+def _loadFiles(source, path, paths):
+    repo = syncMirror(source, path)
+    gitspecs = {}
+    for relpath in sorted(paths):
+        if not isSpecFile(source, relpath) or \
+                not os.path.isfile(os.path.join(path, relpath)):
+            continue
+        try:
+            spec = loadSpecFile(source, repo, path, relpath)
+        except Exception:
+            LOGGER.exception('Cannot load spec %s of source %s',
+                             relpath, source['name'])
+            continue
+        gitspecs[spec['content']['name']] = spec
+    return gitspecs
+
+
+def _ingestSource(source, paths, priorities):
+    """Update the mirror of a source and save its changed specs.
 
-    # Remove the temporary path
-    shutil.rmtree(path)
+    The mirror is locked meanwhile, so that other ingests of the source wait.
+    """
+    with mirrorLock(source) as path:
+        with metrics.timer('ingest_source'):
+            if paths is None:
+                gitspecs = loadSource(source, path)
+            else:
+                gitspecs = _loadFiles(source, path, paths)
+        return saveSpecs(source, gitspecs, priorities)
+
+
+def ingestFiles(source, paths):
+    """Ingest some spec files of a source into Girder.
+
+    The mirror of the source is updated first; listed files that are not
+    spec files of the source, or no longer exist, are skipped.
+
+    :param paths: The paths of the files in the repository, or None to
+        ingest all the specs of the source.
+    :returns: The names of the specs created or updated.
+    """
+    return _ingestSource(source, paths, _sourcePriorities())
+
+
+def ingest(sources=None):
+    """Ingest the specs of the configured git repositories into Girder.
+
+    The mirrors of the sources are updated and read concurrently, and the
+    specs of each source are saved as soon as it is loaded, so a slow
+    repository does not hold up the others.  Each source is ingested under
+    the lock of its mirror, like webhook ingests.  The git object hash is
+    used to determine whether a spec has changed.  The saved graphs using
+    changed specs are revalidated in the background.
+
+    :param sources: The sources to ingest, by default all of them.
+    :returns: The names of the specs created or updated.
+    """
+    priorities = _sourcePriorities()
+    if sources is None:
+        sources = getSources()
+    taskId = requestId()
+
+    def ingestSource(source):
+        with requestContext(taskId):
+            try:
+                return _ingestSource(source, None, priorities)
+            except Exception:
+                LOGGER.exception('Cannot ingest spec source %s',
+                                 source['name'])
+                return []
+
+    changed = []
+    threads = ThreadPool(max(len(sources), 1))
+    try:
+        for names in threads.imap_unordered(ingestSource, sources):
+            changed.extend(names)
+    finally:
+        threads.close()
+        threads.join()
+    return changed
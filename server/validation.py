@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*
+"""Structural validation of FBP graphs.
+
+The whole graph is checked in one pass before conversion, so that every
+problem is reported at once rather than as the first exception raised by
+fbpToCis.  Processes, specs and ports are indexed first, after which each
+connection is checked in constant time; cycles are found with a
+topological sort.  The cost is linear in the size of the graph, with one
+spec lookup per distinct component.
+"""
+
+import collections
+
+import six
+
+FILE_COMPONENTS = ('inport', 'outport')
+
+# Metadata fbpToCis reads from graph input and output ports
+FILE_METADATA = {
+    'inport': ('label', 'name', 'type', 'read_meth'),
+    'outport': ('label', 'name', 'type', 'write_meth'),
+}
+
+# Port type accepted by any other type
+ANY_TYPE = 'all'
+
+
+class GraphValidationError(Exception):
+    """Raised when an FBP graph fails structural validation."""
+
+    def __init__(self, errors, warnings=None):
+        super(GraphValidationError, self).__init__(
+            '\n'.join(error['message'] for error in errors))
+        self.errors = errors
+        self.warnings = warnings or []
+
+
+def _issue(code, message, **context):
+    issue = {'code': code, 'message': message}
+    issue.update(context)
+    return issue
+
+
+def _portIndex(ports):
+    """Index a spec's ports by lower case name."""
+    return dict((port['name'].lower(), port) for port in ports or [])
+
+
+def _peel(nodes, successors):
+    """Repeatedly remove nodes without predecessors; return the rest."""
+    indegree = collections.Counter()
+    for node in nodes:
+        for succ in successors[node]:
+            if succ in nodes:
+                indegree[succ] += 1
+
+    ready = collections.deque(node for node in nodes if not indegree[node])
+    remaining = set(nodes)
+    while ready:
+        node = ready.popleft()
+        remaining.discard(node)
+        for succ in successors[node]:
+            if succ in remaining:
+                indegree[succ] -= 1
+                if not indegree[succ]:
+                    ready.append(succ)
+    return remaining
+
+
+def _findCycles(processes, edges):
+    """Return the processes that lie on a cycle.
+
+    A topological sort removes everything upstream of the cycles, and a
+    second one over the reversed edges everything downstream.
+    """
+    successors = collections.defaultdict(set)
+    predecessors = collections.defaultdict(set)
+    for src, tgt in edges:
+        successors[src].add(tgt)
+        predecessors[tgt].add(src)
+    return sorted(_peel(_peel(set(processes), successors), predecessors))
+
+
+def checkFbp(data, loadSpec):
+    """Check an FBP graph for structural errors.
+
+    :param data: The FBP graph.
+    :param loadSpec: Callable returning the spec document of a component
+        name, or None if there is none.
+    :returns: The lists of errors and of warnings, and a dict of the loaded
+        specs by component name.  Each error and warning is a dict with a
+        'code', a 'message' and the 'process' or 'connection' it concerns.
+    """
+    errors = []
+    warnings = []
+    specs = {}
+
+    if not isinstance(data, dict) or \
+            not isinstance(data.get('processes'), dict) or \
+            not isinstance(data.get('connections'), list):
+        errors.append(_issue(
+            'malformedGraph',
+            'The graph must have a processes object and a connections list'))
+        return errors, warnings, specs
+
+    # Index the processes and the ports of their specs
+    inports = {}
+    outports = {}
+    for key, process in six.iteritems(data['processes']):
+        component = process.get('component')
+        metadata = process.get('metadata') or {}
+        if component in FILE_COMPONENTS:
+            missing = [field for field in FILE_METADATA[component]
+                       if not metadata.get(field)]
+            if missing:
+                errors.append(_issue(
+                    'missingMetadata',
+                    'Process %s is missing %s' % (key, ', '.join(missing)),
+                    process=key))
+            continue
+
+        if component not in specs:
+            specs[component] = loadSpec(component) if component else None
+        spec = specs[component]
+        if spec is None:
+            errors.append(_issue(
+                'unknownComponent',
+                'Process %s uses unknown component %s' % (key, component),
+                process=key))
+            continue
+        inports[key] = _portIndex(spec['content'].get('inports'))
+        outports[key] = _portIndex(spec['content'].get('outports'))
+
+    # Two models may not read from, or write to, the same channel
+    for direction, index in (('input', inports), ('output', outports)):
+        owners = collections.defaultdict(list)
+        for key, ports in six.iteritems(index):
+            for port in six.itervalues(ports):
+                owners[port.get('label', port['name']).lower()].append(key)
+        for label, keys in sorted(six.iteritems(owners)):
+            if len(keys) > 1:
+                errors.append(_issue(
+                    'duplicatePortLabel',
+                    'Processes %s share the %s %s' % (
+                        ', '.join(sorted(keys)), direction, label),
+                    processes=sorted(keys)))
+
+    edges = []
+    for i, connection in enumerate(data['connections']):
+        try:
+            src = connection['src']['process']
+            srcPort = connection['src']['port']
+            tgt = connection['tgt']['process']
+            tgtPort = connection['tgt']['port']
+        except (KeyError, TypeError):
+            errors.append(_issue(
+                'malformedConnection',
+                'Connection %d needs a source and a target process and '
+                'port' % i, connection=i))
+            continue
+
+        dangling = [key for key in (src, tgt)
+                    if key not in data['processes']]
+        if dangling:
+            errors.append(_issue(
+                'danglingConnection',
+                'Connection %d refers to missing process %s' % (
+                    i, ', '.join(dangling)), connection=i))
+            continue
+
+        srcComponent = data['processes'][src].get('component')
+        tgtComponent = data['processes'][tgt].get('component')
+        if srcComponent == 'outport' or tgtComponent == 'inport':
+            errors.append(_issue(
+                'invalidDirection',
+                'Connection %d flows into a graph input or out of a graph '
+                'output' % i, connection=i))
+            continue
+        if srcComponent == 'inport' and tgtComponent == 'outport':
+            errors.append(_issue(
+                'invalidDirection',
+                'Connection %d joins a graph input directly to a graph '
+                'output' % i, connection=i))
+            continue
+
+        source = target = None
+        if src in outports:
+            source = outports[src].get(srcPort.lower())
+            if source is None:
+                errors.append(_issue(
+                    'unknownPort',
+                    'Connection %d: process %s has no output %s' % (
+                        i, src, srcPort), connection=i, process=src))
+        if tgt in inports:
+            target = inports[tgt].get(tgtPort.lower())
+            if target is None:
+                errors.append(_issue(
+                    'unknownPort',
+                    'Connection %d: process %s has no input %s' % (
+                        i, tgt, tgtPort), connection=i, process=tgt))
+
+        if source is not None and target is not None:
+            sourceType = source.get('type', ANY_TYPE)
+            targetType = target.get('type', ANY_TYPE)
+            if ANY_TYPE not in (sourceType, targetType) and \
+                    sourceType != targetType:
+                errors.append(_issue(
+                    'typeMismatch',
+                    'Connection %d joins output %s of type %s to input %s '
+                    'of type %s' % (i, srcPort, sourceType, tgtPort,
+                                    targetType), connection=i))
+            edges.append((src, tgt))
+
+    # Feedback loops are legitimate in yggdrasil, so cycles only warn
+    cycle = _findCycles(inports, edges)
+    if cycle:
+        warnings.append(_issue(
+            'cycle', 'Processes %s form a cycle' % ', '.join(cycle),
+            processes=cycle))
+
+    return errors, warnings, specs
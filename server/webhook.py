@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*
+"""GitHub push webhooks that re-ingest the spec files a push changed.
+
+A push to the branch of a spec source schedules the ingest of the spec
+files its commits added or modified.  Ingests are debounced per source: a
+burst of pushes is ingested once, DEBOUNCE_SECONDS after the last of
+them, with the files of all the pushes.  Forced pushes, and pushes whose
+changed files are not listed, re-ingest the whole source.
+
+Payloads are authenticated with the HMAC signature GitHub computes with
+the secret of the cis.webhook_secret setting.
+"""
+
+import hashlib
+import hmac
+import re
+import threading
+
+from .log import getLogger, requestContext, requestId
+from .spec_sources import isSpecFile
+
+LOGGER = getLogger(__name__)
+
+# Seconds to wait after a push for further pushes to the same source
+DEBOUNCE_SECONDS = 5.0
+
+SIGNATURE_HEADERS = (
+    ('X-Hub-Signature-256', 'sha256', hashlib.sha256),
+    ('X-Hub-Signature', 'sha1', hashlib.sha1),
+)
+
+
+def verifySignature(secret, body, headers):
+    """Check the signature of a webhook payload.
+
+    :param secret: The shared secret.
+    :param body: The raw request body.
+    :param headers: The request headers.
+    :returns: Whether the payload was signed with the secret.
+    """
+    for header, name, algorithm in SIGNATURE_HEADERS:
+        signature = headers.get(header)
+        if signature:
+            prefix, _, value = str(signature).partition('=')
+            digest = hmac.new(secret.encode('utf8'), body,
+                              algorithm).hexdigest()
+            return prefix == name and hmac.compare_digest(digest, value)
+    return False
+
+
+def normalizeUrl(url):
+    """Reduce a git URL to host and path, to compare repositories."""
+    url = url.strip().lower()
+    url = re.sub(r'^[a-z+]+://', '', url)
+    url = re.sub(r'^[^@/]+@', '', url)
+    url = re.sub(r'^([^/:]+):(?!\d)', r'\1/', url)
+    url = url.rstrip('/')
+    if url.endswith('.git'):
+        url = url[:-4]
+    return url
+
+
+def matchSources(payload, sources):
+    """Return the sources a push payload updates."""
+    repository = payload.get('repository') or {}
+    urls = set(normalizeUrl(repository[key]) for key in (
+        'clone_url', 'html_url', 'ssh_url', 'git_url', 'url')
+        if repository.get(key))
+    ref = payload.get('ref')
+    return [source for source in sources
+            if normalizeUrl(source['url']) in urls and
+            ref == 'refs/heads/' + source['branch']]
+
+
+def changedFiles(payload):
+    """Return the files the commits of a push added or modified.
+
+    :returns: A set of paths, or None if the whole repository must be
+        ingested again.
+    """
+    commits = payload.get('commits')
+    if payload.get('forced') or commits is None:
+        return None
+    paths = set()
+    for commit in commits:
+        paths.update(commit.get('added') or [])
+        paths.update(commit.get('modified') or [])
+    return paths
+
+
+class IngestDebouncer(object):
+    """Runs the ingest of each source once after a burst of pushes."""
+
+    def __init__(self, ingestFiles, delay=DEBOUNCE_SECONDS):
+        """Initialize the debouncer.
+
+        :param ingestFiles: Called with a source and the set of its files
+            to ingest, or None for all of them.
+        :param delay: Seconds to wait for further pushes.
+        """
+        self._ingestFiles = ingestFiles
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timers = {}
+
+    def schedule(self, source, paths):
+        """Schedule the ingest of files of a source, or of all with None."""
+        name = source['name']
+        with self._lock:
+            if name in self._pending:
+                pending = self._pending[name][1]
+                if pending is None or paths is None:
+                    paths = None
+                else:
+                    paths = pending | set(paths)
+            elif paths is not None:
+                paths = set(paths)
+            self._pending[name] = (source, paths)
+
+            timer = self._timers.pop(name, None)
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(self.delay, self._run,
+                                    args=(name, requestId()))
+            timer.daemon = True
+            self._timers[name] = timer
+            timer.start()
+
+    def pending(self):
+        """Return the names of the sources waiting to be ingested."""
+        with self._lock:
+            return sorted(self._pending)
+
+    def _run(self, name, taskId):
+        with self._lock:
+            entry = self._pending.pop(name, None)
+            self._timers.pop(name, None)
+        if entry is None:
+            return []
+        source, paths = entry
+        # ingestFiles waits for other ingests of the source, which share
+        # its mirror
+        with requestContext(taskId):
+            try:
+                return self._ingestFiles(source, paths)
+            except Exception:
+                LOGGER.exception('Cannot ingest spec source %s', name)
+                return []
+
+    def flush(self):
+        """Run the pending ingests now, in the calling thread.
+
+        :returns: The names of the specs created or updated.
+        """
+        with self._lock:
+            names = sorted(self._pending)
+            for name in names:
+                timer = self._timers.get(name)
+                if timer is not None:
+                    timer.cancel()
+        changed = []
+        for name in names:
+            changed.extend(self._run(name, requestId()))
+        return changed
+
+
+def _ingestFiles(source, paths):
+    from .utils import ingestFiles
+
+    return ingestFiles(source, paths)
+
+
+debouncer = IngestDebouncer(_ingestFiles)
+
+
+def handlePush(payload, sources):
+    """Schedule the ingest of the spec files changed by a push.
+
+    :returns: The sources whose ingest was scheduled.
+    """
+    paths = changedFiles(payload)
+    scheduled = []
+    for source in matchSources(payload, sources):
+        if paths is None:
+            debouncer.schedule(source, None)
+        else:
+            specFiles = set(path for path in paths
+                            if isSpecFile(source, path))
+            if not specFiles:
+                continue
+            debouncer.schedule(source, specFiles)
+        scheduled.append(source)
+    LOGGER.info('Push to %s scheduled the ingest of %d sources',
+                payload.get('ref'), len(scheduled))
+    return scheduled